@@ -0,0 +1,86 @@
+# runs the firmware's benchmark suite on the host, printing to the
+# simulated parallel, serial and network printers
+#
+#   python sim/bench.py --output results.json
+#   python sim/bench.py --capture my.cap --protocol escp --port parallel --rate 2000
+#
+# the heap and gc figures only mean something on the device, as cpython
+# neither has micropython's heap nor collects the same way.
+
+import os
+import sys
+import json
+import shutil
+import asyncio
+import argparse
+import tempfile
+
+import run
+import host
+
+def getparser():
+    parser = argparse.ArgumentParser("bench", description="Pico ZX Printer host benchmarks")
+    parser.add_argument("--capture", action="append", default=[], help="capture to benchmark, testprintout.cap by default")
+    parser.add_argument("--protocol", action="append", choices=["escp", "escpr"], help="protocols to print with, all by default")
+    parser.add_argument("--port", action="append", choices=["null", "parallel", "serial", "network"], help="ports to print to, all by default")
+    parser.add_argument("--rate", type=int, help="printer speed in bytes per second")
+    parser.add_argument("--busy", type=run.parsebusy, help="printer goes busy, as BYTES:MS")
+    parser.add_argument("--output", help="file to write the results to, rather than stdout")
+    parser.add_argument("--traceheap", action="store_true", help="track python allocations as the heap")
+    return parser
+
+# captures are copied onto the flash so the firmware can open them
+def loadcaptures(filenames):
+    captures = []
+    for filename in filenames:
+        name = os.path.basename(filename)
+        shutil.copyfile(filename, f"{host.root}/{name}")
+        captures.append(f"/{name}")
+    return captures
+
+async def benchmark(args):
+    import network
+    import ports
+
+    network.enablewifi(True)
+    options = {"rate": args.rate}
+    if args.busy:
+        options["busyevery"], options["busyms"] = args.busy
+    printers = [ports.ParallelPrinter(**options), ports.SerialPrinter(**options), ports.NetworkPrinter(**options)]
+    await printers[-1].start()
+
+    import networkprinter
+    import services
+
+    networkprinter.setaddress("127.0.0.1")
+    try:
+        results = await services.runbenchmark(
+            ",".join(loadcaptures(args.capture)),
+            ",".join(args.protocol or ["escp", "escpr"]),
+            ",".join(args.port or ["null", "parallel", "serial", "network"]))
+    finally:
+        printers[-1].stop()
+    results["host"] = sys.implementation.name
+    return results
+
+def main():
+    args = getparser().parse_args()
+    flash = tempfile.mkdtemp(prefix="zxflash")
+    host.install(flash, (run.firmwarepath, run.webpath), args.traceheap)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        results = loop.run_until_complete(benchmark(args))
+    finally:
+        run.shutdown(loop)
+        host.cleanup()
+        shutil.rmtree(flash, ignore_errors=True)
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(results, fp, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+# stand-in for the deflate module using zlib, compression only
+
+import zlib
+
+RAW = 0
+ZLIB = 1
+GZIP = 2
+AUTO = 3
+
+_wbits = {RAW: -15, ZLIB: 15, GZIP: 31}
+
+class DeflateIO:
+    def __init__(self, stream, format=AUTO, wbits=0, close=False):
+        self.stream = stream
+        self.closestream = close
+        self.compressor = zlib.compressobj(wbits=_wbits.get(format, 15))
+
+    def write(self, buf):
+        self.stream.write(self.compressor.compress(bytes(buf)))
+        return len(buf)
+
+    def close(self):
+        self.stream.write(self.compressor.flush())
+        if self.closestream:
+            self.stream.close()
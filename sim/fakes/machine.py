@@ -0,0 +1,204 @@
+# stand-in for the rp2 port's machine module
+
+import time
+import asyncio
+
+# registers read back whatever the simulation has preset, writes are
+# ignored so busy loops on self-clearing registers finish straight away
+class _Memory:
+    def __init__(self):
+        self.registers = {}
+
+    def __getitem__(self, address):
+        return self.registers.get(address, 0)
+
+    def __setitem__(self, address, value):
+        pass
+
+mem8 = _Memory()
+mem16 = _Memory()
+mem32 = _Memory()
+
+USBCTRL_SIE_STATUS = 0x50110050
+USB_CONNECTED = 1<<16
+
+def setusbconnected(connected):
+    if connected:
+        mem32.registers[USBCTRL_SIE_STATUS] = USB_CONNECTED
+    else:
+        mem32.registers.pop(USBCTRL_SIE_STATUS, None)
+
+def freq(value=None):
+    return 125_000_000
+
+def unique_id():
+    return b"\xe6\x61\x38\x52\x83\x5e\x1d\x2c"
+
+def reset():
+    raise SystemExit("machine.reset()")
+
+def soft_reset():
+    raise SystemExit("machine.soft_reset()")
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_RISING = 4
+    IRQ_FALLING = 8
+
+    levels = {}         # pin id -> level, for inputs driven by the simulation
+    _pins = {}
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+        self.handler = None
+        self.trigger = 0
+        Pin._pins.setdefault(id, []).append(self)
+        self.init(mode, pull, value)
+
+    def init(self, mode=-1, pull=-1, value=None):
+        if mode != -1:
+            self.mode = mode
+        if pull != -1:
+            self.pull = pull
+            if self.id not in Pin.levels:
+                Pin.levels[self.id] = 1 if pull == Pin.PULL_UP else 0
+        if value is not None:
+            Pin.levels[self.id] = value
+
+    def value(self, value=None):
+        if value is None:
+            return Pin.levels.get(self.id, 0)
+        Pin.levels[self.id] = value
+
+    def __call__(self, value=None):
+        return self.value(value)
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING, hard=False):
+        self.handler = handler
+        self.trigger = trigger
+
+    # changes an input level from the simulation, running any irq handlers
+    @staticmethod
+    def drive(id, level):
+        previous = Pin.levels.get(id, 0)
+        Pin.levels[id] = level
+        if previous == level:
+            return
+        edge = Pin.IRQ_RISING if level else Pin.IRQ_FALLING
+        for pin in Pin._pins.get(id, []):
+            if pin.handler is not None and pin.trigger & edge:
+                pin.handler(pin)
+
+class Timer:
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, id=-1, **kwargs):
+        self._handle = None
+        if kwargs:
+            self.init(**kwargs)
+
+    def init(self, mode=PERIODIC, period=-1, freq=None, callback=None):
+        self.deinit()
+        if freq is not None:
+            period = 1000 // freq
+        self._mode = mode
+        self._period = max(period, 1) / 1000
+        self._callback = callback
+        self._schedule()
+
+    def _schedule(self):
+        loop = asyncio.get_event_loop()
+        self._handle = loop.call_later(self._period, self._fire)
+
+    def _fire(self):
+        self._handle = None
+        if self._mode == Timer.PERIODIC:
+            self._schedule()
+        if self._callback is not None:
+            self._callback(self)
+
+    def deinit(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+class RTC:
+    def datetime(self, value=None):
+        if value is not None:
+            return
+        now = time.localtime()
+        return (now[0], now[1], now[2], now[6], now[3], now[4], now[5], 0)
+
+class SPI:
+    def __init__(self, id, baudrate=1_000_000, **kwargs):
+        self.id = id
+        self.baudrate = baudrate
+
+    def init(self, baudrate=None, **kwargs):
+        if baudrate is not None:
+            self.baudrate = baudrate
+
+    def write(self, buf):
+        pass
+
+    def read(self, nbytes, write=0xff):
+        return bytes([0xff]*nbytes)
+
+    def readinto(self, buf, write=0xff):
+        for index in range(len(buf)):
+            buf[index] = 0xff
+
+    def write_readinto(self, write, read):
+        self.readinto(read)
+
+# a uart whose transmitted bytes go to a sink set by the simulation, which
+# decides how many it accepts on each write
+class UART:
+    CTS = 1
+    RTS = 2
+
+    sinks = {}          # uart id -> sink
+
+    def __init__(self, id, baudrate=115200, **kwargs):
+        self.id = id
+        self.settings = {}
+        self.rx = bytearray()
+        self.init(baudrate=baudrate, **kwargs)
+
+    def init(self, **kwargs):
+        self.settings.update(kwargs)
+
+    def write(self, buf):
+        sink = UART.sinks.get(self.id)
+        if sink is None:
+            return len(buf)
+        return sink.accept(buf)
+
+    def any(self):
+        return len(self.rx)
+
+    def read(self, nbytes=None):
+        if not self.rx:
+            return None
+        nbytes = len(self.rx) if nbytes is None else min(nbytes, len(self.rx))
+        data = bytes(self.rx[:nbytes])
+        del self.rx[:nbytes]
+        return data
+
+    def readinto(self, buf, nbytes=None):
+        data = self.read(len(buf) if nbytes is None else nbytes)
+        if data is None:
+            return None
+        buf[:len(data)] = data
+        return len(data)
@@ -0,0 +1,32 @@
+# stand-in for the micropython module on cpython. viper and native code runs
+# as plain python, and the few asm_thumb functions are swapped for the
+# python versions in thumb.py
+
+import thumb
+
+def const(value):
+    return value
+
+def native(function):
+    return function
+
+def viper(function):
+    return function
+
+def asm_thumb(function):
+    replacement = thumb.functions.get(function.__name__)
+    if replacement is None:
+        raise NotImplementedError(f"No host version of asm_thumb function '{function.__name__}'")
+    return replacement
+
+def mem_info(verbose=False):
+    pass
+
+def opt_level(level=None):
+    return 0
+
+def alloc_emergency_exception_buf(size):
+    pass
+
+def schedule(function, arg):
+    function(arg)
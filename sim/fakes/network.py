@@ -0,0 +1,67 @@
+# stand-in for the network module. WLAN is only there once the simulation
+# calls enablewifi, matching a Pico without wireless by default
+
+import socket
+
+STA_IF = 0
+AP_IF = 1
+
+STAT_IDLE = 0
+STAT_CONNECTING = 1
+STAT_WRONG_PASSWORD = -3
+STAT_NO_AP_FOUND = -2
+STAT_CONNECT_FAIL = -1
+STAT_GOT_IP = 3
+
+_hostname = "zxprinter"
+
+def hostname(name=None):
+    global _hostname
+
+    if name is None:
+        return _hostname
+    _hostname = name
+
+class _WLAN:
+    _connected = False
+    _ssid = None
+
+    def __init__(self, interface=STA_IF):
+        self.interface = interface
+
+    def active(self, state=None):
+        return True
+
+    def connect(self, ssid=None, key=None):
+        _WLAN._ssid = ssid
+        _WLAN._connected = True
+
+    def disconnect(self):
+        _WLAN._connected = False
+
+    def isconnected(self):
+        return _WLAN._connected
+
+    def status(self, param=None):
+        if param == "rssi":
+            return -50
+        return STAT_GOT_IP if _WLAN._connected else STAT_IDLE
+
+    def ifconfig(self):
+        return ("127.0.0.1", "255.0.0.0", "127.0.0.1", "127.0.0.1")
+
+    def config(self, param):
+        if param == "mac":
+            return b"\x28\xcd\xc1\x00\x00\x01"
+        if param == "ssid":
+            return _WLAN._ssid
+        return None
+
+    def scan(self):
+        return [(b"zxnet", b"\x00\x00\x00\x00\x00\x01", 6, -50, 3, False)]
+
+def enablewifi(enabled=True):
+    if enabled:
+        globals()["WLAN"] = _WLAN
+    else:
+        globals().pop("WLAN", None)
@@ -0,0 +1,10 @@
+# stand-in for ntptime, the host clock is already right
+
+host = "pool.ntp.org"
+
+def settime():
+    pass
+
+def time():
+    import time as _time
+    return int(_time.time())
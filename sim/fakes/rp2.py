@@ -0,0 +1,168 @@
+# stand-in for the rp2 module. pio programs aren't run, instead dma
+# transfers to or from a pio fifo address are handed to a device the
+# simulation has attached at that address.
+
+import array
+
+PIO0_BASE = 0x50200000
+PIO1_BASE = 0x50300000
+PIOX_TXF0 = 0x010
+PIOX_RXF0 = 0x020
+
+devices = {}        # fifo address -> device
+
+def txfifo(smid):
+    return (PIO0_BASE if smid < 4 else PIO1_BASE) + PIOX_TXF0 + smid%4*4
+
+def rxfifo(smid):
+    return (PIO0_BASE if smid < 4 else PIO1_BASE) + PIOX_RXF0 + smid%4*4
+
+# a device has transfer(dma) which moves what it can of dma.remaining and
+# reduces it, called each time the channel's count is checked
+def attach(address, device):
+    devices[address] = device
+
+def detach(address):
+    devices.pop(address, None)
+
+def asm_pio(**kwargs):
+    def _asm_pio(program):
+        return program
+    return _asm_pio
+
+def asm_pio_encode(instruction, sideset_count, sideset_opt=False):
+    return 0
+
+class PIO:
+    OUT_LOW = 0
+    OUT_HIGH = 1
+    IN_LOW = 0
+    IN_HIGH = 1
+    SHIFT_LEFT = 0
+    SHIFT_RIGHT = 1
+    IRQ_SM0 = 0x100
+    IRQ_SM1 = 0x200
+    IRQ_SM2 = 0x400
+    IRQ_SM3 = 0x800
+
+    def __init__(self, id):
+        self.id = id
+
+    def add_program(self, program):
+        pass
+
+    def remove_program(self, program=None):
+        pass
+
+    def state_machine(self, id, program=None, **kwargs):
+        return StateMachine(self.id*4 + id, program, **kwargs)
+
+    def irq(self, handler=None, trigger=0, hard=False):
+        pass
+
+class StateMachine:
+    def __init__(self, id, program=None, **kwargs):
+        self.id = id
+        self.running = False
+        self.txfifo = []
+        self.rxfifo = []
+
+    def init(self, program, **kwargs):
+        pass
+
+    def active(self, value=None):
+        if value is None:
+            return self.running
+        self.running = bool(value)
+
+    def restart(self):
+        pass
+
+    def exec(self, instruction):
+        pass
+
+    def put(self, value, shift=0):
+        pass
+
+    def get(self, buf=None, shift=0):
+        return 0
+
+    def tx_fifo(self):
+        return 0
+
+    def rx_fifo(self):
+        return 0
+
+    def irq(self, handler=None, trigger=0, hard=False):
+        pass
+
+class DMA:
+    _channels = 0
+
+    def __init__(self):
+        self.channel = DMA._channels
+        DMA._channels += 1
+        self.read = None
+        self.write = None
+        self.ctrl = 0
+        self.remaining = 0
+        self.transferred = 0
+        self.registers = memoryview(array.array("L", [0]*4))
+        self._count = 0
+
+    def pack_ctrl(self, default=None, **kwargs):
+        return 0
+
+    def unpack_ctrl(self, value):
+        return {}
+
+    def config(self, read=None, write=None, count=None, ctrl=None, trigger=False):
+        if read is not None:
+            self.read = read
+        if write is not None:
+            self.write = write
+        if count is not None:
+            self._count = count
+        if ctrl is not None:
+            self.ctrl = ctrl
+        if trigger:
+            self.active(1)
+
+    def active(self, value=None):
+        if value is None:
+            return self.remaining > 0
+        if value:
+            self.remaining = self._count
+            self.transferred = 0
+            self._progress()
+        else:
+            self.remaining = 0
+
+    def device(self):
+        if isinstance(self.read, int):
+            return devices.get(self.read)
+        if isinstance(self.write, int):
+            return devices.get(self.write)
+        return None
+
+    def _progress(self):
+        if self.remaining <= 0:
+            return
+        device = self.device()
+        if device is None:
+            self.remaining = 0
+        else:
+            device.transfer(self)
+
+    @property
+    def count(self):
+        self._progress()
+        return self.remaining
+
+    @count.setter
+    def count(self, value):
+        self._count = value
+        self.remaining = 0
+
+    def close(self):
+        self.remaining = 0
@@ -0,0 +1,93 @@
+# stand-in for the sdcard driver: a card held in ram. blocks are only
+# allocated once written. the host filesystem layer mounts a ram-backed
+# folder for it, so files don't go through these blocks.
+
+import asyncio
+from errno import EINVAL, ENODEV
+
+BLOCKSIZE = 512
+
+class SDCard:
+    present = True
+    sectors = 4*1024*1024*1024 // BLOCKSIZE     # 4GB
+    CID = 0x035344534334384780214c9b56015b00
+    CIDBYTES = CID.to_bytes(16, "big")
+
+    def __init__(self, spi, cs, baudrate=1320000, crc16_function=None, dma=None, initialise=True):
+        self.spi = spi
+        self.cs = cs
+        self.cdv = 1
+        self.crcerrors = 0
+        self.blocks = {}
+        self.reads = 0
+        self.writes = 0
+        if initialise:
+            self.init_card(baudrate, crc16_function)
+
+    def init_card(self, baudrate, crc16_function=None):
+        if not SDCard.present:
+            raise OSError(ENODEV, "no SD card")
+        self.baudrate = baudrate
+        self.crc16 = crc16_function
+
+    async def init_card_async(self, baudrate=1320000, crc16_function=None):
+        await asyncio.sleep(0)
+        self.init_card(baudrate, crc16_function)
+
+    def decode_cid(self):
+        cid = self.CIDBYTES
+        return {
+            'mid' : cid[0],
+            'oid' : cid[1:3].decode('ascii'),
+            'product' : cid[3:8].decode('ascii'),
+            'revision' : f"{cid[8] >> 4}.{cid[8] & 0xf}",
+            'serial' : int.from_bytes(cid[9:13], "big"),
+            'date' : f"{2000 + ((cid[13] & 0xf) << 4 | cid[14] >> 4):04d}/{cid[14] & 0xf:02d}"
+        }
+
+    # a class 10, UHS grade 1 card that can be clocked at 50MHz
+    def decode_csd(self):
+        return {
+            'version' : 2,
+            'capacity' : self.sectors * BLOCKSIZE,
+            'maxspeed' : 50_000_000,
+            'classes' : 0x5b5
+        }
+
+    def decode_status(self):
+        return {
+            'speedclass' : 10,
+            'uhsgrade' : 1,
+            'videoclass' : 10
+        }
+
+    def _check(self, block_num, buf):
+        nblocks, err = divmod(len(buf), BLOCKSIZE)
+        if not nblocks or err or block_num + nblocks > self.sectors:
+            raise OSError(EINVAL, "Buffer length is invalid")
+        return nblocks
+
+    def readblocks(self, block_num, buf):
+        mv = memoryview(buf)
+        for index in range(self._check(block_num, buf)):
+            block = self.blocks.get(block_num + index)
+            offset = index*BLOCKSIZE
+            if block is None:
+                mv[offset:offset+BLOCKSIZE] = bytes(BLOCKSIZE)
+            else:
+                mv[offset:offset+BLOCKSIZE] = block
+        self.reads += 1
+
+    def writeblocks(self, block_num, buf):
+        mv = memoryview(buf)
+        for index in range(self._check(block_num, buf)):
+            offset = index*BLOCKSIZE
+            self.blocks[block_num + index] = bytes(mv[offset:offset+BLOCKSIZE])
+        self.writes += 1
+
+    def ioctl(self, op, arg):
+        if op == 4:  # get number of blocks
+            return self.sectors
+        if op == 5:  # get block size in bytes
+            return BLOCKSIZE
+        return 0
@@ -0,0 +1,24 @@
+# stand-in for uctypes. there are no raw addresses on the host, so an
+# address is the id of the buffer, which ptr8/ptr16/ptr32 turn back into
+# the buffer. only the most recent buffers are remembered.
+
+KEEP = 64
+
+_objects = {}
+
+def addressof(obj):
+    address = id(obj)
+    _objects.pop(address, None)
+    _objects[address] = obj
+    if len(_objects) > KEEP:
+        del _objects[next(iter(_objects))]
+    return address
+
+def objectat(address):
+    return _objects[address]
+
+def bytearray_at(address, size):
+    return memoryview(objectat(address))[:size]
+
+def bytes_at(address, size):
+    return bytes(memoryview(objectat(address))[:size])
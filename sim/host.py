@@ -0,0 +1,431 @@
+# makes cpython look enough like micropython on the rp2 to run the
+# firmware: the ticks functions, asyncio extras and micropython style
+# streams, gc heap figures, and a filesystem where "/" is a folder standing
+# in for the flash and os.mount attaches a ram-backed folder for the card
+
+import sys
+import os
+import io
+import gc
+import ast
+import time
+import select
+import shutil
+import asyncio
+import builtins
+import tempfile
+import importlib.machinery
+import traceback
+import tracemalloc
+
+ISMICROPYTHON = sys.implementation.name == "micropython"
+
+TICKS_PERIOD = 1<<30
+TICKS_MAX = TICKS_PERIOD - 1
+TICKS_HALFPERIOD = TICKS_PERIOD // 2
+
+HEAPSIZE = 192*1024
+
+_hostopen = builtins.open
+_hoststat = os.stat
+_hostos = {}
+_start = time.monotonic_ns()
+
+root = None         # folder standing in for the flash
+overlays = []       # read-only folders for files the flash doesn't have, like the web files
+mounts = {}         # mount point -> host folder
+cards = {}          # mount point -> host folder of the card last mounted there
+passthrough = []    # host paths used as they are
+_cwd = "/"
+
+collections = 0
+heapsize = HEAPSIZE
+
+def _elapsed_us():
+    return (time.monotonic_ns() - _start) // 1000
+
+def ticks_ms():
+    return (_elapsed_us() // 1000) & TICKS_MAX
+
+def ticks_us():
+    return _elapsed_us() & TICKS_MAX
+
+def ticks_cpu():
+    return ticks_us()
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & TICKS_MAX
+
+def ticks_diff(end, start):
+    return ((end - start + TICKS_HALFPERIOD) & TICKS_MAX) - TICKS_HALFPERIOD
+
+def sleep_ms(ms):
+    time.sleep(ms / 1000)
+
+def sleep_us(us):
+    time.sleep(us / 1000000)
+
+def mem_alloc():
+    if tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()[0]
+    return 0
+
+def mem_free():
+    return max(0, heapsize - mem_alloc())
+
+def collect():
+    global collections
+
+    collections += 1
+    return _hostcollect()
+
+_hostcollect = gc.collect
+
+def threshold(amount=None):
+    return -1
+
+def print_exception(ex, file=None):
+    traceback.print_exception(type(ex), ex, ex.__traceback__, file=file or sys.stdout)
+
+# filesystem
+
+def _exists(path):
+    try:
+        _hoststat(path)
+        return True
+    except OSError:
+        return False
+
+def _under(path, folder):
+    return path == folder or path.startswith(folder.rstrip("/") + "/")
+
+def hostpath(path, reading=False):
+    if not isinstance(path, str) or not path.startswith("/"):
+        return path
+    for folder in passthrough:
+        if _under(path, folder):
+            return path
+    for mountpoint in sorted(mounts, key=len, reverse=True):
+        if _under(path, mountpoint):
+            return mounts[mountpoint] + path[len(mountpoint):]
+    mapped = root + path
+    if reading and not _exists(mapped):
+        for overlay in overlays:
+            if _exists(overlay + path):
+                return overlay + path
+    return mapped
+
+def _open(file, mode="r", *args, **kwargs):
+    reading = not any(flag in mode for flag in "wax+")
+    return _hostopen(hostpath(file, reading), mode, *args, **kwargs)
+
+def _wrap(name, reading=False):
+    function = getattr(os, name)
+    _hostos[name] = function
+    def _mapped(path, *args, **kwargs):
+        return function(hostpath(path, reading), *args, **kwargs)
+    setattr(os, name, _mapped)
+
+def _rename(old, new):
+    _hostos["rename"](hostpath(old), hostpath(new))
+
+def _chdir(path):
+    global _cwd
+
+    if not path.startswith("/"):
+        path = _cwd.rstrip("/") + "/" + path
+    _hostos["chdir"](hostpath(path))
+    _cwd = path
+
+def _getcwd():
+    return _cwd
+
+def _mount(device, mountpoint, readonly=False):
+    folder = cards.get(mountpoint)
+    if folder is None:
+        folder = tempfile.mkdtemp(prefix="zxsd", dir="/dev/shm" if _exists("/dev/shm") else None)
+        cards[mountpoint] = folder
+        passthrough.append(folder)
+    device.hostfolder = folder
+    mounts[mountpoint] = folder
+
+def _umount(mountpoint):
+    if mounts.pop(mountpoint, None) is None:
+        raise OSError(22, "EINVAL")
+
+def _sync():
+    pass
+
+# asyncio
+
+async def sleep_ms(ms):
+    await asyncio.sleep(ms / 1000)
+
+async def wait_for_ms(awaitable, timeout):
+    return await asyncio.wait_for(awaitable, timeout / 1000)
+
+_hostcreatetask = asyncio.create_task
+
+def create_task(coro):
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.get_event_loop().create_task(coro)
+    return _hostcreatetask(coro)
+
+class ThreadSafeFlag:
+    def __init__(self):
+        self._event = asyncio.Event()
+
+    def set(self):
+        self._event.set()
+
+    def clear(self):
+        self._event.clear()
+
+    async def wait(self):
+        await self._event.wait()
+        self._event.clear()
+
+# streams over a file, like stdin, or a device with any(), like a uart
+class StreamReader:
+    def __init__(self, stream, extra=None):
+        self.stream = stream
+        self.text = isinstance(stream, io.TextIOBase)
+        try:
+            self.fd = stream.fileno()
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            self.fd = None
+
+    async def _wait(self):
+        while True:
+            if self.fd is None:
+                if self.stream.any():
+                    return
+            elif select.select([self.fd], [], [], 0)[0]:
+                return
+            await asyncio.sleep(0.01)
+
+    async def read(self, n=-1):
+        await self._wait()
+        if self.fd is None:
+            data = self.stream.read(None if n < 0 else n)
+        else:
+            data = _hostos["read"](self.fd, 4096 if n < 0 else n)
+            if not data:
+                await asyncio.Event().wait()    # closed, like a serial port nobody is typing into
+        return data.decode() if self.text else data
+
+    async def readinto(self, buf):
+        data = await self.read(len(buf))
+        if self.text:
+            data = data.encode()
+        buf[:len(data)] = data
+        return len(data)
+
+    async def readexactly(self, n):
+        data = b"" if not self.text else ""
+        while len(data) < n:
+            data += await self.read(n - len(data))
+        return data
+
+    async def readline(self):
+        line = b"" if not self.text else ""
+        newline = "\n" if self.text else b"\n"
+        while not line.endswith(newline):
+            line += await self.read(1)
+        return line
+
+class StreamWriter:
+    def __init__(self, stream, extra=None):
+        self.stream = stream
+        self.text = isinstance(stream, io.TextIOBase)
+        self.buffer = []
+
+    def get_extra_info(self, name):
+        return None
+
+    def write(self, buf):
+        self.buffer.append(buf)
+
+    async def drain(self):
+        buffer = self.buffer
+        self.buffer = []
+        for buf in buffer:
+            if self.text:
+                self.stream.write(buf if isinstance(buf, str) else bytes(buf).decode())
+                self.stream.flush()
+                continue
+            if isinstance(buf, (list, str)):
+                buf = bytes(buf) if isinstance(buf, list) else buf.encode()
+            view = memoryview(buf)
+            write = getattr(self.stream, "write", None) or self.stream.send
+            while len(view):
+                written = write(view)
+                if written:
+                    view = view[written:]
+                if len(view):
+                    await asyncio.sleep(0.001)
+            if hasattr(self.stream, "flush"):
+                self.stream.flush()
+
+    async def awrite(self, buf, offset=0, size=-1):
+        if offset or size >= 0:
+            buf = buf[offset:] if size < 0 else buf[offset:offset+size]
+        self.write(buf)
+        await self.drain()
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+# poll with micropython's allocation free ipoll
+class Poll:
+    def __init__(self):
+        self._poll = _hostpoll()
+
+    def register(self, obj, eventmask=select.POLLIN | select.POLLOUT):
+        self._poll.register(obj, eventmask)
+
+    def unregister(self, obj):
+        self._poll.unregister(obj)
+
+    def modify(self, obj, eventmask):
+        self._poll.modify(obj, eventmask)
+
+    def poll(self, timeout=-1):
+        return self._poll.poll(timeout)
+
+    def ipoll(self, timeout=-1, flags=0):
+        return iter(self._poll.poll(timeout))
+
+_hostpoll = select.poll
+
+# extras on the real streams used by the web server
+async def _readinto(self, buf):
+    data = await self.read(len(buf))
+    buf[:len(data)] = data
+    return len(data)
+
+async def _awrite(self, buf, offset=0, size=-1):
+    if offset or size >= 0:
+        buf = buf[offset:] if size < 0 else buf[offset:offset+size]
+    self.write(buf)
+    await self.drain()
+
+# on micropython an async def that yields is a plain generator, which is
+# what the firmware checks for when streaming a response. the firmware is
+# loaded with those functions turned into plain defs to match.
+class _GeneratorTransformer(ast.NodeTransformer):
+    def visit_AsyncFunctionDef(self, node):
+        self.generic_visit(node)
+        if not any(isinstance(child, (ast.Yield, ast.YieldFrom)) for child in ast.walk(node)):
+            return node
+        function = ast.FunctionDef(**{field: getattr(node, field, None) for field in ast.FunctionDef._fields})
+        return ast.copy_location(function, node)
+
+class _FirmwareLoader(importlib.machinery.SourceFileLoader):
+    def source_to_code(self, data, path, *, _optimize=-1):
+        tree = _GeneratorTransformer().visit(ast.parse(data, path))
+        return compile(ast.fix_missing_locations(tree), path, "exec", dont_inherit=True, optimize=_optimize)
+
+    # never from the bytecode cache, which holds the untransformed code
+    def get_code(self, fullname):
+        return self.source_to_code(self.get_data(self.path), self.path)
+
+class _FirmwareFinder(importlib.machinery.PathFinder):
+    @classmethod
+    def find_spec(cls, fullname, path=None, target=None):
+        spec = super().find_spec(fullname, path, target)
+        if spec is None or not isinstance(spec.loader, importlib.machinery.SourceFileLoader):
+            return spec
+        if not any(_under(spec.origin, folder) for folder in overlays):
+            return spec
+        spec.loader = _FirmwareLoader(fullname, spec.origin)
+        return spec
+
+# viper pointers index straight into the buffer
+def _pointer(value):
+    if isinstance(value, int):
+        import uctypes
+        return uctypes.objectat(value)
+    return value
+
+def install(flash, readonly=(), traceheap=False, heap=HEAPSIZE):
+    global root, heapsize
+
+    root = os.path.abspath(flash)
+    overlays.extend(os.path.abspath(folder) for folder in readonly)
+    heapsize = heap
+    os.makedirs(root, exist_ok=True)
+    repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    passthrough.extend([repository, root, sys.prefix, sys.base_prefix, tempfile.gettempdir(), "/dev", "/proc"])
+    passthrough.extend(overlays)
+
+    if ISMICROPYTHON:
+        return
+
+    import micropython
+    builtins.micropython = micropython
+    builtins.const = micropython.const
+    builtins.ptr8 = _pointer
+    builtins.ptr16 = _pointer
+    builtins.ptr32 = _pointer
+    builtins.uint = int
+
+    time.ticks_ms = ticks_ms
+    time.ticks_us = ticks_us
+    time.ticks_cpu = ticks_cpu
+    time.ticks_add = ticks_add
+    time.ticks_diff = ticks_diff
+    time.sleep_ms = sleep_ms
+    time.sleep_us = sleep_us
+
+    if traceheap:
+        tracemalloc.start()
+    gc.mem_alloc = mem_alloc
+    gc.mem_free = mem_free
+    gc.threshold = threshold
+    gc.collect = collect
+    sys.print_exception = print_exception
+
+    for alias, module in (("usys", "sys"), ("usocket", "socket"), ("uasyncio", "asyncio"), ("ustruct", "struct"),
+            ("ujson", "json"), ("uos", "os"), ("utime", "time"), ("ubinascii", "binascii"),
+            ("uhashlib", "hashlib"), ("uselect", "select"), ("uio", "io"), ("ure", "re"), ("uerrno", "errno")):
+        sys.modules[alias] = __import__(module)
+
+    select.poll = Poll
+    # unbuffered, so what poll says is there is what a read gets
+    sys.stdin = io.TextIOWrapper(io.FileIO(0, closefd=False))
+
+    asyncio.sleep_ms = sleep_ms
+    asyncio.wait_for_ms = wait_for_ms
+    asyncio.create_task = create_task
+    asyncio.ThreadSafeFlag = ThreadSafeFlag
+    asyncio.streams.StreamReader.readinto = _readinto
+    asyncio.streams.StreamWriter.awrite = _awrite
+    asyncio.StreamReader = StreamReader
+    asyncio.StreamWriter = StreamWriter
+
+    sys.meta_path.insert(0, _FirmwareFinder)
+    builtins.open = _open
+    _hostos["read"] = os.read
+    for name in ("stat", "listdir", "ilistdir", "statvfs"):
+        if hasattr(os, name):
+            _wrap(name, reading=True)
+    for name in ("mkdir", "remove", "rmdir"):
+        _wrap(name)
+    _hostos["rename"] = os.rename
+    _hostos["chdir"] = os.chdir
+    os.rename = _rename
+    os.chdir = _chdir
+    os.getcwd = _getcwd
+    os.mount = _mount
+    os.umount = _umount
+    os.sync = _sync
+
+def cleanup():
+    for folder in cards.values():
+        shutil.rmtree(folder, ignore_errors=True)
@@ -0,0 +1,102 @@
+# printers for the simulated ports. each records what it receives and can
+# be made slow, with a byte rate, or busy, with a pause every so many bytes
+
+import time
+import asyncio
+import rp2
+import machine
+
+PARALLELPORT_SM = 5
+SERIALPORT_UART = 0
+RAWPORT = 9100
+
+class Printer:
+    def __init__(self, name, rate=None, busyevery=None, busyms=0):
+        self.name = name
+        self.rate = rate                # bytes per second, None for as fast as they come
+        self.busyevery = busyevery      # bytes between busy spells
+        self.busyms = busyms
+        self.data = bytearray()
+        self.writes = 0
+        self.first = None
+        self.last = None
+        self.busyuntil = 0
+        self.nextbusy = busyevery
+
+    # how many of the bytes on offer the printer takes right now
+    def accept(self, buf):
+        now = time.monotonic()
+        if now < self.busyuntil:
+            return 0
+        if self.first is None:
+            self.first = now
+        wanted = len(buf)
+        if self.rate:
+            wanted = min(wanted, int((now - self.first) * self.rate) + 1 - len(self.data))
+        if self.busyevery:
+            wanted = min(wanted, self.nextbusy - len(self.data))
+        if wanted <= 0:
+            return 0
+        self.data += bytes(buf[:wanted])
+        self.writes += 1
+        self.last = now
+        if self.busyevery and len(self.data) >= self.nextbusy:
+            self.nextbusy += self.busyevery
+            self.busyuntil = now + self.busyms / 1000
+        return wanted
+
+    def rateseen(self):
+        if self.first is None or self.last is None or self.last == self.first:
+            return None
+        return len(self.data) / (self.last - self.first)
+
+    def clear(self):
+        self.data = bytearray()
+        self.writes = 0
+        self.first = None
+        self.last = None
+
+# the parallel port's pio words carry a byte each
+class ParallelPrinter(Printer):
+    def __init__(self, **kwargs):
+        super().__init__("parallel", **kwargs)
+        rp2.attach(rp2.txfifo(PARALLELPORT_SM), self)
+
+    def transfer(self, dma):
+        start = dma.transferred
+        words = dma.read[start:start + dma.remaining]
+        accepted = self.accept(bytes(word & 0xff for word in words))
+        dma.transferred += accepted
+        dma.remaining -= accepted
+
+class SerialPrinter(Printer):
+    def __init__(self, **kwargs):
+        super().__init__("serial", **kwargs)
+        machine.UART.sinks[SERIALPORT_UART] = self
+
+# a raw (port 9100) network printer on localhost
+class NetworkPrinter(Printer):
+    def __init__(self, port=RAWPORT, **kwargs):
+        super().__init__("network", **kwargs)
+        self.port = port
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._client, "127.0.0.1", self.port)
+
+    async def _client(self, reader, writer):
+        while True:
+            data = await reader.read(4096)
+            if not data:
+                break
+            view = memoryview(data)
+            while len(view):
+                accepted = self.accept(view)
+                view = view[accepted:]
+                if len(view):
+                    await asyncio.sleep(0.001)
+        writer.close()
+
+    def stop(self):
+        if self.server is not None:
+            self.server.close()
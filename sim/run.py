@@ -0,0 +1,223 @@
+# runs the firmware's init.py on the host with simulated hardware
+#
+#   python sim/run.py --pattern 400 --count 2 --target parallel --rate 2000
+#
+# a folder stands in for the flash (--flash, kept between runs) and the card
+# is a folder in ram. printouts come from .cap files (--capture) or a test
+# pattern (--pattern), and what reaches the printer port is saved to
+# --output. the run ends once the printouts have been captured and printed,
+# or after --duration seconds.
+
+import os
+import sys
+import json
+import time
+import runpy
+import asyncio
+import argparse
+
+simpath = os.path.dirname(os.path.abspath(__file__))
+basepath = os.path.dirname(simpath)
+firmwarepath = f"{basepath}/src/firmware"
+webpath = f"{basepath}/src"
+
+sys.path[0:0] = [f"{simpath}/fakes", simpath, firmwarepath]
+
+import host
+
+PRTTIMEOUT = 2000       # as in init.py
+SETTLEMS = 500
+SDCD = 27               # card detect pin, low when there's a card
+WEBFILES = (".html", ".css", ".js", ".svg", ".ico", ".woff", ".json")
+
+def parsebusy(value):
+    every, ms = value.split(":")
+    return int(every), int(ms)
+
+def getparser():
+    parser = argparse.ArgumentParser("run", description="Pico ZX Printer host simulation")
+    parser.add_argument("--flash", default=f"{simpath}/flash", help="folder standing in for the flash")
+    parser.add_argument("--capture", action="append", default=[], help="replay a .cap file as a printout")
+    parser.add_argument("--pattern", type=int, help="print a test pattern of this many rows")
+    parser.add_argument("--count", type=int, default=1, help="number of times to send the printouts")
+    parser.add_argument("--rowrate", type=float, help="rows per second from the ZX printer port")
+    parser.add_argument("--target", choices=["off", "parallel", "serial", "network"], help="printer target")
+    parser.add_argument("--protocol", choices=["auto", "escp", "escpr"], help="printer protocol")
+    parser.add_argument("--rate", type=int, help="printer speed in bytes per second")
+    parser.add_argument("--busy", type=parsebusy, help="printer goes busy, as BYTES:MS")
+    parser.add_argument("--nosd", action="store_true", help="run without an sd card")
+    parser.add_argument("--web", action="store_true", help="simulate a Pico W, which also runs the web server")
+    parser.add_argument("--webport", type=int, default=8080, help="web server port")
+    parser.add_argument("--serial", action="store_true", help="usb serial connected, so events are sent to stdout")
+    parser.add_argument("--duration", type=float, help="stop after this many seconds")
+    parser.add_argument("--output", help="folder to save the printer output to")
+    parser.add_argument("--traceheap", action="store_true", help="track python allocations as the heap")
+    return parser
+
+# written as a plain settings file, which the firmware still reads
+def savesettings(target, protocol):
+    if target is None and protocol is None:
+        return
+    filename = f"{host.root}/settings.json"
+    try:
+        with open(filename) as fp:
+            settings = json.load(fp)
+    except (OSError, ValueError):
+        settings = {}
+    if "crc" in settings and "settings" in settings:
+        settings = settings["settings"]
+    printer = settings.setdefault("printer", {})
+    raw = printer.setdefault("raw", {})
+    if target is not None:
+        printer["target"] = None if target == "off" else target
+    if target == "network":
+        raw["address"] = "127.0.0.1"
+    if protocol is not None:
+        raw["protocol"] = protocol
+    with open(filename, "w") as fp:
+        json.dump(settings, fp)
+
+# the web files as build.py would list them, for the web server's static routes
+def savefilelist():
+    filename = f"{host.root}/files.json"
+    if os.path.exists(filename) or os.path.exists(f"{webpath}/files.json"):
+        return
+    files = [{"source": name, "target": name, "type": "web"} for name in sorted(os.listdir(webpath))
+        if name.endswith(WEBFILES)]
+    with open(filename, "w") as fp:
+        json.dump(files, fp)
+
+def getprintouts(args):
+    import zxsource
+
+    printouts = [zxsource.readcapture(filename) for filename in args.capture]
+    if args.pattern:
+        printouts.append(zxsource.pattern(args.pattern))
+    return printouts * args.count
+
+def createprinter(args):
+    import ports
+
+    options = {"rate": args.rate}
+    if args.busy:
+        options["busyevery"], options["busyms"] = args.busy
+    if args.target == "parallel":
+        return ports.ParallelPrinter(**options)
+    if args.target == "serial":
+        return ports.SerialPrinter(**options)
+    if args.target == "network":
+        return ports.NetworkPrinter(**options)
+    return None
+
+class Simulation:
+    def __init__(self, args):
+        self.args = args
+        self.source = None
+        self.printer = None
+        self.started = time.monotonic()
+        self.stopped = None
+
+    def setup(self, loop):
+        import machine
+        import network
+        import zxsource
+
+        args = self.args
+        wifi = args.web or args.target == "network"
+        network.enablewifi(wifi)
+        machine.Pin.levels[SDCD] = 1 if args.nosd else 0
+        machine.setusbconnected(args.serial)
+        savesettings(args.target, args.protocol)
+
+        self.printer = createprinter(args)
+        if hasattr(self.printer, "start"):
+            loop.run_until_complete(self.printer.start())
+
+        printouts = getprintouts(args)
+        if printouts:
+            self.source = zxsource.ZXSource(printouts, args.rowrate)
+
+        if wifi:
+            savefilelist()
+            from phew import server
+            createtask = server.create_task
+            server.create_task = lambda host="0.0.0.0", port=80, usessl=False: createtask(host, args.webport, usessl)
+
+        loop.create_task(self.watch(loop))
+
+    # stops once the printouts have all been sent and everything has gone quiet
+    async def watch(self, loop):
+        if self.args.duration is not None:
+            await asyncio.sleep(self.args.duration)
+        elif self.source is not None:
+            await self.source.finished.wait()
+            await asyncio.sleep((PRTTIMEOUT + SETTLEMS) / 1000)
+            import physicalprinter
+            while physicalprinter.printerlock.locked():
+                await asyncio.sleep(SETTLEMS / 1000)
+            await asyncio.sleep(SETTLEMS / 1000)
+        else:
+            return
+        self.stopped = time.monotonic()
+        loop.stop()
+
+    def results(self):
+        results = {
+            "seconds": round((self.stopped or time.monotonic()) - self.started, 3),
+            "rowssent": 0 if self.source is None else self.source.rowssent,
+            "gccollections": host.collections
+        }
+        printoutpath = f"{host.root}/printout"
+        if os.path.isdir(printoutpath):
+            results["captures"] = sorted(name for name in os.listdir(printoutpath) if name.endswith(".cap"))
+        if self.printer is not None:
+            results["printer"] = {
+                "name": self.printer.name,
+                "bytes": len(self.printer.data),
+                "writes": self.printer.writes,
+                "bytespersecond": self.printer.rateseen()
+            }
+        return results
+
+    def saveoutput(self, folder):
+        if self.printer is None:
+            return
+        os.makedirs(folder, exist_ok=True)
+        with open(f"{folder}/{self.printer.name}.prn", "wb") as fp:
+            fp.write(self.printer.data)
+
+def shutdown(loop):
+    loop.set_exception_handler(None)
+    tasks = asyncio.all_tasks(loop)
+    for task in tasks:
+        task.cancel()
+    loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+    loop.close()
+
+def main():
+    args = getparser().parse_args()
+    host.install(args.flash, (firmwarepath, webpath), args.traceheap)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    simulation = Simulation(args)
+    simulation.setup(loop)
+    try:
+        runpy.run_path(f"{firmwarepath}/init.py", run_name="__main__")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logging = sys.modules.get("phew.logging")
+        if logging is not None:
+            logging.flush()
+        if hasattr(simulation.printer, "stop"):
+            simulation.printer.stop()
+        shutdown(loop)
+        host.cleanup()
+    if args.output:
+        simulation.saveoutput(args.output)
+    print(json.dumps(simulation.results(), indent=2))
+
+if __name__ == "__main__":
+    main()
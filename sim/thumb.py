@@ -0,0 +1,91 @@
+# python versions of the firmware's @micropython.asm_thumb functions, used
+# in their place on the host. they follow the assembler step for step so the
+# output matches the device byte for byte.
+
+def pwgrle_encode(bufin, length, bufout):
+    pos = 0
+    out = 0
+    while pos < length:
+        start = end = pos
+        while end < length:
+            if end+1 < length and bufin[end] == bufin[end+1]:
+                break
+            if end - start >= 128:
+                break
+            end += 1
+        count = end - start
+        if count >= 2:
+            bufout[out] = 257 - count
+            out += 1
+            bufout[out:out+count] = bufin[start:end]
+            out += count
+            pos = end
+            continue
+        start = end = pos
+        while end+1 < length and bufin[end] == bufin[end+1] and end - start < 127:
+            end += 1
+        bufout[out] = end - start
+        bufout[out+1] = bufin[start]
+        out += 2
+        pos = end + 1
+    return out
+
+def packbits_encode(bufin, length, bufout):
+    pos = 0
+    out = 0
+    while pos < length:
+        start = end = pos
+        while end < length:
+            if end+2 < length and bufin[end] == bufin[end+1] and bufin[end] == bufin[end+2]:
+                break
+            if end - start >= 128:
+                break
+            end += 1
+        count = end - start
+        if count > 0:
+            bufout[out] = count - 1
+            out += 1
+            bufout[out:out+count] = bufin[start:end]
+            out += count
+            pos = end
+            continue
+        start = end = pos
+        while end+1 < length and bufin[end] == bufin[end+1] and end - start < 127:
+            end += 1
+        count = end - start + 1
+        if count >= 2:
+            bufout[out] = (1 - count) & 0xff
+            bufout[out+1] = bufin[start]
+            out += 2
+            pos = end + 1
+        else:
+            bufout[out] = 0
+            bufout[out+1] = bufin[pos]
+            out += 2
+            pos += 1
+    return out
+
+def bitmaptobytemap(bufin, length, bufout, params):
+    clear, set, scale = params[0], params[1], params[2]
+    out = 0
+    if scale <= 0:
+        return out
+    for pos in range(length):
+        byte = bufin[pos]
+        for bit in range(7, -1, -1):
+            value = set if byte & (1<<bit) else clear
+            for _ in range(scale):
+                bufout[out] = value
+                out += 1
+    return out
+
+def fillarray(buf, length, value):
+    for pos in range(length):
+        buf[pos] = value
+
+functions = {
+    "pwgrle_encode": pwgrle_encode,
+    "packbits_encode": packbits_encode,
+    "bitmaptobytemap": bitmaptobytemap,
+    "fillarray": fillarray
+}
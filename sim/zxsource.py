@@ -0,0 +1,76 @@
+# synthetic zx printer: feeds rows into the row dma of zxprinterdriver as
+# if the pio had read them off the edge connector. printouts are separated
+# by a gap longer than the driver's timeout, so each one is captured as a
+# file of its own.
+
+import time
+import asyncio
+import rp2
+
+ROWBYTES = 32
+ZXPORT_SM = 0
+GAPMS = 2500
+
+# unpacks a .cap capture into rows
+def readcapture(filename):
+    with open(filename, "rb") as filehandle:
+        packed = filehandle.read()
+    unpacked = bytearray()
+    pos = 0
+    while pos < len(packed):
+        header = packed[pos]
+        pos += 1
+        if header < 128:
+            unpacked += packed[pos:pos+header+1]
+            pos += header+1
+        elif header > 128:
+            unpacked += bytes([packed[pos]]) * (257-header)
+            pos += 1
+    return [bytes(unpacked[pos:pos+ROWBYTES]) for pos in range(0, len(unpacked) - ROWBYTES + 1, ROWBYTES)]
+
+# a deterministic test pattern: a diagonal stripe with the row number
+# written in binary down the right hand side
+def pattern(rows):
+    printout = []
+    for row in range(rows):
+        line = bytearray(ROWBYTES)
+        line[(row // 8) % (ROWBYTES - 4)] = 0x80 >> (row % 8)
+        line[ROWBYTES-2] = (row >> 8) & 0xff
+        line[ROWBYTES-1] = row & 0xff
+        printout.append(bytes(line))
+    return printout
+
+class ZXSource:
+    def __init__(self, printouts, rowrate=None, gapms=GAPMS, startms=500):
+        self.printouts = list(printouts)
+        self.rowrate = rowrate
+        self.gapms = gapms
+        self.printout = 0
+        self.row = 0
+        self.rowssent = 0
+        self.finished = asyncio.Event()
+        self.started = None
+        self.finishtime = None
+        self.next = time.monotonic() + startms / 1000
+        rp2.attach(rp2.rxfifo(ZXPORT_SM), self)
+
+    def transfer(self, dma):
+        now = time.monotonic()
+        if self.printout >= len(self.printouts) or now < self.next:
+            return
+        if self.started is None:
+            self.started = now
+        rows = self.printouts[self.printout]
+        dma.write[:ROWBYTES] = rows[self.row]
+        dma.remaining = 0
+        self.rowssent += 1
+        self.row += 1
+        if self.rowrate:
+            self.next = now + 1 / self.rowrate
+        if self.row == len(rows):
+            self.row = 0
+            self.printout += 1
+            self.next = now + self.gapms / 1000
+            if self.printout == len(self.printouts):
+                self.finishtime = now
+                self.finished.set()
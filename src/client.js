@@ -175,6 +175,13 @@ function iscloudconnection() {
     return !(useserial.checked && serial.isconnected) && ishttpallowed();
 }
 
+// the url of a route on the device, or null when it's only reachable over serial
+function getrouteurl(route, params = {}) {
+    if (!iscloudconnection() || !hasaddress()) return null;
+    const query = new URLSearchParams(params).toString();
+    return `${gettargetpath()}/${route}${query ? `?${query}` : ""}`;
+}
+
 function getaddress() {
     return settings.get("address", "");
 }
@@ -357,5 +364,6 @@ export {
     newcanceller,
     cancelrequest,
     fetchrequest,
-    ishttpallowed
+    ishttpallowed,
+    getrouteurl
 }
\ No newline at end of file
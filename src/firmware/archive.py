@@ -0,0 +1,60 @@
+import time
+from micropython import const
+
+BLOCKSIZE   = const(512)
+CHUNKSIZE   = const(1024)
+
+# tar wants seconds since 1970, some ports count from 2000
+EPOCHOFFSET = 0 if time.gmtime(0)[0] == 1970 else 946684800
+
+def padding(size):
+    return -size % BLOCKSIZE
+
+# uncompressed ustar archive streamed straight from the files, the only
+# ram used is a header block and a read chunk
+class TarArchive:
+    def __init__(self, path, entries):
+        self.path = path
+        self.entries = entries  # list of (name, size, mtime)
+        self.size = sum(BLOCKSIZE + size + padding(size) for _, size, _ in entries) + 2*BLOCKSIZE
+
+    @staticmethod
+    def header(block, name, size, mtime):
+        for i in range(BLOCKSIZE):
+            block[i] = 0
+        encodedname = name.encode()
+        block[0:len(encodedname)] = encodedname
+        block[100:108] = b"0000644\x00"                        # mode
+        block[108:116] = b"0000000\x00"                        # uid
+        block[116:124] = b"0000000\x00"                        # gid
+        block[124:136] = b"%011o\x00" % size                   # size
+        block[136:148] = b"%011o\x00" % (mtime + EPOCHOFFSET)  # mtime
+        block[148:156] = b"        "                           # checksum placeholder
+        block[156] = ord("0")                                  # regular file
+        block[257:265] = b"ustar\x0000"                        # magic and version
+        block[148:156] = b"%06o\x00 " % sum(block)             # checksum
+
+    def stream(self):
+        block = bytearray(BLOCKSIZE)
+        chunk = bytearray(CHUNKSIZE)
+        chunkview = memoryview(chunk)
+        zeroview = memoryview(bytes(BLOCKSIZE))
+        for name, size, mtime in self.entries:
+            self.header(block, name, size, mtime)
+            yield block
+            written = 0
+            with open(f"{self.path}/{name}", "rb") as filehandle:
+                while written < size:
+                    bytecount = filehandle.readinto(chunkview[0:min(CHUNKSIZE, size-written)])
+                    if not bytecount:
+                        break
+                    written += bytecount
+                    yield chunkview[0:bytecount]
+            # pad a file that shrunk since it was listed so the length stays right
+            remaining = size - written + padding(size)
+            while remaining > 0:
+                zerocount = min(remaining, BLOCKSIZE)
+                yield zeroview[0:zerocount]
+                remaining -= zerocount
+        yield zeroview
+        yield zeroview
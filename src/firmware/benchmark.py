@@ -0,0 +1,204 @@
+import gc
+import os
+import json
+import time
+import asyncio
+from micropython import const
+from phew import logging
+from packbits import PackBitsFile, UnpackBitsFile
+import physicalprinter
+import parallelprinter
+import serialprinter
+import networkprinter
+import system
+
+# throughput benchmarks: each capture is replayed through the capture path
+# (rows packed into a file) and then printed with each protocol to each port
+
+ROWBYTES = const(32)
+YIELDROWS = const(32)           # rows between letting other tasks run
+HISTORYLENGTH = const(8)        # runs kept in the results file
+
+REFERENCECAPTURE = const("/testprintout.cap")
+BENCHFILENAME = const("/benchmark.cap")
+RESULTSFILENAME = const("/benchmark.json")
+
+protocols = {
+    "escp": physicalprinter.escpprotocol,
+    "escpr": networkprinter.escpprotocol
+}
+
+ports = {
+    "null": physicalprinter.nullport,
+    "parallel": parallelprinter.parallelport,
+    "serial": serialprinter.serialport,
+    "network": networkprinter.networkport
+}
+
+# tracks the heap high water mark. micropython doesn't count collections,
+# so a drop in the allocated memory between samples is counted as one
+class HeapMonitor:
+    def __init__(self):
+        gc.collect()
+        self.base = gc.mem_alloc() # type: ignore
+        self.peak = self.base
+        self.last = self.base
+        self.collections = 0
+
+    def sample(self):
+        allocated = gc.mem_alloc() # type: ignore
+        if allocated < self.last:
+            self.collections += 1
+        elif allocated > self.peak:
+            self.peak = allocated
+        self.last = allocated
+
+    def results(self):
+        return {
+            "peakheap": self.peak,
+            "heapgrowth": self.peak - self.base,
+            "gccollections": self.collections
+        }
+
+def rate(count, ms):
+    return round(count * 1000 / max(ms, 1), 1)
+
+# the capture's rows, unpacked a row at a time into the same buffer
+def readrows(unpacker):
+    row = bytearray(ROWBYTES)
+    while True:
+        for rowpos in range(ROWBYTES):
+            byte = unpacker.read()
+            if byte is None:
+                return
+            row[rowpos] = byte
+        yield row
+
+# only the packing is timed, not unpacking the rows to pack
+async def benchcapture(filename):
+    with UnpackBitsFile(filename) as unpacker:
+        rowcount = 0
+        elapsed = 0
+        heap = HeapMonitor()
+        filehandle = PackBitsFile(BENCHFILENAME)
+        try:
+            for row in readrows(unpacker):
+                starttime = time.ticks_us()
+                for byte in row:
+                    filehandle.write(byte)
+                elapsed += time.ticks_diff(time.ticks_us(), starttime)
+                rowcount += 1
+                heap.sample()
+                if rowcount % YIELDROWS == 0:
+                    await asyncio.sleep_ms(0) # type: ignore
+        except:
+            filehandle.close()
+            raise
+        starttime = time.ticks_us()
+        filehandle.close()
+        elapsed = (elapsed + time.ticks_diff(time.ticks_us(), starttime)) // 1000
+    packedsize = os.stat(BENCHFILENAME)[6]
+    results = {
+        "rows": rowcount,
+        "ms": elapsed,
+        "rowspersecond": rate(rowcount, elapsed),
+        "bytesin": rowcount*ROWBYTES,
+        "bytesout": packedsize,
+        "compressionratio": round(rowcount*ROWBYTES / max(packedsize, 1), 2)
+    }
+    results.update(heap.results())
+    return results
+
+async def benchprint(filename, protocolname, portname):
+    async with physicalprinter.printerlock:
+        savedport = physicalprinter.activeport
+        savedprotocol = physicalprinter.activeprotocol
+        physicalprinter.setport(ports[portname])
+        physicalprinter.setprotocol(protocols[protocolname])
+        try:
+            rowcount = 0
+            heap = HeapMonitor()
+            physicalprinter.byteswritten = 0
+            starttime = time.ticks_ms()
+            await physicalprinter.writeopen()
+            async for row in physicalprinter.FileRowGeneratorAsync(filename):
+                await physicalprinter.writerow(row)
+                rowcount += 1
+                heap.sample()
+                if rowcount % YIELDROWS == 0:
+                    await asyncio.sleep_ms(0) # type: ignore
+            await physicalprinter.writeclose()
+            elapsed = time.ticks_diff(time.ticks_ms(), starttime)
+            byteswritten = physicalprinter.byteswritten
+        finally:
+            physicalprinter.setport(savedport)
+            physicalprinter.setprotocol(savedprotocol)
+    results = {
+        "protocol": protocolname,
+        "port": portname,
+        "rows": rowcount,
+        "ms": elapsed,
+        "rowspersecond": rate(rowcount, elapsed),
+        "bytes": byteswritten,
+        "bytespersecond": rate(byteswritten, elapsed)
+    }
+    results.update(heap.results())
+    return results
+
+# the null port, and the printer's port when one is set
+def defaultports():
+    names = ["null"]
+    if physicalprinter.enabled and physicalprinter.activeport.name != "null":
+        names.append(physicalprinter.activeport.name)
+    return names
+
+def checknames(names, known, kind):
+    for name in names:
+        if name not in known:
+            raise ValueError(f"{kind} '{name}' not supported")
+
+def gethistory():
+    try:
+        with open(RESULTSFILENAME) as fp:
+            return json.load(fp)
+    except:
+        return []
+
+def savehistory(results):
+    history = gethistory()[-(HISTORYLENGTH-1):]
+    history.append(results)
+    with open(RESULTSFILENAME, "wt") as fp:
+        json.dump(history, fp)
+
+async def run(captures=None, protocolnames=None, portnames=None, version=None):
+    captures = captures or [REFERENCECAPTURE]
+    protocolnames = protocolnames or list(protocols)
+    portnames = portnames or defaultports()
+    checknames(protocolnames, protocols, "Protocol")
+    checknames(portnames, ports, "Port")
+
+    results = {
+        "version": version,
+        "machine": system.machine,
+        "time": time.time(),
+        "captures": []
+    }
+    for filename in captures:
+        logging.info(f"Benchmarking capture of {filename}")
+        captureresults = await benchcapture(filename)
+        printresults = []
+        try:
+            for protocolname in protocolnames:
+                for portname in portnames:
+                    logging.info(f"Benchmarking {protocolname} printing to the {portname} port")
+                    printresults.append(await benchprint(BENCHFILENAME, protocolname, portname))
+        finally:
+            os.remove(BENCHFILENAME)
+        results["captures"].append({
+            "file": filename,
+            "capture": captureresults,
+            "print": printresults
+        })
+    savehistory(results)
+    logging.info("Benchmark finished")
+    return results
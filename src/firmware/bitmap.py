@@ -318,6 +318,28 @@ def bitmaptobytemap(r0, r1, r2, r3) -> uint:
     pop({r4})                       # r4 = pop start of output
     sub(r0, r2, r4)                 # return output buffer length = output_ptr - start of output
 
+# Scales a 1bpp bitmap horizontally, repeating each bit scale times
+@micropython.viper
+def scalebits(bufin: ptr8, inlen: int, bufout: ptr8, scale: int) -> int:
+    outpos = 0
+    outbyte = 0
+    outbits = 0
+    for i in range(inlen):
+        byte = bufin[i]
+        mask = 0x80
+        while mask:
+            value = 1 if byte & mask else 0
+            for _ in range(scale):
+                outbyte = (outbyte << 1) | value
+                outbits += 1
+                if outbits == 8:
+                    bufout[outpos] = outbyte
+                    outpos += 1
+                    outbyte = 0
+                    outbits = 0
+            mask >>= 1
+    return outpos
+
 def bitmap_to_escpr(bufin, bufout, scale):
     return bitmaptobytemap(bufin, len(bufin), bufout, array.array('B', [0x01, 0x00, scale]))
 
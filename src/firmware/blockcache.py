@@ -0,0 +1,156 @@
+from micropython import const
+from collections import OrderedDict
+
+# an lru cache of single blocks between the filesystem and a block device.
+# the fat filesystem reads its fat and directory blocks a block at a time,
+# over and over, so those are what gets cached. reads and writes of several
+# blocks are file data and go straight to the device.
+#
+# writes to the fat region (the reserved blocks, the fats and a fat12/16
+# root directory) are held in the cache until flushed. other writes go
+# straight through, keeping the cached copy up to date.
+
+BLOCKSIZE = const(512)
+
+IOCTL_INIT = const(1)
+IOCTL_DEINIT = const(2)
+IOCTL_SYNC = const(3)
+
+MBRPARTITION = const(446)       # first partition entry
+MBRPARTITIONSTART = const(8)    # partition's first block, in the entry
+MBRSIGNATURE = const(510)
+
+class BlockCache:
+    def __init__(self, device, blocks):
+        self.device = device
+        self.blocks = blocks
+        self.buffer = bytearray(blocks*BLOCKSIZE)
+        self.bufferview = memoryview(self.buffer)
+        self.slots = OrderedDict()  # block number -> slot, least recently used first
+        self.free = list(range(blocks))
+        self.dirty = set()
+        self.hits = 0
+        self.misses = 0
+        self.writebacks = 0
+        self.writebackend = self._fatregionend()
+
+    def _slotview(self, slot):
+        return self.bufferview[slot*BLOCKSIZE:(slot+1)*BLOCKSIZE]
+
+    # the block after the last fat region block, or 0 if the card isn't fat
+    def _fatregionend(self):
+        block = bytearray(BLOCKSIZE)
+        try:
+            self.device.readblocks(0, block)
+            if block[MBRSIGNATURE] != 0x55 or block[MBRSIGNATURE+1] != 0xaa:
+                return 0
+            start = 0
+            if block[0] not in (0xeb, 0xe9):
+                entry = MBRPARTITION+MBRPARTITIONSTART
+                start = int.from_bytes(block[entry:entry+4], "little")
+                self.device.readblocks(start, block)
+            if int.from_bytes(block[11:13], "little") != BLOCKSIZE:
+                return 0
+            reserved = int.from_bytes(block[14:16], "little")
+            fats = block[16]
+            rootentries = int.from_bytes(block[17:19], "little")
+            fatsize = int.from_bytes(block[22:24], "little") or int.from_bytes(block[36:40], "little")
+            return start + reserved + fats*fatsize + (rootentries*32 + BLOCKSIZE-1)//BLOCKSIZE
+        except OSError:
+            return 0
+
+    # the slot holding a block, made the most recently used
+    def _lookup(self, block_num):
+        slot = self.slots.pop(block_num, None)
+        if slot is not None:
+            self.slots[block_num] = slot
+        return slot
+
+    def _writeback(self, block_num, slot):
+        self.device.writeblocks(block_num, self._slotview(slot))
+        self.dirty.discard(block_num)
+        self.writebacks += 1
+
+    def _allocate(self, block_num):
+        if self.free:
+            slot = self.free.pop()
+        else:
+            oldest = next(iter(self.slots))
+            slot = self.slots.pop(oldest)
+            if oldest in self.dirty:
+                self._writeback(oldest, slot)
+        self.slots[block_num] = slot
+        return slot
+
+    def _drop(self, block_num):
+        slot = self.slots.pop(block_num, None)
+        if slot is not None:
+            self.dirty.discard(block_num)
+            self.free.append(slot)
+
+    def readblocks(self, block_num, buf):
+        if len(buf) != BLOCKSIZE:
+            self.device.readblocks(block_num, buf)
+            # cached blocks may be newer than the card
+            if self.dirty:
+                mv = memoryview(buf)
+                for dirty in self.dirty:
+                    offset = (dirty - block_num)*BLOCKSIZE
+                    if 0 <= offset < len(buf):
+                        mv[offset:offset+BLOCKSIZE] = self._slotview(self.slots[dirty])
+            return
+        slot = self._lookup(block_num)
+        if slot is None:
+            self.misses += 1
+            slot = self._allocate(block_num)
+            try:
+                self.device.readblocks(block_num, self._slotview(slot))
+            except:
+                self._drop(block_num)
+                raise
+        else:
+            self.hits += 1
+        buf[:] = self._slotview(slot)
+
+    def writeblocks(self, block_num, buf):
+        if len(buf) != BLOCKSIZE:
+            for block in range(block_num, block_num + len(buf)//BLOCKSIZE):
+                self._drop(block)
+            self.device.writeblocks(block_num, buf)
+            return
+        slot = self._lookup(block_num)
+        if slot is None:
+            slot = self._allocate(block_num)
+        self._slotview(slot)[:] = buf
+        if block_num < self.writebackend:
+            self.dirty.add(block_num)
+        else:
+            try:
+                self.device.writeblocks(block_num, buf)
+            except:
+                self._drop(block_num)
+                raise
+
+    def flush(self):
+        for block_num in sorted(self.dirty):
+            self._writeback(block_num, self.slots[block_num])
+
+    def invalidate(self):
+        self.slots = OrderedDict()
+        self.free = list(range(self.blocks))
+        self.dirty = set()
+
+    def ioctl(self, op, arg):
+        if op == IOCTL_SYNC or op == IOCTL_DEINIT:
+            self.flush()
+        result = self.device.ioctl(op, arg)
+        if op == IOCTL_INIT:
+            self.invalidate()
+        return result
+
+    def stats(self):
+        return {
+            "hit": self.hits,
+            "miss": self.misses,
+            "writeback": self.writebacks
+        }
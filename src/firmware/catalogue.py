@@ -0,0 +1,103 @@
+import os
+import time
+from micropython import const
+from packbits import unpackedlength
+
+ROWBYTES    = const(32)
+
+SIZE        = const(0)
+MTIME       = const(1)
+ROWS        = const(2)
+
+MAXREMOVED  = const(32)     # removals remembered for listing changes since a time
+
+# sort orders, prefix with '-' for descending
+ORDERS = {
+    "name":  lambda item: item[0],
+    "size":  lambda item: item[1][SIZE],
+    "mtime": lambda item: item[1][MTIME]
+}
+
+# in memory list of the captures in a store, kept up to date as captures
+# are added and removed so listing doesn't have to scan the folder. the
+# most recent removals are remembered, with when they were removed, so
+# listing changes since a time can say what's gone.
+class Catalogue:
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.removed = {}
+        self.forgotten = 0      # removals up to this time aren't known
+
+    def rebuild(self, names):
+        self.entries = {}
+        self.removed = {}
+        self.forgotten = time.time()
+        for name in names:
+            self.update(name)
+
+    def update(self, name, rows=None):
+        try:
+            stat = os.stat(f"{self.path}/{name}")
+        except OSError:
+            self.remove(name)
+            return
+        if stat[0] & 0x4000:
+            return
+        self.entries[name] = [stat[6], stat[8], rows]
+        self.removed.pop(name, None)
+
+    def remove(self, name):
+        if self.entries.pop(name, None) is None:
+            return
+        if len(self.removed) >= MAXREMOVED:
+            oldest = min(self.removed, key=self.removed.get)
+            self.forgotten = self.removed.pop(oldest)
+        self.removed[name] = time.time()
+
+    def get(self, name):
+        return self.entries.get(name)
+
+    def names(self):
+        return sorted(self.entries)
+
+    def rows(self, name):
+        entry = self.entries.get(name)
+        if entry is None:
+            return None
+        if entry[ROWS] is None:
+            entry[ROWS] = unpackedlength(f"{self.path}/{name}") // ROWBYTES
+        return entry[ROWS]
+
+    def list(self, offset=0, limit=None, order="name", since=None):
+        descending = order.startswith("-")
+        sortkey = ORDERS.get(order[1:] if descending else order)
+        if sortkey is None:
+            raise ValueError(f"Order '{order}' not supported")
+        items = self.entries.items()
+        if since is not None:
+            # file times are only to 2 seconds, so ones at since are
+            # included and clients drop those they already have
+            items = [item for item in items if item[1][MTIME] >= since]
+        items = sorted(items, key=sortkey, reverse=descending)
+        end = len(items) if limit is None else offset+limit
+        result = {
+            "total": len(items),
+            "offset": offset,
+            "printouts": [{
+                "name": name,
+                "size": entry[SIZE],
+                "mtime": entry[MTIME],
+                "rows": self.rows(name)
+            } for name, entry in items[offset:end]]
+        }
+        if since is not None:
+            result["removed"] = self.removedsince(since)
+        return result
+
+    # names removed at or after since, or None when that's further back
+    # than is remembered and the whole list has to be fetched again
+    def removedsince(self, since):
+        if since <= self.forgotten:
+            return None
+        return sorted(name for name, removed in self.removed.items() if removed >= since)
@@ -0,0 +1,65 @@
+import asyncio
+from phew import logging
+
+# bounded outbound queue with its own writer task, so putting a message
+# never waits on the client. when full the oldest message is dropped, and
+# a client that keeps overflowing without sending anything is treated as
+# dead, unless closeonoverflow is off for a client that can't go away.
+# messages put with a key replace any queued message with that key.
+class ClientQueue:
+    def __init__(self, send, maxlength, onclose=None, closeonoverflow=True):
+        self._send = send
+        self._onclose = onclose
+        self.closeonoverflow = closeonoverflow
+        self.maxlength = maxlength
+        self.items = []
+        self.dropped = 0
+        self.overflow = 0
+        self.closed = False
+        self.ready = asyncio.Event()
+        self.task = asyncio.create_task(self._run())
+
+    def put(self, message, key=None):
+        if self.closed:
+            return
+        if key is not None:
+            for item in self.items:
+                if item[0] == key:
+                    self.items.remove(item)
+                    break
+        if len(self.items) >= self.maxlength:
+            self.items.pop(0)
+            self.dropped += 1
+            self.overflow += 1
+            if self.closeonoverflow and self.overflow > self.maxlength:
+                self.close()
+                return
+        self.items.append((key, message))
+        self.ready.set()
+
+    def close(self):
+        if self.closed:
+            return
+        self._shutdown()
+        self.task.cancel()
+
+    def _shutdown(self):
+        self.closed = True
+        self.items = []
+        if self._onclose:
+            self._onclose()
+
+    async def _run(self):
+        try:
+            while True:
+                await self.ready.wait()
+                self.ready.clear()
+                while self.items:
+                    _, message = self.items.pop(0)
+                    await self._send(message)
+                    self.overflow = 0
+        except OSError:
+            self._shutdown()
+        except Exception as ex:
+            logging.error(f"Client queue send failed: {ex}")
+            self._shutdown()
@@ -2,11 +2,12 @@ import time
 import json
 import asyncio
 import usys
-import gc
+import uselect
 from micropython import const
 from machine import mem32
 from phew.server import urldecode
 from phew import logging
+import metrics
 
 # see 4.1.4 in RP2040 datasheet
 USBCTRL_REGS_BASE = const(0x50110000)
@@ -21,6 +22,10 @@ WHITESPACE = ''.join(chr(code) for code in range(33)) # control chars and space
 
 seriallock = asyncio.Lock()
 
+# parameters are only url decoded if they need to be
+def decodeparam(param):
+    return urldecode(param) if '%' in param or '+' in param else param
+
 class CommandDefinition:
     def __init__(self, name, handler, params):
         self.name = name
@@ -28,66 +33,89 @@ class CommandDefinition:
         self.params = []
         self.secrets = set()
         self.optional = 0
+        self.variadic = False   # last parameter takes a list of the rest
+        self.exclusive = None   # when set, says whether it must run on its own right now
         for param in params:
+            if self.variadic:
+                raise ValueError('Only the last parameter can take the rest of the parameters')
             if param.startswith('[') and param.endswith(']'):
                 param = param[1:-1]
                 self.optional += 1
             else:
                 if self.optional > 0:
                     raise ValueError('Mandatory parameters must come before optional parameters')
+            if param.endswith('...'):
+                param = param[:-3]
+                self.variadic = True
             if param.startswith('*'):
                 param = param[1:]
                 self.secrets.add(param)
             self.params.append(param)
+        self.mandatory = len(self.params)-self.optional
+        self.masked = [param in self.secrets for param in self.params]
+        self.help = ' '.join(self.paramhelp())
 
     class Command:
         def __init__(self, commanddef, params):
             self.commanddef = commanddef
             self.params = params
-            self.callparams = {}
-            self.maskedparams = []
-            position = 0
-            for param in params:
-                paramname = commanddef.params[position] if position < len(commanddef.params) else None
-                self.maskedparams.append('****' if paramname in commanddef.secrets else param)
-                if not paramname:
-                    continue
-                self.callparams[paramname] = urldecode(param)
-                position += 1
+
+        def callparams(self):
+            commanddef = self.commanddef
+            paramnames = commanddef.params
+            callparams = {}
+            for position, param in enumerate(self.params):
+                if position < len(paramnames):
+                    callparams[paramnames[position]] = decodeparam(param)
+                else:
+                    break
+            if commanddef.variadic:
+                last = len(paramnames)-1
+                callparams[paramnames[last]] = [decodeparam(param) for param in self.params[last:]]
+            return callparams
 
         async def invoke(self):
-            if len(self.params) < len(self.commanddef.params)-self.commanddef.optional:
-                raise ValueError(f"Missing parameters, expecting: {' '.join(self.commanddef.paramhelp())}")
-            if len(self.params) > len(self.commanddef.params):
-                raise ValueError(f"Too many parameters, expecting: {' '.join(self.commanddef.paramhelp())}")
-            return await self.commanddef.call_handler(self.callparams)
+            commanddef = self.commanddef
+            if len(self.params) < commanddef.mandatory:
+                raise ValueError(f"Missing parameters, expecting: {commanddef.help}")
+            if len(self.params) > len(commanddef.params) and not commanddef.variadic:
+                raise ValueError(f"Too many parameters, expecting: {commanddef.help}")
+            return await commanddef.call_handler(self.callparams())
 
         def __str__(self):
-            return f"{self.commanddef.name.upper()} {' '.join(self.maskedparams)}"
+            commanddef = self.commanddef
+            masked = commanddef.masked
+            params = []
+            for position, param in enumerate(self.params):
+                if position < len(masked):
+                    ismasked = masked[position]
+                else:
+                    ismasked = commanddef.variadic and masked[-1]
+                params.append('****' if ismasked else param)
+            return f"{commanddef.name.upper()} {' '.join(params)}"
 
-    def match(self, tokens):
-        if tokens[0].lower() == self.name.lower():
-            return self.Command(self, tokens[1:])
-        return None
+    def parse(self, params):
+        return self.Command(self, params.split(" ") if params else [])
 
     async def call_handler(self, params):
         return await self.handler(params)
 
     def paramhelp(self):
-        mandatory = len(self.params)-self.optional
         position = 0
         for param in self.params:
-            yield param if position<mandatory else f"[{param}]"
+            if self.variadic and position == len(self.params)-1:
+                param += "..."
+            yield param if position<self.mandatory else f"[{param}]"
             position += 1
 
-_commands = []
+_commands = {}
 
 def _match_command(line):
-    tokens = line.strip(WHITESPACE).split(" ")
-    for commanddef in _commands:
-        if command := commanddef.match(tokens):
-            return command
-    return None
+    name, _, params = line.strip(WHITESPACE).partition(" ")
+    commanddef = _commands.get(name.lower())
+    if commanddef is None:
+        return None
+    return commanddef.parse(params)
 
 def command_error(message, cause=None):
     response = { 'error': message }
@@ -97,7 +125,20 @@ def command_error(message, cause=None):
 
 def add_command(name, handler, params):
     global _commands
-    _commands.append(CommandDefinition(name, handler, params))
+    key = name.lower()
+    if key in _commands:
+        raise ValueError(f"Command '{name}' already added")
+    _commands[key] = CommandDefinition(name, handler, params)
+
+# for commands that sometimes write straight to the port, which only a
+# plain command holding the port can do, so they can't be batched or run
+# as a request then
+def setexclusive(name, exclusive):
+    _commands[name.lower()].exclusive = exclusive
+
+def isexclusive(command):
+    exclusive = command.commanddef.exclusive
+    return exclusive is not None and exclusive()
 
 def command(name, *args):
     def _command(f):
@@ -105,8 +146,121 @@ def command(name, *args):
         return f
     return _command
 
-stdin = asyncio.StreamReader(usys.stdin)
+CR = const(0x0d)
+LF = const(0x0a)
+SPACE = const(0x20)
+HASH = const(0x23)
+MAXLINELENGTH = const(1024)
+
+class LineTooLongError(ValueError):
+    pass
+
+# pyright: reportUndefinedVariable=false
+
+# the first cr or lf
+@micropython.viper
+def _find_lineend(buf: ptr8, start: int, end: int) -> int:
+    i = start
+    while i < end:
+        byte = buf[i]
+        if byte == LF or byte == CR:
+            return i
+        i += 1
+    return -1
+
+# the first printable character
+@micropython.viper
+def _find_printable(buf: ptr8, start: int, end: int) -> int:
+    i = start
+    while i < end:
+        if buf[i] >= SPACE:
+            return i
+        i += 1
+    return -1
+
+# reads lines into a reusable buffer, where they're split in place. what's
+# left after a line is kept for the next one. bytes that have already
+# arrived are taken straight off the stream, only waiting for more goes
+# through the scheduler. a line longer than the buffer is read to its end
+# and dropped.
+#
+# stdin's readinto waits until all it's given is filled, so bytes are only
+# taken while the poller says there are more.
+class SerialLineReader:
+    def __init__(self, stream, maxlength=MAXLINELENGTH):
+        self.stream = stream
+        self.reader = asyncio.StreamReader(stream)
+        self.poller = uselect.poll()
+        self.poller.register(stream, uselect.POLLIN)
+        self.buffer = bytearray(maxlength)
+        self.bufferview = memoryview(self.buffer)
+        self.byte = bytearray(1)
+        self.start = 0      # the unread bytes are buffer[start:end]
+        self.end = 0
+        self.reading = False
+
+    def available(self):
+        for _ in self.poller.ipoll(0):
+            return True
+        return False
+
+    # onstart is awaited with the first printable character of the line
+    async def readline(self, onstart=None):
+        self.reading = True
+        try:
+            return await self._readline(onstart)
+        finally:
+            self.reading = False
+
+    # moves the unread bytes to the front, dropping them if the buffer is
+    # full without a line end
+    def _compact(self):
+        if self.start == 0 and self.end == len(self.buffer):
+            self.end = 0
+            return True
+        length = self.end - self.start
+        self.buffer[0:length] = self.bufferview[self.start:self.end]
+        self.start = 0
+        self.end = length
+        return False
+
+    async def _fill(self):
+        buffer = self.buffer
+        byte = self.byte
+        end = self.end
+        while end < len(buffer) and self.available() and self.stream.readinto(byte):
+            buffer[end] = byte[0]
+            end += 1
+        # nothing had arrived, so wait for it
+        if end == self.end and await self.reader.readinto(byte): # type: ignore
+            buffer[end] = byte[0]
+            end += 1
+        self.end = end
+
+    async def _readline(self, onstart):
+        overflow = False
+        scanned = self.start
+        while True:
+            lineend = _find_lineend(self.buffer, scanned, self.end)
+            if onstart is not None:
+                printable = _find_printable(self.buffer, scanned, self.end if lineend < 0 else lineend)
+                if printable >= 0:
+                    await onstart(self.buffer[printable])
+                    onstart = None
+            if lineend >= 0:
+                linestart = self.start
+                self.start = lineend + 1
+                if overflow:
+                    raise LineTooLongError(f"Line longer than {len(self.buffer)} characters")
+                return str(self.bufferview[linestart:lineend], "utf-8")
+            if self.start > 0 or self.end == len(self.buffer):
+                overflow = self._compact() or overflow
+            scanned = self.end
+            await self._fill()
+
+serialreader = SerialLineReader(usys.stdin.buffer)
 stdout = asyncio.StreamWriter(usys.stdout, {}) # type: ignore
+binaryout = asyncio.StreamWriter(usys.stdout.buffer, {}) # type: ignore
 
 class LockingSerialReader:
     def __init__(self):
@@ -119,26 +273,22 @@ class LockingSerialReader:
         if self.locked:
             seriallock.release()
 
+    # a plain command has the port from when it starts to be typed, a
+    # request only takes it to answer
+    async def lock(self, firstchar):
+        if firstchar != HASH:
+            await seriallock.acquire() # type: ignore
+            self.locked = True
+
     async def read(self):
-        line = ''
-        while True:
-            byte = await stdin.read(1)
-            if not self.locked and ord(byte)>=ord(' '):
-                await seriallock.acquire()
-                self.locked = True
-            if byte == '\n' or byte == '\r':
-                return line
-            line += byte # type: ignore
+        return await serialreader.readline(self.lock)
 
 async def serialread():
-    line = ''
-    while True:
-        byte = await stdin.read(1)
-        if byte == '\n' or byte == '\r':
-            return line
-        line += byte # type: ignore
+    return await serialreader.readline()
 
-async def serialwrite(data):
+async def serialwrite(data, requestid=None):
+    if requestid is not None:
+        await stdout.awrite(f"#{requestid} ") # type: ignore
     if type(data).__name__ == "generator":
         for chunk in data:
             await stdout.awrite(chunk) # type: ignore
@@ -152,24 +302,128 @@ async def serialnotify(event):
             await stdout.awrite(event) # type: ignore
             await stdout.awrite("\n") # type: ignore
 
+# runs each url encoded command in turn, answering with an array of their
+# responses. a failed command gives an error in its place without stopping
+# the rest. commands that write straight to the port, like getprintout in
+# binary mode, can't be batched and give an error instead.
+async def batch(params):
+    responses = []
+    for line in params["commands"]:
+        command = _match_command(line)
+        if command is None:
+            responses.append(command_error("Unknown command"))
+        elif command.commanddef.handler is batch:
+            responses.append(command_error("Batches can't be nested"))
+        elif isexclusive(command):
+            responses.append(command_error("Command can't be batched"))
+        else:
+            try:
+                responses.append(await command.invoke())
+            except Exception as ex:
+                responses.append(command_error("Command failed", str(ex)))
+    return batchresponse(responses)
+
+def batchresponse(responses):
+    yield '['
+    separator = ''
+    for response in responses:
+        if type(response).__name__ == "generator":
+            yield separator
+            for chunk in response:
+                yield chunk
+        else:
+            yield separator + json.dumps(response)
+        separator = ','
+    yield ']'
+
+add_command("batch", batch, ("*commands...",))
+
+# a line starting "#<id> " is a request that runs as a task of its own,
+# with its response sent as a line starting with the same "#<id> ". other
+# lines run one at a time, as they always have.
+MAXREQUESTS = const(4)
+
+requests = 0
+requestdone = asyncio.Event()
+
+metrics.addqueue("requests", lambda: requests)
+
+def splitrequest(line):
+    if not line.startswith("#"):
+        return None, line
+    requestid, _, line = line[1:].partition(" ")
+    return requestid, line
+
+# responses to requests take the lock, other commands already have it. a
+# response that's generated is put together first, so the port isn't held
+# while it is
+async def respond(response, requestid):
+    if requestid is None:
+        await serialwrite(response)
+    else:
+        if type(response).__name__ == "generator":
+            chunks = list(response)
+            response = (chunk for chunk in chunks)
+        async with seriallock:
+            await serialwrite(response, requestid)
+
+async def runcommand(line, requestid=None):
+    command_start_time = time.ticks_ms()
+    command = _match_command(line)
+    prefix = "" if requestid is None else f"#{requestid} "
+    if command and requestid is not None and isexclusive(command):
+        await respond(command_error("Command can't be run as a request"), requestid)
+    elif command:
+        try:
+            response = await command.invoke()
+            await respond(response, requestid)
+            processing_time = time.ticks_ms() - command_start_time
+            logging.info(f"$ {prefix}{command} [{processing_time}ms]")
+        except Exception as ex:
+            logging.error(f"$ {prefix}{command} failed: {ex}")
+            await respond(command_error("Command failed", str(ex)), requestid)
+    else:
+        await respond(command_error("Unknown command"), requestid)
+
+async def runrequest(requestid, line):
+    global requests
+
+    try:
+        await runcommand(line, requestid)
+    except Exception as ex:
+        logging.error(f"$ #{requestid} Request failed: {ex}")
+    finally:
+        requests -= 1
+        requestdone.set()
+        metrics.collectgarbage()
+
+# waits for one of the running requests to finish when there are too many
+async def startrequest(requestid, line):
+    global requests
+
+    while requests >= MAXREQUESTS:
+        requestdone.clear()
+        await requestdone.wait()
+    requests += 1
+    asyncio.create_task(runrequest(requestid, line))
+
 async def start_server():
     while True:
         try:
+            requestid = None
             with LockingSerialReader() as reader:
-                line = await reader.read()
-                command_start_time = time.ticks_ms()
-                command = _match_command(line)
-                if command:
-                    try:
-                        response = await command.invoke()
-                        await serialwrite(response)
-                        processing_time = time.ticks_ms() - command_start_time
-                        logging.info(f"$ {command} [{processing_time}ms]")
-                    except Exception as ex:
-                        logging.error(f"$ {command} failed: {ex}")
-                        await serialwrite(command_error("Command failed", str(ex)))
-                else:
-                    await serialwrite(command_error("Unknown command"))
-            gc.collect()
+                try:
+                    line = await reader.read()
+                except LineTooLongError as ex:
+                    logging.error(f"$ Command read failed: {ex}")
+                    await serialwrite(command_error("Command too long"))
+                    continue
+                requestid, line = splitrequest(line)
+                if requestid is None:
+                    await runcommand(line)
+            if requestid is None:
+                metrics.collectgarbage()
+            else:
+                await startrequest(requestid, line)
         except Exception as ex:
             logging.error(f"$ Command read failed: {ex}")
@@ -1,29 +1,40 @@
 import json
+from micropython import const
 from phew import server, logging
 from command import serialnotify
+from clientqueue import ClientQueue
+import metrics
 
-eventclients = set()
+EVENTQUEUELENGTH = const(8)
+
+eventclients = {}
 
 pingmessage = "__ping__"
 pongmessage = "__pong__"
 
+# events that only report the current state, a queued one is replaced
+# rather than sent again
+stateevents = {"sdcard"}
+
 connecthandlers = []
 
+# usb serial is always there, it's only slow while a command holds the port
+serialqueue = ClientQueue(serialnotify, EVENTQUEUELENGTH, closeonoverflow=False)
+
+metrics.addqueue("serial", lambda: len(serialqueue.items))
+metrics.addqueue("events", lambda: sum(len(queue.items) for queue in eventclients.values()))
+
 def addconnecthandler(handler, data):
     connecthandlers.append((handler, data))
 
-async def sendall(message):
-    global eventclients
-
-    for client in eventclients:
-        try:
-            await client.send(message)
-        except:
-            pass
+def sendall(message, key=None):
+    for client, queue in list(eventclients.items()):
+        if queue.closed:
+            eventclients.pop(client, None)
+        else:
+            queue.put(message, key)
 
 async def notifyevent(type, data):
-    global eventclients
-
     logging.info(f"Notifying event {type} with {data}")
     event = json.dumps({
         "event": {
@@ -31,22 +42,25 @@ async def notifyevent(type, data):
             "data": data
         }
     })
-    await serialnotify(event)
-    await sendall(event)
+    key = type if type in stateevents else None
+    serialqueue.put(event, key)
+    sendall(event, key)
 
 @server.websocket("/events")
 async def events(websocket):
-    global eventclients
-
-    eventclients.add(websocket)
-    for handler in connecthandlers:
-        await handler[0](handler[1])
-    while True:
-        evt = await websocket.recv()
-        if evt is None or evt["type"] == "close":
-            break
-        if evt["type"] == "text":
-            message = str(evt["data"])
-            if message == pingmessage:
-                await websocket.send(pongmessage)
-    eventclients.discard(websocket)
+    queue = ClientQueue(websocket.send, EVENTQUEUELENGTH, websocket.writer.close)
+    eventclients[websocket] = queue
+    try:
+        for handler in connecthandlers:
+            await handler[0](handler[1])
+        while not queue.closed:
+            evt = await websocket.recv()
+            if evt is None or evt["type"] == "close":
+                break
+            if evt["type"] == "text":
+                message = str(evt["data"])
+                if message == pingmessage:
+                    queue.put(pongmessage)
+    finally:
+        eventclients.pop(websocket, None)
+        queue.close()
@@ -3,11 +3,12 @@ import time
 import json
 import re
 from micropython import const
-from phew import logging
-from phew.server import file_exists
+from phew import logging, trace
 from packbits import PackBitsFile
+from catalogue import Catalogue, SIZE
 from event import notifyevent
 from sdmanager import SDManager
+import metrics
 
 PRINTOUTFOLDER  = const("printout")
 PRINTCONFIGFILE = const("prtconfig.json")
@@ -15,6 +16,10 @@ PRINTCONFIGFILE = const("prtconfig.json")
 SDSTORENAME = const("sd")
 
 filenumbers = {}
+catalogues = {}
+SPAN_PACKBITS = trace.span("packbits")
+SPAN_CAPTURECLOSE = trace.span("captureclose")
+
 captureenabled = True
 printpattern = re.compile(r"^prt(\d\d\d\d\d\d).cap$") # type: ignore
 
@@ -28,6 +33,7 @@ async def storehandler(hascard):
         storeinit(SDSTORENAME)
     else:
         del filenumbers[SDSTORENAME]
+        catalogues.pop(SDSTORENAME, None)
 
 def getrootpath(store):
     return sd.mount_point if store == SDSTORENAME else ""
@@ -52,18 +58,19 @@ def getfilenumber(store):
         raise Exception("File store not ready")
     return filenumber
 
+def getcatalogue(store):
+    catalogue = catalogues.get(store)
+    if catalogue is None:
+        raise Exception("File store not ready")
+    return catalogue
+
 def nextfilename(store):
     filenumber = getfilenumber(store)
     filenumbers[store] = filenumber+1
     return getfullfilename(store, filenumber)
 
 def getfiles(store):
-    files = []
-    storepath = getstorepath(store)
-    for file in os.listdir(storepath):
-        if printpattern.match(file) and file_exists(f"{storepath}/{file}"):
-            files.append(file)
-    return files
+    return getcatalogue(store).names()
 
 def savesettings(store):
     logging.info("Saving print capture settings")
@@ -93,8 +100,15 @@ def storeinit(store):
     except:
         settings = {}
 
+    names = []
+    for name in os.listdir(storepath):
+        if printpattern.match(name):
+            names.append(name)
+        elif name.startswith("upload") and name.endswith(".tmp"):
+            os.remove(f"{storepath}/{name}")    # left by an upload cut short by a restart
+
     settinglast = int(settings.get("next") or "1")-1
-    filelast = max([0]+[int(m.group(1)) for f in os.listdir(storepath) for m in [printpattern.match(f)] if m is not None])
+    filelast = max([0]+[int(printpattern.match(f).group(1)) for f in names]) # type: ignore
     maxlast = max(settinglast, filelast)
 
     filenumber = maxlast
@@ -104,6 +118,11 @@ def storeinit(store):
 
     filenumbers[store] = filenumber
 
+    logging.info("Cataloguing print files")
+    catalogue = Catalogue(storepath)
+    catalogue.rebuild(names)
+    catalogues[store] = catalogue
+
     logging.info(f"Next print file is #{filenumber+1} '{getfullfilename(store, filenumber+1)}'")
 
 async def capture(rows):
@@ -111,6 +130,8 @@ async def capture(rows):
 
     starttime = None
     filehandle = None
+    filename = None
+    rowcount = 0
     logging.info("Waiting for printout to capture")
     while True:
         async for row in rows:
@@ -120,16 +141,30 @@ async def capture(rows):
                 starttime = time.ticks_ms()
             if filehandle is None:
                 logging.info("Capture started")
+                filename = getfilename(getfilenumber(None))
                 filehandle = PackBitsFile(nextfilename(None))
+                rowcount = 0
+            trace.begin(SPAN_PACKBITS)
             for byte in row:
                 filehandle.write(byte)
+            trace.end(SPAN_PACKBITS)
+            rowcount += 1
         if filehandle is not None:
+            trace.begin(SPAN_CAPTURECLOSE)
             filehandle.close()
             filehandle = None
-            await notifyevent("capture", getfilename(getfilenumber(None)))
+            catalogue = getcatalogue(None)
+            catalogue.update(filename, rowcount)
+            trace.end(SPAN_CAPTURECLOSE)
+            metrics.rowscaptured.inc(rowcount)
+            entry = catalogue.get(filename)
+            if entry:
+                metrics.capturebytes.inc(entry[SIZE])
+            await notifyevent("capture", filename)
         if starttime is not None:
             printtime = time.ticks_diff(time.ticks_ms(), starttime)
             logging.info(f"Capture time: {printtime} ms")
+            metrics.captureduration.observe(printtime)
             logging.info("Capture finished")
             savesettings(None)
             starttime = None
\ No newline at end of file
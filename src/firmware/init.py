@@ -20,23 +20,25 @@ import settings
 settings.initialize()
 
 import asyncio
-import gc
 from system import hasnetwork, logexception
 from phew import logging
 from zxprinterdriver import RowServerAsync
 from producerconsumer import ProducerConsumer
 import ledprinter
 import fileprinter
+import render
 import physicalprinter
 import services
 import serialserver
 import sd
+import metrics
 
 if DEBUG:
     logging.enable_logging_types(logging.LOG_ALL)
     logging.logger = print
 else:
-    logging.logger = logging.rotatefile_logger
+    logging.start_buffered_logger()
+settings.start_background_save()
 
 def exceptionhandler(_, context):
     logexception(context["exception"])
@@ -47,6 +49,7 @@ sdmanager = sd.create()
 
 services.initialise(connectedpixel, sdmanager)
 fileprinter.initialise(sdmanager)
+render.initialise(sdmanager)
 if webenabled:
     import webserver
     webserver.initialize(connectedpixel)
@@ -62,11 +65,18 @@ eventloop.create_task(printserver.getproducer())
 eventloop.create_task(ledprinter.capture(printserver.addconsumer(), capturepixel))
 eventloop.create_task(fileprinter.capture(printserver.addconsumer()))
 eventloop.create_task(physicalprinter.capture(printserver.addconsumer()))
+if webenabled:
+    import mirrorprinter
+    eventloop.create_task(mirrorprinter.capture(printserver.addconsumer()))
 
 eventloop.create_task(serialserver.start())
 if webenabled:
     eventloop.create_task(webserver.start())
 
-gc.collect()
+metrics.collectgarbage()
 
-eventloop.run_forever()
+try:
+    eventloop.run_forever()
+finally:
+    settings.flush()
+    logging.flush()
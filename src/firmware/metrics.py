@@ -0,0 +1,139 @@
+import gc
+import time
+from micropython import const
+
+PREFIX = const("zxprinter_")
+
+# buckets in milliseconds, shared by the duration histograms
+DURATIONBUCKETS = (10, 50, 100, 500, 1000, 5000, 10000, 30000, 60000)
+LATENCYBUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+PAUSEBUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+registry = []
+
+def labelkey(value):
+    return "" if value is None else str(value)
+
+# a metric holds one value per label value, None being the unlabelled value
+class Metric:
+    def __init__(self, type, name, help, label=None, collect=None):
+        self.type = type
+        self.name = PREFIX + name
+        self.help = help
+        self.label = label
+        self.collect = collect  # called when read, returns a dict of label value -> value
+        self.values = {}
+        registry.append(self)
+
+    def labels(self, value, extra=None):
+        labels = []
+        if value is not None:
+            labels.append('%s="%s"' % (self.label, value))
+        if extra is not None:
+            labels.append(extra)
+        return "{" + ",".join(labels) + "}" if labels else ""
+
+    def current(self):
+        if self.collect is not None:
+            return self.collect()
+        return self.values
+
+    def text(self):
+        yield f"# HELP {self.name} {self.help}\n# TYPE {self.name} {self.type}\n"
+        for value, metric in self.current().items():
+            yield f"{self.name}{self.labels(value)} {metric}\n"
+
+    def json(self):
+        return {"type": self.type, "values": {labelkey(k): v for k, v in self.current().items()}}
+
+class Counter(Metric):
+    def __init__(self, name, help, label=None):
+        super().__init__("counter", name, help, label)
+
+    def inc(self, amount=1, label=None):
+        self.values[label] = self.values.get(label, 0) + amount
+
+class Gauge(Metric):
+    def __init__(self, name, help, label=None, collect=None):
+        super().__init__("gauge", name, help, label, collect)
+
+    def set(self, value, label=None):
+        self.values[label] = value
+
+# fixed buckets, each value is [bucket counts..., sum, count]
+class Histogram(Metric):
+    def __init__(self, name, help, buckets, label=None):
+        super().__init__("histogram", name, help, label)
+        self.buckets = buckets
+
+    def observe(self, value, label=None):
+        counts = self.values.get(label)
+        if counts is None:
+            counts = [0]*(len(self.buckets)+2)
+            self.values[label] = counts
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+                break
+        counts[-2] += value
+        counts[-1] += 1
+
+    def text(self):
+        yield f"# HELP {self.name} {self.help}\n# TYPE {self.name} histogram\n"
+        for value, counts in self.values.items():
+            total = 0
+            labels = self.labels(value)
+            for index, bound in enumerate(self.buckets):
+                total += counts[index]
+                yield "%s_bucket%s %d\n" % (self.name, self.labels(value, 'le="%s"' % bound), total)
+            yield "%s_bucket%s %d\n" % (self.name, self.labels(value, 'le="+Inf"'), counts[-1])
+            yield f"{self.name}_sum{labels} {counts[-2]}\n"
+            yield f"{self.name}_count{labels} {counts[-1]}\n"
+
+    def json(self):
+        values = {}
+        for value, counts in self.values.items():
+            values[labelkey(value)] = {
+                "buckets": {str(bound): count for bound, count in zip(self.buckets, counts)},
+                "sum": counts[-2],
+                "count": counts[-1]
+            }
+        return {"type": "histogram", "values": values}
+
+queuedepths = {}    # queue name -> function returning its depth
+
+def addqueue(name, depth):
+    queuedepths[name] = depth
+
+sdcachestats = None  # function returning the sd card cache's counts
+
+def setsdcache(stats):
+    global sdcachestats
+
+    sdcachestats = stats
+
+rowscaptured = Counter("rows_captured_total", "Rows captured from the ZX printer port")
+capturebytes = Counter("capture_bytes_total", "Compressed bytes written to capture files")
+captureduration = Histogram("capture_duration_ms", "Time taken to capture a printout", DURATIONBUCKETS)
+printduration = Histogram("print_duration_ms", "Time taken to print a printout", DURATIONBUCKETS, "source")
+portbytes = Counter("port_bytes_total", "Bytes written to printer ports", "port")
+portrate = Gauge("port_bytes_per_second", "Write rate of the last print to each port", "port")
+routelatency = Histogram("http_request_duration_ms", "Time taken to serve web requests", LATENCYBUCKETS, "route")
+queuedepth = Gauge("queue_depth", "Messages waiting in outbound queues", "queue",
+    lambda: {name: depth() for name, depth in queuedepths.items()})
+gcpause = Histogram("gc_pause_ms", "Time taken by garbage collections", PAUSEBUCKETS)
+sdcache = Metric("counter", "sd_cache_total", "SD card block cache hits, misses and write backs", "result",
+    lambda: {} if sdcachestats is None else sdcachestats())
+freeheap = Gauge("heap_free_bytes", "Free heap", collect=lambda: {None: gc.mem_free()})
+
+def collectgarbage():
+    start = time.ticks_ms()
+    gc.collect()
+    gcpause.observe(time.ticks_diff(time.ticks_ms(), start))
+
+def text():
+    for metric in registry:
+        yield from metric.text()
+
+def getmetrics():
+    return {metric.name: metric.json() for metric in registry}
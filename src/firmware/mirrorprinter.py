@@ -0,0 +1,95 @@
+from micropython import const
+from phew import server, logging
+from bitmap import packbits_encode
+from clientqueue import ClientQueue
+import metrics
+
+ROWBYTES        = const(32)
+FRAMEROWS       = const(8)      # rows batched into each frame
+QUEUEFRAMES     = const(16)     # frames held per client before dropping the oldest
+
+# binary frame header: type, flags, row count
+FRAME_START     = const(1)
+FRAME_ROWS      = const(2)
+FRAME_END       = const(3)
+
+FLAG_PACKBITS   = const(1)
+
+clients = {}     # websocket -> (client queue, wants packed frames)
+
+metrics.addqueue("mirror", lambda: sum(len(queue.items) for queue, _ in clients.values()))
+
+def sendall(type, rowcount=0, raw=None, packed=None):
+    rawframe = None
+    packedframe = None
+    for queue, wantspacked in list(clients.values()):
+        if wantspacked and packed is not None:
+            if packedframe is None:
+                packedframe = bytes((type, FLAG_PACKBITS, rowcount)) + bytes(packed)
+            queue.put(packedframe)
+        else:
+            if rawframe is None:
+                rawframe = bytes((type, 0, rowcount)) + (b"" if raw is None else bytes(raw))
+            queue.put(rawframe)
+
+class RowBatcher:
+    def __init__(self):
+        self.batch = bytearray(ROWBYTES*FRAMEROWS)
+        self.batchview = memoryview(self.batch)
+        self.compressed = bytearray(len(self.batch)*2)
+        self.compressedview = memoryview(self.compressed)
+        self.rowcount = 0
+
+    def add(self, row):
+        offset = self.rowcount*ROWBYTES
+        self.batchview[offset:offset+ROWBYTES] = row
+        self.rowcount += 1
+        if self.rowcount == FRAMEROWS:
+            self.flush()
+
+    def flush(self):
+        if self.rowcount == 0:
+            return
+        length = self.rowcount*ROWBYTES
+        packed = None
+        if any(wantspacked for _, wantspacked in clients.values()):
+            packed = self.compressedview[:packbits_encode(self.batch, length, self.compressed)]
+        sendall(FRAME_ROWS, self.rowcount, self.batchview[:length], packed)
+        self.rowcount = 0
+
+async def capture(rows):
+    batcher = RowBatcher()
+    while True:
+        started = False
+        async for row in rows:
+            if not clients:
+                continue
+            if not started:
+                started = True
+                sendall(FRAME_START)
+            batcher.add(row)
+        if started:
+            batcher.flush()
+            sendall(FRAME_END)
+
+async def mirror(websocket, packed):
+    queue = ClientQueue(websocket.send, QUEUEFRAMES, websocket.writer.close)
+    clients[websocket] = (queue, packed)
+    try:
+        while not queue.closed:
+            evt = await websocket.recv()
+            if evt is None or evt["type"] == "close":
+                break
+    finally:
+        clients.pop(websocket, None)
+        queue.close()
+        if queue.dropped:
+            logging.info(f"Mirror client dropped {queue.dropped} frames")
+
+@server.websocket("/mirror")
+async def mirrorraw(websocket):
+    await mirror(websocket, False)
+
+@server.websocket("/mirror/packbits")
+async def mirrorpacked(websocket):
+    await mirror(websocket, True)
@@ -25,6 +25,8 @@ def setaddress(newaddress):
     address = newaddress
 
 class NetworkPort(physicalprinter.Port):
+    name = "network"
+
     def __init__(self):
         self.sock = None
         self.writer = None
@@ -137,7 +139,7 @@ class EscprProtocol(physicalprinter.Protocol):
         self.y = 0
 
     async def write(self, data):
-        await physicalprinter.activeport.writeport(data)
+        await physicalprinter.writeport(data)
 
     async def writecmd(self, cmd, code, data=None, datalen=None):
         if data is None:
@@ -4,10 +4,16 @@ STATE_IDLE   = const(0)
 STATE_LITERAL = const(1)
 STATE_REPEAT  = const(2)
 MAX_LENGTH    = const(128)
+BUFFER_SIZE   = const(2048)  # a multiple of the 512 byte sector
 
+# output is gathered into a buffer of whole sectors, so the file is written
+# a sector at a time rather than a few bytes at a time
 class PackBitsFile:
-    def __init__(self, filename):
+    def __init__(self, filename, buffersize=BUFFER_SIZE):
         self._file = open(filename, 'wb')
+        self._buffer = bytearray(buffersize)
+        self._bufferview = memoryview(self._buffer)
+        self._bufferlen = 0
         self._state =  STATE_IDLE
         self._lastbyte = 0
         self._literal = bytearray(MAX_LENGTH+1)
@@ -23,12 +29,35 @@ class PackBitsFile:
     def __exit__(self, type, value, tb):
         self.close()
 
+    def _flushbuffer(self):
+        if self._bufferlen > 0:
+            self._file.write(self._bufferview[0:self._bufferlen])
+            self._bufferlen = 0
+
+    def _put(self, data):
+        bufferlen = self._bufferlen
+        length = len(data)
+        if bufferlen+length < len(self._buffer):
+            self._buffer[bufferlen:bufferlen+length] = data
+            self._bufferlen = bufferlen+length
+            return
+        # it fills the buffer, so it's written out part way through
+        start = 0
+        end = len(data)
+        while start < end:
+            length = min(end-start, len(self._buffer)-self._bufferlen)
+            self._bufferview[self._bufferlen:self._bufferlen+length] = data[start:start+length]
+            self._bufferlen += length
+            start += length
+            if self._bufferlen == len(self._buffer):
+                self._flushbuffer()
+
     def _writeliteral(self):
         litlen = self._literallen
         if litlen>0:
             self._literalbytes[0] = litlen-1
-            self._file.write(self._literalbytes)
-            self._file.write(self._literalview[0:litlen])
+            self._put(self._literalbytes)
+            self._put(self._literalview[0:litlen])
             self._literallen = 0
 
     def _writerepeat(self):
@@ -36,7 +65,7 @@ class PackBitsFile:
             repeatsize = self._repeat if self._repeat <= MAX_LENGTH else MAX_LENGTH-1
             self._repeatbytes[0] = 256-repeatsize+1
             self._repeatbytes[1] = self._lastbyte
-            self._file.write(self._repeatbytes)
+            self._put(self._repeatbytes)
             self._repeat -= repeatsize
 
     def write(self, byte):
@@ -69,6 +98,7 @@ class PackBitsFile:
             self.write(self._lastbyte)
         elif self._state == STATE_REPEAT:
             self.write(None)
+        self._flushbuffer()
         return self._file.close()
 
 class UnpackBitsFile:
@@ -127,3 +157,52 @@ class UnpackBitsFile:
 
     def close(self):
         self._file.close()
+
+# length of the unpacked data, found by walking the flag bytes and
+# skipping over literal runs rather than unpacking them
+def unpackedlength(filename):
+    length = 0
+    flag = bytearray(1)
+    with open(filename, 'rb') as file:
+        while file.readinto(flag):
+            flagcounter = flag[0]
+            if flagcounter == 128:      # ignore
+                continue
+            if flagcounter > 128:       # repeat
+                file.seek(1, 1)
+                length += 257 - flagcounter
+            else:                       # literal
+                file.seek(flagcounter + 1, 1)
+                length += flagcounter + 1
+    return length
+
+# checks a stream of packed data as it arrives, a run cut short at the end
+# is the only thing that makes packed data invalid
+class PackBitsValidator:
+    def __init__(self):
+        self.pending = 0    # data bytes still to come for the current run
+        self.length = 0     # unpacked length so far
+
+    def feed(self, data, count):
+        pos = 0
+        pending = self.pending
+        while pos < count:
+            if pending > 0:
+                skip = min(pending, count-pos)
+                pos += skip
+                pending -= skip
+                continue
+            flagcounter = data[pos]
+            pos += 1
+            if flagcounter == 128:      # ignore
+                continue
+            if flagcounter > 128:       # repeat
+                pending = 1
+                self.length += 257 - flagcounter
+            else:                       # literal
+                pending = flagcounter + 1
+                self.length += flagcounter + 1
+        self.pending = pending
+
+    def iscomplete(self):
+        return self.pending == 0
@@ -2,6 +2,8 @@ from parallelprinterdriver import printbytesdmaasync
 import physicalprinter
 
 class ParallelPort(physicalprinter.Port):
+    name = "parallel"
+
     async def writeport(self, line):
         await printbytesdmaasync(line)
 
@@ -1,4 +1,5 @@
-import machine, os, gc
+import machine, os, gc, time
+import asyncio
 
 log_file = "/log.txt"
 log1_file = f"/{log_file}.1"
@@ -94,10 +95,26 @@ def truncate(file, target_size):
   os.rename(file + ".tmp", file)
 
 
+# free memory only changes a little between log calls, so it's sampled
+# at most every _mem_free_interval_ms rather than walking the heap each time
+_mem_free_interval_ms = 500
+_mem_free_kb = 0
+_mem_free_time = None
+
+def mem_free_kb():
+  global _mem_free_kb, _mem_free_time
+  now = time.ticks_ms()
+  if _mem_free_time is None or time.ticks_diff(now, _mem_free_time) >= _mem_free_interval_ms:
+    _mem_free_kb = round(gc.mem_free() / 1024)
+    _mem_free_time = now
+  return _mem_free_kb
+
 def log(level, text):
   datetime = datetime_string()
-  log_entry = "{0} [{1:8} /{2:>4}kB] {3}".format(datetime, level, round(gc.mem_free() / 1024), text)
+  log_entry = "{0} [{1:8} /{2:>4}kB] {3}".format(datetime, level, mem_free_kb(), text)
   logger(log_entry)
+  if level == "error" or level == "exception":
+    flush()
 
 def info(*items):
   if _logging_types & LOG_INFO:
@@ -135,6 +152,139 @@ def rotatefile_logger(log_entry):
     file_remove(log1_file)
     os.rename(log_file, log1_file)
 
+# buffered logging: entries are kept in ram and appended to the log file in
+# batches by a background task, either every _flush_interval_ms or once
+# _flush_watermark entries are waiting. the log sizes are tracked in memory
+# so rotating doesn't need a stat per entry.
+_flush_interval_ms = 2000
+_flush_watermark = 16
+_buffer_limit = 64
+_buffer = []
+_flush_event = asyncio.Event()
+_listeners = []
+
+# positions in the log are byte offsets into log1_file followed by log_file,
+# counted from when the device started so they keep increasing across
+# rotations. _line_starts remembers where the most recent lines begin.
+_log_origin = 0
+_log1_size = None
+_log_size = None
+_line_index_limit = 256
+_line_starts = []
+_line_index_built = False
+
+def set_flush_thresholds(interval_ms, watermark, limit):
+  global _flush_interval_ms, _flush_watermark, _buffer_limit
+  _flush_interval_ms = interval_ms
+  _flush_watermark = watermark
+  _buffer_limit = limit
+
+def add_listener(listener):
+  _listeners.append(listener)
+
+def remove_listener(listener):
+  if listener in _listeners:
+    _listeners.remove(listener)
+
+def buffered_logger(log_entry):
+  _buffer.append(log_entry)
+  for listener in _listeners:
+    listener(log_entry)
+  if len(_buffer) >= _buffer_limit:
+    flush() # the flush task isn't keeping up, so don't let ram grow
+  elif len(_buffer) >= _flush_watermark:
+    _flush_event.set()
+
+def _load_sizes():
+  global _log1_size, _log_size
+  if _log_size is None:
+    _log1_size = file_size(log1_file) or 0
+    _log_size = file_size(log_file) or 0
+
+def _add_line_start(position):
+  _line_starts.append(position)
+  if len(_line_starts) > _line_index_limit:
+    _line_starts.pop(0)
+
+# writes out any buffered entries, rotating the log if it's grown too big
+def flush():
+  global _buffer, _log_origin, _log1_size, _log_size
+  if not _buffer:
+    return
+  entries = _buffer
+  _buffer = []
+  _load_sizes()
+  position = _log_origin + _log1_size + _log_size
+  with open(log_file, "ab") as logfile:
+    for entry in entries:
+      data = entry.encode()
+      logfile.write(data)
+      logfile.write(b"\n")
+      if _line_index_built:
+        _add_line_start(position)
+      position += len(data) + 1
+  _log_size = position - _log_origin - _log1_size
+  if _log_truncate_at and _log_size > _log_truncate_at:
+    file_remove(log1_file)
+    os.rename(log_file, log1_file)
+    _log_origin += _log1_size
+    _log1_size = _log_size
+    _log_size = 0
+
+async def _flush_task():
+  while True:
+    try:
+      await asyncio.wait_for_ms(_flush_event.wait(), _flush_interval_ms)
+    except asyncio.TimeoutError:
+      pass
+    _flush_event.clear()
+    flush()
+
+def start_buffered_logger():
+  global logger
+  logger = buffered_logger
+  asyncio.create_task(_flush_task())
+
+# the first and one past the last position currently in the log files
+def log_range():
+  flush()
+  _load_sizes()
+  return _log_origin, _log_origin + _log1_size + _log_size
+
+def _log_segments():
+  return ((log1_file, _log_origin, _log1_size), (log_file, _log_origin + _log1_size, _log_size))
+
+# reads the lines between two positions, yielding each with its position
+def read_log(start, end):
+  for filename, base, size in _log_segments():
+    if start >= base + size or end <= base:
+      continue
+    position = max(start, base)
+    with open(filename, "rb") as logfile:
+      logfile.seek(position - base)
+      while position < end:
+        line = logfile.readline()
+        if not line:
+          break
+        yield position, line
+        position += len(line)
+
+# the position of the start of the nth line from the end of the log
+def tail_position(lines):
+  global _line_index_built
+  start, end = log_range()
+  if not _line_index_built:
+    for position, _ in read_log(start, end):
+      _add_line_start(position)
+    _line_index_built = True
+  while _line_starts and _line_starts[0] < start:
+    _line_starts.pop(0)
+  if lines <= 0:
+    return end
+  if lines >= len(_line_starts):
+    return _line_starts[0] if _line_starts else start
+  return _line_starts[-lines]
+
 def combined_logger(log_entry):
   print(log_entry)
   truncatefile_logger(log_entry)
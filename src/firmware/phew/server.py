@@ -1,5 +1,5 @@
 import asyncio, os, time
-from . import logging
+from . import logging, trace
 from hashlib import sha1
 from binascii import b2a_base64
 import struct
@@ -10,6 +10,10 @@ catchall_handler = None
 exception_handler = None
 loop = asyncio.get_event_loop()
 
+_span_headers = trace.span("http headers")
+_span_handler = trace.span("http handler")
+_span_response = trace.span("http response")
+
 
 def file_exists(filename):
   try:
@@ -53,12 +57,20 @@ class Request:
     self.form = {}
     self.data = {}
     self.query = {}
+    self.reader = None
+    self.content_length = None
     query_string_start = uri.find("?") if uri.find("?") != -1 else len(uri)
     self.path = uri[:query_string_start]
     self.query_string = uri[query_string_start + 1:]
     if self.query_string:
       self.query = _parse_query_string(self.query_string)
 
+  # reads the next part of a body the server hasn't already parsed, so a
+  # handler can stream it, each read has to complete within the body timeout
+  async def readinto(self, buf):
+    deadline = time.ticks_add(time.ticks_ms(), body_timeout_ms)
+    return await _read_until(self.reader.readinto(buf), deadline)
+
   def __str__(self):
     return f"""\
 request: {self.method} {self.path} {self.protocol}
@@ -93,14 +105,17 @@ content_type_map = {
   "css": "text/css",
   "js": "text/javascript",
   "csv": "text/csv",
+  "bmp": "image/bmp",
+  "pbm": "image/x-portable-bitmap",
 }
 
 
 class FileResponse(Response):
-  def __init__(self, file, status=200, headers={}):
+  def __init__(self, file, status=200, headers={}, onclose=None):
     self.status = 404
     self.headers = headers
     self.file = file
+    self.onclose = onclose  # called once the file has been sent, or failed to be
 
     try:
       if (os.stat(self.file)[0] & 0x4000) == 0:
@@ -183,6 +198,7 @@ class WebSocket:
     def __init__(self, reader, writer):
         self.reader = reader
         self.writer = writer
+        self.query = {}
 
     async def recv(self):
         reader = self.reader
@@ -235,18 +251,257 @@ class WebSocket:
         await writer.drain()
 
 
+# size of the buffer used to coalesce response writes, defaults to
+# the lwip tcp mss so each drain sends one full segment
+send_buffer_size = 1460
+_send_buffers = []
+
+def set_send_buffer_size(size):
+  global send_buffer_size
+  send_buffer_size = size
+  _send_buffers.clear()
+
+
+# batches small response writes (such as single characters yielded by a
+# generator body) into a preallocated buffer and only drains when it's full
+class _ResponseWriter:
+  def __init__(self, writer):
+    self.writer = writer
+    self.buffer = _send_buffers.pop() if _send_buffers else bytearray(send_buffer_size)
+    self.view = memoryview(self.buffer)
+    self.length = 0
+
+  async def write(self, data):
+    if isinstance(data, str):
+      data = data.encode()
+    datalen = len(data)
+    if self.length + datalen > len(self.buffer):
+      await self.flush()
+      if datalen >= len(self.buffer):
+        self.writer.write(data)
+        await self.writer.drain()
+        return
+    self.view[self.length:self.length + datalen] = data
+    self.length += datalen
+
+  async def writefile(self, file):
+    while True:
+      # the headers may have filled the buffer exactly
+      if self.length == len(self.buffer):
+        await self.flush()
+      bytecount = file.readinto(self.view[self.length:])
+      if not bytecount:
+        break
+      self.length += bytecount
+
+  async def flush(self):
+    if self.length:
+      self.writer.write(self.view[0:self.length])
+      await self.writer.drain()
+      self.length = 0
+
+  def release(self):
+    if len(self.buffer) == send_buffer_size:
+      _send_buffers.append(self.buffer)
+    self.buffer = None
+    self.view = None
+
+
+# connection admission and slow client limits, a device with a couple of
+# hundred kB of ram can't afford to hold many idle or trickling connections
+max_connections = 4
+header_timeout_ms = 5000
+body_timeout_ms = 10000
+max_header_count = 32
+max_header_size = 1024
+max_body_size = 16 * 1024
+retry_after = 2
+# requests no longer churn the heap, so only collect when it's getting low
+gc_free_threshold = 32 * 1024
+_admitted = set()
+
+def set_limits(connections=None, header_timeout=None, body_timeout=None,
+               header_count=None, header_size=None, body_size=None):
+  global max_connections, header_timeout_ms, body_timeout_ms
+  global max_header_count, max_header_size, max_body_size
+  if connections is not None:
+    max_connections = connections
+  if header_timeout is not None:
+    header_timeout_ms = header_timeout
+  if body_timeout is not None:
+    body_timeout_ms = body_timeout
+  if header_count is not None:
+    max_header_count = header_count
+  if header_size is not None:
+    max_header_size = header_size
+  if body_size is not None:
+    max_body_size = body_size
+
+
+class _RequestError(Exception):
+  def __init__(self, status):
+    super().__init__(status)
+    self.status = status
+
+
+request_observer = None
+garbage_collector = gc.collect
+
+# called with the route pattern, status and time taken after each response
+def set_request_observer(observer):
+  global request_observer
+  request_observer = observer
+
+def set_garbage_collector(collector):
+  global garbage_collector
+  garbage_collector = collector
+
+# waits for a read to complete before the deadline, or fails the request
+async def _read_until(awaitable, deadline):
+  if deadline is None:
+    return await awaitable
+  remaining = time.ticks_diff(deadline, time.ticks_ms())
+  if remaining <= 0:
+    raise _RequestError(408)
+  try:
+    return await asyncio.wait_for_ms(awaitable, remaining)
+  except asyncio.TimeoutError:
+    raise _RequestError(408)
+
+
+# only these headers are kept, the rest are skipped without being decoded
+_wanted_headers = {}
+_header_buffers = []
+
+def want_header(name):
+  name = name.lower()
+  _wanted_headers.setdefault(len(name), []).append((name, name.encode()))
+
+for _name in ("host", "content-length", "content-type", "content-disposition",
+              "accept", "accept-encoding", "range", "if-none-match", "connection",
+              "upgrade", "sec-websocket-key", "sec-websocket-version"):
+  want_header(_name)
+
+
+@micropython.viper
+def _find_byte(buf: ptr8, start: int, end: int, byte: int) -> int:
+  i = start
+  while i < end:
+    if buf[i] == byte:
+      return i
+    i += 1
+  return -1
+
+
+# case insensitive compare against a lower case name
+@micropython.viper
+def _match_name(buf: ptr8, start: int, name: ptr8, length: int) -> bool:
+  i = 0
+  while i < length:
+    if (buf[start + i] | 0x20) != name[i]:
+      return False
+    i += 1
+  return True
+
+
+# reads the request into a reusable buffer so header lines can be looked at
+# in place, anything read past the headers is handed out before reading
+# from the stream again
+class _RequestReader:
+  def __init__(self, reader):
+    self.reader = reader
+    self.buffer = _header_buffers.pop() if _header_buffers else bytearray(max_header_size)
+    self.view = memoryview(self.buffer)
+    self.start = 0
+    self.end = 0
+
+  async def _fill(self, deadline, toolong_status):
+    if self.start > 0:
+      remaining = self.end - self.start
+      self.buffer[0:remaining] = self.view[self.start:self.end]
+      self.start = 0
+      self.end = remaining
+    if self.end == len(self.buffer):
+      raise _RequestError(toolong_status)
+    count = await _read_until(self.reader.readinto(self.view[self.end:]), deadline)
+    if not count:
+      raise _RequestError(400)
+    self.end += count
+
+  # returns the bounds of the next line in the buffer, without the line end
+  async def readlinebounds(self, deadline, toolong_status=431):
+    while True:
+      lineend = _find_byte(self.buffer, self.start, self.end, 10) if self.buffer else -1
+      if lineend != -1:
+        linestart = self.start
+        self.start = lineend + 1
+        if lineend > linestart and self.buffer[lineend - 1] == 13:
+          lineend -= 1
+        return linestart, lineend
+      await self._fill(deadline, toolong_status)
+
+  def _take(self, size):
+    size = min(size, self.end - self.start)
+    data = bytes(self.view[self.start:self.start + size])
+    self.start += size
+    return data
+
+  async def read(self, size=-1):
+    if self.start < self.end:
+      return self._take(self.end - self.start if size < 0 else size)
+    return await self.reader.read(size)
+
+  async def readexactly(self, size):
+    data = self._take(size) if self.start < self.end else b""
+    if len(data) < size:
+      data += await self.reader.readexactly(size - len(data))
+    return data
+
+  async def readinto(self, buf):
+    if self.start < self.end:
+      size = min(len(buf), self.end - self.start)
+      buf[0:size] = self.view[self.start:self.start + size]
+      self.start += size
+      return size
+    return await self.reader.readinto(buf)
+
+  async def readline(self):
+    if self.start < self.end:
+      lineend = _find_byte(self.buffer, self.start, self.end, 10)
+      if lineend != -1:
+        return self._take(lineend + 1 - self.start)
+      return self._take(self.end - self.start) + await self.reader.readline()
+    return await self.reader.readline()
+
+  # hands the buffer back once nothing buffered is left to read
+  def release(self):
+    if self.buffer is not None and self.start >= self.end:
+      if len(self.buffer) == max_header_size:
+        _header_buffers.append(self.buffer)
+      self.buffer = None
+      self.view = None
+
+
 # parses the headers for a http request (or the headers attached to
-# each field in a multipart/form-data)
-async def _parse_headers(reader):
+# each field in a multipart/form-data), keeping only the wanted ones
+async def _parse_headers(reader, deadline=None):
   headers = {}
+  count = 0
   while True:
-    header_line = await reader.readline()
-    if header_line == b"\r\n": # crlf denotes body start
+    start, end = await reader.readlinebounds(deadline)
+    if start == end: # blank line denotes body start
       break
-    header_split = header_line.decode().strip().split(": ", 1)
-    name = header_split[0]
-    value = "" if len(header_split) == 1 else header_split[1]
-    headers[name.lower()] = value
+    count += 1
+    if count > max_header_count:
+      raise _RequestError(431)
+    buffer = reader.buffer
+    colon = _find_byte(buffer, start, end, 58)
+    if colon == -1:
+      continue
+    for name, encoded in _wanted_headers.get(colon - start, ()):
+      if _match_name(buffer, start, encoded, len(encoded)):
+        headers[name] = bytes(reader.view[colon + 1:end]).decode().strip()
+        break
   return headers
 
 
@@ -288,11 +543,21 @@ async def _parse_form_data(reader, headers):
   return None
 
 
+# a non-negative integer, or the request is rejected
+def _parse_content_length(headers):
+  length = headers.get("content-length")
+  if length is None:
+    return None
+  length = length.strip()
+  if not length.isdigit():
+    raise _RequestError(400)
+  return int(length)
+
+
 # if the content type is application/json then parse the body
-async def _parse_json_body(reader, headers):
+async def _parse_json_body(reader, content_length):
   import json
-  content_length_bytes = int(headers["content-length"])
-  body = await reader.readexactly(content_length_bytes)
+  body = await reader.readexactly(content_length)
   return json.loads(body.decode())
 
 
@@ -306,51 +571,110 @@ status_message_map = {
   400: "Bad Request", 401: "Unauthorized", 403: "Forbidden",
   404: "Not Found", 405: "Method Not Allowed", 406: "Not Acceptable",
   408: "Request Timeout", 409: "Conflict", 410: "Gone",
+  411: "Length Required",
+  413: "Payload Too Large",
   414: "URI Too Long", 415: "Unsupported Media Type",
   416: "Range Not Satisfiable", 418: "I'm a teapot",
-  500: "Internal Server Error", 501: "Not Implemented"
+  431: "Request Header Fields Too Large",
+  500: "Internal Server Error", 501: "Not Implemented",
+  503: "Service Unavailable"
 }
 
 
-# handle an incoming request to the web server
+# bodies of these types are read and parsed before the handler is called
+_parsed_content_types = ("multipart/form-data", "application/json", "application/x-www-form-urlencoded")
+
+
+# answers without reading the request, used when refusing a connection
+async def _reject(writer, status, headers={}):
+  status_message = status_message_map.get(status, "Unknown")
+  try:
+    writer.write(f"HTTP/1.1 {status} {status_message}\r\n".encode("ascii"))
+    for key, value in headers.items():
+      writer.write(f"{key}: {value}\r\n".encode("ascii"))
+    writer.write(b"Content-Length: 0\r\nConnection: close\r\n\r\n")
+    await asyncio.wait_for_ms(writer.drain(), header_timeout_ms)
+  except Exception:
+    pass
+  writer.close()
+  await writer.wait_closed()
+
+
+# handle an incoming request to the web server, refusing it when there
+# are already too many in progress
 async def _handle_request(reader, writer):
+  if len(_admitted) >= max_connections:
+    await _reject(writer, 503, {"Retry-After": retry_after})
+    return
+  _admitted.add(writer)
+  request_reader = _RequestReader(reader)
+  try:
+    await _serve_request(request_reader, writer)
+  except _RequestError as e:
+    await _reject(writer, e.status)
+  finally:
+    _admitted.discard(writer)
+    request_reader.release()
+
+
+async def _serve_request(reader, writer):
   response = None
 
   request_start_time = time.ticks_ms()
+  header_deadline = time.ticks_add(request_start_time, header_timeout_ms)
 
-  request_line = await reader.readline()
+  start, end = await reader.readlinebounds(header_deadline, 414)
   try:
-    method, uri, protocol = request_line.decode().split()
+    method, uri, protocol = bytes(reader.view[start:end]).decode().split()
   except Exception as e:
     writer.close()
     await writer.wait_closed()
     return
 
   request = Request(method, uri, protocol)
-  request.headers = await _parse_headers(reader)
-  if "content-length" in request.headers and "content-type" in request.headers:
+  trace.begin(_span_headers)
+  request.headers = await _parse_headers(reader, header_deadline)
+  trace.end(_span_headers)
+  request.reader = reader
+  request.content_length = _parse_content_length(request.headers)
+  if request.content_length is not None and "content-type" in request.headers:
+    content_type = request.headers["content-type"]
+    is_parsed = any(content_type.startswith(t) for t in _parsed_content_types)
+    if is_parsed and request.content_length > max_body_size:
+      raise _RequestError(413)
+    body_deadline = time.ticks_add(time.ticks_ms(), body_timeout_ms)
     if request.headers["content-type"].startswith("multipart/form-data"):
-      request.form = await _parse_form_data(reader, request.headers)
+      request.form = await _read_until(_parse_form_data(reader, request.headers), body_deadline)
     if request.headers["content-type"].startswith("application/json"):
-      request.data = await _parse_json_body(reader, request.headers)
+      request.data = await _read_until(_parse_json_body(reader, request.content_length), body_deadline)
     if request.headers["content-type"].startswith("application/x-www-form-urlencoded"):
-      form_data = await reader.read(int(request.headers["content-length"]))
+      form_data = await _read_until(reader.read(request.content_length), body_deadline)
       request.form = _parse_query_string(form_data.decode())
 
   route = _match_route(request)
   if route:
     if route.iswebsocket:
+      # long lived, so doesn't hold on to a connection slot
+      _admitted.discard(writer)
+      reader.release()
       websocket = await WebSocket.upgrade(request.headers, reader, writer)
+      websocket.query = request.query
       await route.handler(websocket)
       await writer.wait_closed()
       return
+    trace.begin(_span_handler)
     try:
       response = await route.call_handler(request)
+    except _RequestError:
+      # a body read that timed out, answered with its own status
+      raise
     except Exception as e:
       if exception_handler:
         response = exception_handler(request, e)
       else:
         raise
+    finally:
+      trace.end(_span_handler)
   elif catchall_handler:
     response = catchall_handler(request)
 
@@ -372,44 +696,48 @@ async def _handle_request(reader, writer):
     if hasattr(body, '__len__'):
       response.add_header("Content-Length", len(body))
 
-  # write status line
-  status_message = status_message_map.get(response.status, "Unknown")
-  writer.write(f"HTTP/1.1 {response.status} {status_message}\r\n".encode("ascii"))
-
-  # write headers
-  for key, value in response.headers.items():
-    writer.write(f"{key}: {value}\r\n".encode("ascii"))
-
-  # blank line to denote end of headers
-  writer.write("\r\n".encode("ascii"))
-
-  if isinstance(response, FileResponse):
-    # file
-    chunk = bytearray(1024)
-    chunkview = memoryview(chunk)
-    with open(response.file, "rb") as f:
-      while True:
-        bytecount = f.readinto(chunk)
-        if not bytecount:
-          break
-        writer.write(chunkview[0:bytecount])
-        await writer.drain()
-  elif type(response.body).__name__ == "generator":
-    # generator
-    for chunk in response.body:
-      writer.write(chunk)
-      await writer.drain()
-  else:
-    # string/bytes
-    writer.write(response.body)
-    await writer.drain()
+  sender = _ResponseWriter(writer)
+  trace.begin(_span_response)
+  try:
+    # write status line
+    status_message = status_message_map.get(response.status, "Unknown")
+    await sender.write(f"HTTP/1.1 {response.status} {status_message}\r\n")
+
+    # write headers
+    for key, value in response.headers.items():
+      await sender.write(f"{key}: {value}\r\n")
+
+    # blank line to denote end of headers
+    await sender.write(b"\r\n")
+
+    if isinstance(response, FileResponse):
+      # file
+      with open(response.file, "rb") as f:
+        await sender.writefile(f)
+    elif type(response.body).__name__ == "generator":
+      # generator
+      for chunk in response.body:
+        await sender.write(chunk)
+    else:
+      # string/bytes
+      await sender.write(response.body)
+
+    await sender.flush()
+  finally:
+    trace.end(_span_response)
+    sender.release()
+    if isinstance(response, FileResponse) and response.onclose:
+      response.onclose()
 
   writer.close()
   await writer.wait_closed()
 
   processing_time = time.ticks_ms() - request_start_time
   logging.info(f"> {request.method} {request.path} ({response.status} {status_message}) [{processing_time}ms]")
-  gc.collect()
+  if request_observer:
+    request_observer(route.path if route else "*", response.status, processing_time)
+  if gc.mem_free() < gc_free_threshold:
+    garbage_collector()
 
 # adds a new route to the routing table
 def _add_route(route):
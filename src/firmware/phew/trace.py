@@ -0,0 +1,109 @@
+import time, array
+
+# span tracing into a preallocated ring of (ticks_us, span << 1 | phase)
+# records. callers use trace.begin/trace.end through the module, which point
+# at a function that does nothing until tracing is enabled.
+_default_capacity = 2048
+_names = []
+_records = None
+_capacity = 0
+_index = 0
+_count = 0
+
+_END = 1
+
+def span(name):
+  _names.append(name)
+  return len(_names) - 1
+
+def _off(span):
+  pass
+
+def _record(word):
+  global _index, _count
+  index = _index << 1
+  _records[index] = time.ticks_us()
+  _records[index + 1] = word
+  _index += 1
+  if _index == _capacity:
+    _index = 0
+  _count += 1
+
+def _begin(span):
+  _record(span << 1)
+
+def _end(span):
+  _record((span << 1) | _END)
+
+begin = _off
+end = _off
+
+def is_enabled():
+  return begin is _begin
+
+def enable(capacity=None):
+  global begin, end, _records, _capacity
+  capacity = capacity or _capacity or _default_capacity
+  if _records is None or capacity != _capacity:
+    _records = array.array("I", (0 for _ in range(capacity * 2)))
+    _capacity = capacity
+  clear()
+  begin = _begin
+  end = _end
+
+def disable():
+  global begin, end
+  begin = _off
+  end = _off
+
+def clear():
+  global _index, _count
+  _index = 0
+  _count = 0
+
+def status():
+  return {
+    "enabled": is_enabled(),
+    "capacity": _capacity,
+    "recorded": _count,
+    "dropped": max(0, _count - _capacity)
+  }
+
+# the recorded spans, oldest first, as chrome trace-event json. each span
+# name gets its own track, with overlapping spans of the same name, as from
+# concurrent requests, on tracks of their own. recording goes on while the
+# dump is sent, so it stops at the first record that's been overwritten.
+def dump():
+  records = _records
+  capacity = _capacity
+  count = min(_count, capacity)
+  first = _count - count  # the number of the oldest record
+  index = (_index - count) % capacity if capacity else 0
+  spancount = len(_names)
+  depths = bytearray(spancount)  # spans of each name that have begun
+  yield '{"displayTimeUnit":"ms","traceEvents":['
+  timestamp = 0
+  last = None
+  for number in range(count):
+    if _records is not records or _count < first or _count - (first + number) > capacity:
+      break
+    ticks = records[index << 1]
+    word = records[(index << 1) + 1]
+    if last is not None:
+      timestamp += time.ticks_diff(ticks, last)
+    last = ticks
+    span = word >> 1
+    if word & _END:
+      if depths[span]:
+        depths[span] -= 1
+      depth = depths[span]
+    else:
+      depth = depths[span]
+      if depth < 255:
+        depths[span] = depth + 1
+    yield '%s{"name":"%s","ph":"%s","ts":%d,"pid":1,"tid":%d}' % (
+      "," if number else "", _names[span], "E" if word & _END else "B", timestamp, span + depth * spancount)
+    index += 1
+    if index == capacity:
+      index = 0
+  yield ']}'
@@ -2,9 +2,10 @@
 
 from micropython import const
 from asyncio import Lock
-from phew import logging
+from phew import logging, trace
 from packbits import UnpackBitsFile
 import time
+import metrics
 
 # NOTE: only supports ESC/P and ESC/POS
 
@@ -34,7 +35,12 @@ linebytes = const(32)
 
 printerlock = Lock()
 
+SPAN_WRITEROW = trace.span("writerow")
+SPAN_WRITEPORT = trace.span("writeport")
+
 class Port:
+    name = "null"
+
     async def openport(self):
         pass
 
@@ -52,6 +58,17 @@ def setport(port):
 
     activeport = port
 
+byteswritten = 0
+
+# all protocol output goes through here so it can be counted
+async def writeport(data):
+    global byteswritten
+
+    byteswritten += len(data)
+    trace.begin(SPAN_WRITEPORT)
+    await activeport.writeport(data)
+    trace.end(SPAN_WRITEPORT)
+
 def setenabled(state):
     global enabled
 
@@ -102,20 +119,20 @@ class EscpProtocol(Protocol):
     async def begin(self):
         self.row = 7
         fillarray(self.buffer, len(self.buffer), 0)
-        await activeport.writeport(b"\x1b@")               # initialize printer
-        await activeport.writeport(b"\x1b3%c" % 24)        # set line spacing 24/180=8*1/60 (i.e. 8 dots @60 dpi)
-        await activeport.writeport(b"\x1bP")               # set pitch to 10cpi
-        await activeport.writeport(b"\x1bl%c" % leftmargin)# set left margin
+        await writeport(b"\x1b@")               # initialize printer
+        await writeport(b"\x1b3%c" % 24)        # set line spacing 24/180=8*1/60 (i.e. 8 dots @60 dpi)
+        await writeport(b"\x1bP")               # set pitch to 10cpi
+        await writeport(b"\x1bl%c" % leftmargin)# set left margin
         await self.endofline()
 
     async def endofline(self):
-        await activeport.writeport(b"\r")
+        await writeport(b"\r")
         if linefeed:
-            await activeport.writeport(b"\n")
+            await writeport(b"\n")
 
     async def writeline(self, buffer):
-        await activeport.writeport(b"\x1b*%c\x00%c" % (dotdensity, xscale))
-        await activeport.writeport(buffer)
+        await writeport(b"\x1b*%c\x00%c" % (dotdensity, xscale))
+        await writeport(buffer)
         await self.endofline()
 
     async def writerow(self, rowbuffer):
@@ -138,10 +155,10 @@ class EscpProtocol(Protocol):
         if self.row != 7:
             await self.writeline(self.buffer)
         if formfeed:
-            await activeport.writeport(b"\r\f")
+            await writeport(b"\r\f")
         else:
             await self.endofline()
-        await activeport.writeport(b"\x1b@")               # initialize printer
+        await writeport(b"\x1b@")               # initialize printer
 
 escpprotocol = EscpProtocol()
 activeprotocol = escpprotocol
@@ -161,7 +178,9 @@ async def writeopen():
     await activeprotocol.begin()
 
 async def writerow(row):
+    trace.begin(SPAN_WRITEROW)
     await activeprotocol.writerow(row)
+    trace.end(SPAN_WRITEROW)
 
 async def writeclose():
     await activeprotocol.end()
@@ -186,6 +205,7 @@ class FileRowGeneratorAsync:
 
 async def printrows(rows, message, prefix, isforever):
     starttime = None
+    startbytes = 0
     opened = False
     locked = False
     logging.info(message)
@@ -199,6 +219,9 @@ async def printrows(rows, message, prefix, isforever):
                 if not locked:
                     locked = True
                     await printerlock.acquire() # type: ignore
+                    # the count is shared, so this print's bytes are what it
+                    # adds once it has the printer
+                    startbytes = byteswritten
                 if not opened:
                     opened = True
                     await writeopen()
@@ -209,6 +232,10 @@ async def printrows(rows, message, prefix, isforever):
             if starttime is not None:
                 printtime = time.ticks_diff(time.ticks_ms(), starttime)
                 logging.info(f"{prefix} print time: {printtime} ms")
+                metrics.printduration.observe(printtime, prefix)
+                printbytes = byteswritten - startbytes
+                metrics.portbytes.inc(printbytes, activeport.name)
+                metrics.portrate.set(printbytes*1000//max(printtime, 1), activeport.name)
                 logging.info(f"{prefix} print finished")
                 starttime = None
         finally:
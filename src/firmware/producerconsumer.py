@@ -1,4 +1,7 @@
 import asyncio
+from phew import trace
+
+SPAN_FANOUT = trace.span("fanout")
 
 # from https://github.com/peterhinch/micropython-async/blob/master/v3/primitives/barrier.py
 class Barrier:
@@ -7,13 +10,11 @@ class Barrier:
         self._count = participants
         self._evt = asyncio.Event()
 
-    def __await__(self):
+    async def wait(self):
         if self.trigger():
             return  # Other tasks have already reached barrier
         # Wait until last task reaches it
-        await self._evt.wait()  # type: ignore
-
-    __iter__ = __await__
+        await self._evt.wait()
 
     def addparticipant(self):
         self._participants += 1
@@ -40,8 +41,10 @@ class Producer:
 
     async def _setdata(self, value):
         self.data = value
-        await self._barrier
-        await self._barrier
+        trace.begin(SPAN_FANOUT)
+        await self._barrier.wait()
+        await self._barrier.wait()
+        trace.end(SPAN_FANOUT)
 
     async def getproducer(self):
         while True:
@@ -66,11 +69,11 @@ class Consumer:
         return data
 
     async def __anext__(self):
-        await self._barrier
+        await self._barrier.wait()
         if self._first:
             self._first = False
             return self._getdata()
-        await self._barrier
+        await self._barrier.wait()
         return self._getdata()
 
 class ProducerConsumer:
@@ -0,0 +1,269 @@
+import os
+import io
+import struct
+import asyncio
+import binascii
+from collections import OrderedDict
+from micropython import const
+from phew import logging
+from phew.server import content_type_map
+from packbits import UnpackBitsFile
+from bitmap import scalebits
+from sdmanager import SDManager
+
+try:
+    import deflate
+except ImportError:
+    deflate = None
+
+# rp2 builds can have deflate without its compressor, so try it out once
+def candeflate():
+    if deflate is None:
+        return False
+    try:
+        compressor = deflate.DeflateIO(io.BytesIO(), deflate.ZLIB)
+        compressor.write(b"\x00")
+        compressor.close()
+        return True
+    except Exception:
+        return False
+
+haspng = candeflate()
+
+ROWBYTES        = const(32)
+ROWPIXELS       = const(256)
+MAXSCALE        = const(8)
+
+IDATSIZE        = const(2048)
+YIELDROWS       = const(16)
+
+CACHEFOLDER     = const("render")
+CACHEBYTES      = const(4*1024*1024)
+
+FORMATS = ("pbm", "bmp", "png")
+DEFAULTFORMAT = "png" if haspng else "bmp"
+
+cache = None
+
+def initialise(s: SDManager):
+    global sd
+    sd = s
+    sd.addhandler(cachehandler)
+
+async def cachehandler(hascard):
+    global cache
+
+    if hascard:
+        cache = RenderCache(f"{sd.mount_point}/{CACHEFOLDER}", CACHEBYTES)
+        cache.rebuild()
+    else:
+        cache = None
+
+def readrows(filename):
+    row = bytearray(ROWBYTES)
+    with UnpackBitsFile(filename) as unpacker:
+        while True:
+            for rowpos in range(ROWBYTES):
+                byte = unpacker.read()
+                if byte is None:
+                    return
+                row[rowpos] = byte
+            yield row
+
+def scaledrows(filename, scale):
+    line = bytearray(ROWBYTES*scale)
+    for row in readrows(filename):
+        scalebits(row, ROWBYTES, line, scale)
+        for _ in range(scale):
+            yield line
+
+# netpbm binary bitmap, set bits are black
+def pbm(filename, rows, scale):
+    yield b"P4\n%d %d\n" % (ROWPIXELS*scale, rows*scale)
+    yield from scaledrows(filename, scale)
+
+# top down (negative height) 1bpp bitmap with a white/black palette
+def bmp(filename, rows, scale):
+    width = ROWPIXELS*scale
+    height = rows*scale
+    rowsize = ROWBYTES*scale    # already a multiple of 4
+    offset = 14 + 40 + 8
+    yield struct.pack("<2sIHHI", b"BM", offset + rowsize*height, 0, 0, offset)
+    yield struct.pack("<IiiHHIIiiII", 40, width, -height, 1, 1, 0, rowsize*height, 2835, 2835, 2, 2)
+    yield b"\xff\xff\xff\x00\x00\x00\x00\x00"
+    yield from scaledrows(filename, scale)
+
+class _DeflateStream(io.IOBase):
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, buf):
+        self.data.extend(buf)
+        return len(buf)
+
+def pngchunk(kind, data):
+    yield struct.pack(">I", len(data)) + kind
+    yield data
+    yield struct.pack(">I", binascii.crc32(data, binascii.crc32(kind)))
+
+# 1bpp palette png, rows are deflated as they're read and sent as
+# idat chunks once enough compressed data has built up
+def png(filename, rows, scale):
+    yield b"\x89PNG\r\n\x1a\n"
+    yield from pngchunk(b"IHDR", struct.pack(">IIBBBBB", ROWPIXELS*scale, rows*scale, 1, 3, 0, 0, 0))
+    yield from pngchunk(b"PLTE", b"\xff\xff\xff\x00\x00\x00")
+    stream = _DeflateStream()
+    compressor = deflate.DeflateIO(stream, deflate.ZLIB) # type: ignore
+    for line in scaledrows(filename, scale):
+        compressor.write(b"\x00")   # no filter
+        compressor.write(line)
+        if len(stream.data) >= IDATSIZE:
+            yield from pngchunk(b"IDAT", stream.data)
+            stream.data = bytearray()
+    compressor.close()
+    yield from pngchunk(b"IDAT", stream.data)
+    yield from pngchunk(b"IEND", b"")
+
+renderers = {
+    "pbm": pbm,
+    "bmp": bmp,
+    "png": png
+}
+
+def validate(format, scale):
+    if format not in FORMATS:
+        raise ValueError(f"Format '{format}' not supported")
+    if format == "png" and not haspng:
+        raise ValueError("PNG not supported on this device")
+    if scale < 1 or scale > MAXSCALE:
+        raise ValueError(f"Scale must be between 1 and {MAXSCALE}")
+
+# renders a capture, returning the path of a cached render when there's an
+# sd card to cache on, otherwise a generator that streams the render. a
+# cached render is kept until it's given to release, once it's been sent
+async def render(filename, key, rows, format, scale):
+    validate(format, scale)
+    chunks = renderers[format](filename, rows, scale)
+    if cache is None:
+        return chunks
+    cachekey = f"{key}-{scale}.{format}"
+    cachefile = cache.get(cachekey)
+    if cachefile is None:
+        # another request is already filling this entry, so just stream it
+        if cache.isfilling(cachekey):
+            return chunks
+        cachefile = await cache.fill(cachekey, chunks)
+    cache.acquire(cachekey)
+    return cachefile
+
+def release(cachefile):
+    if cache is not None and cachefile.startswith(cache.path):
+        cache.release(cachefile[len(cache.path)+1:])
+
+def contenttype(format):
+    return content_type_map[format]
+
+def invalidate(prefix):
+    if cache is not None:
+        cache.invalidate(prefix)
+
+# least recently used cache of rendered files, the order is kept in memory
+# and seeded from the file times when the card is mounted
+class RenderCache:
+    def __init__(self, path, maxbytes):
+        self.path = path
+        self.maxbytes = maxbytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.filling = set()    # keys being rendered into the cache
+        self.inuse = {}         # keys being sent, with how many times
+
+    def rebuild(self):
+        try:
+            os.stat(self.path)
+        except OSError:
+            os.mkdir(self.path)
+        files = []
+        for name in os.listdir(self.path):
+            filename = f"{self.path}/{name}"
+            if name.endswith(".tmp"):
+                os.remove(filename)
+                continue
+            stat = os.stat(filename)
+            files.append((stat[8], name, stat[6]))
+        files.sort()
+        self.entries = OrderedDict()
+        self.size = 0
+        for _, name, size in files:
+            self.entries[name] = size
+            self.size += size
+        self.evict()
+        logging.info(f"Render cache has {len(self.entries)} files using {self.size} bytes")
+
+    def get(self, key):
+        size = self.entries.pop(key, None)
+        if size is None:
+            return None
+        self.entries[key] = size
+        return f"{self.path}/{key}"
+
+    def isfilling(self, key):
+        return key in self.filling
+
+    def acquire(self, key):
+        self.inuse[key] = self.inuse.get(key, 0) + 1
+
+    def release(self, key):
+        count = self.inuse.pop(key, 0) - 1
+        if count > 0:
+            self.inuse[key] = count
+
+    async def fill(self, key, chunks):
+        filename = f"{self.path}/{key}"
+        tmpfilename = f"{filename}.tmp"
+        size = 0
+        self.filling.add(key)
+        try:
+            with open(tmpfilename, "wb") as filehandle:
+                count = 0
+                for chunk in chunks:
+                    filehandle.write(chunk)
+                    size += len(chunk)
+                    count += 1
+                    if count % YIELDROWS == 0:
+                        await asyncio.sleep_ms(0) # type: ignore
+            os.rename(tmpfilename, filename)
+        except:
+            try:
+                os.remove(tmpfilename)
+            except OSError:
+                pass
+            raise
+        finally:
+            self.filling.discard(key)
+        self.entries[key] = size
+        self.size += size
+        self.evict()
+        return filename
+
+    def remove(self, key):
+        size = self.entries.pop(key, None)
+        if size is not None:
+            self.size -= size
+            try:
+                os.remove(f"{self.path}/{key}")
+            except OSError:
+                pass
+
+    # files still being sent are left, their keys have the capture's mtime
+    # so they won't be used again, and they're evicted later
+    def invalidate(self, prefix):
+        for key in [key for key in self.entries if key.startswith(prefix) and key not in self.inuse]:
+            self.remove(key)
+
+    def evict(self):
+        for key in list(self.entries):
+            if self.size <= self.maxbytes or len(self.entries) <= 1:
+                break
+            if key not in self.inuse:
+                self.remove(key)
@@ -0,0 +1,134 @@
+import os
+import time
+import random
+import asyncio
+from micropython import const
+from phew import logging
+import system
+
+# sd card benchmarks: a scratch file on the card is written and read back,
+# sequentially and at random, a number of blocks at a time. the file goes
+# through the filesystem, as captures do, so the figures are what capture
+# would see rather than what the card can do at best.
+
+BLOCKSIZE = const(512)
+BLOCKCOUNTS = (1, 8, 32)
+FILESIZE = const(256*1024)
+MAXFILESIZE = const(4*1024*1024)
+RANDOMOPS = const(64)           # random reads and writes at each block count
+
+SCRATCHFILENAME = const("sdbench.tmp")
+
+def rate(count, us):
+    return round(count * 1_000_000 / max(us, 1))
+
+# latencies in microseconds, sorted
+def percentiles(latencies):
+    latencies.sort()
+    last = len(latencies)-1
+    return {
+        "p50": latencies[last*50//100],
+        "p90": latencies[last*90//100],
+        "p99": latencies[last*99//100],
+        "max": latencies[last]
+    }
+
+def results(size, elapsed, latencies):
+    return {
+        "bytes": size,
+        "us": elapsed,
+        "bytespersecond": rate(size, elapsed),
+        "latency": percentiles(latencies)
+    }
+
+# times each read or write of the buffer, at the offsets given, or one after
+# the other when there are none
+async def timeops(filehandle, buffer, iswrite, count, offsets=None):
+    operation = filehandle.write if iswrite else filehandle.readinto
+    latencies = []
+    starttime = time.ticks_us()
+    for op in range(count):
+        if offsets is not None:
+            filehandle.seek(offsets[op])
+        optime = time.ticks_us()
+        operation(buffer)
+        latencies.append(time.ticks_diff(time.ticks_us(), optime))
+        await asyncio.sleep_ms(0) # type: ignore
+    if iswrite:
+        filehandle.flush()
+    elapsed = time.ticks_diff(time.ticks_us(), starttime)
+    return results(count*len(buffer), elapsed, latencies)
+
+async def benchblocks(filename, blocks, size):
+    buffer = bytearray(blocks*BLOCKSIZE)
+    for position in range(len(buffer)):
+        buffer[position] = position & 0xff
+    count = size // len(buffer)
+    offsets = [random.randrange(count) * len(buffer) for _ in range(RANDOMOPS)]
+    logging.info(f"Benchmarking SD card {blocks} blocks at a time")
+    with open(filename, "wb") as filehandle:
+        sequentialwrite = await timeops(filehandle, buffer, True, count)
+    with open(filename, "rb") as filehandle:
+        sequentialread = await timeops(filehandle, buffer, False, count)
+        randomread = await timeops(filehandle, buffer, False, RANDOMOPS, offsets)
+    with open(filename, "r+b") as filehandle:
+        randomwrite = await timeops(filehandle, buffer, True, RANDOMOPS, offsets)
+    return {
+        "blocks": blocks,
+        "sequentialwrite": sequentialwrite,
+        "sequentialread": sequentialread,
+        "randomread": randomread,
+        "randomwrite": randomwrite
+    }
+
+# what the card says about itself; older cards may not answer for the status
+def cardhealth(card):
+    try:
+        status = card.decode_status()
+    except OSError as ex:
+        logging.error(f"SD card status failed: {ex}")
+        status = None
+    return {
+        "identifier": hex(card.CID)[2:],
+        "details": card.decode_cid(),
+        "csd": card.decode_csd(),
+        "status": status,
+        "busspeed": card.baudrate,
+        "crcerrors": card.crcerrors
+    }
+
+async def run(sdmanager, blockcounts=None, size=None, version=None):
+    if not sdmanager.ismounted():
+        raise ValueError("No SD card")
+    blockcounts = blockcounts or BLOCKCOUNTS
+    size = size or FILESIZE
+    if size > MAXFILESIZE:
+        raise ValueError(f"Size is larger than {MAXFILESIZE//1024}KB")
+    for blocks in blockcounts:
+        if blocks < 1 or blocks*BLOCKSIZE > size:
+            raise ValueError(f"Block count {blocks} doesn't fit the size")
+
+    card = sdmanager.card
+    crcerrors = card.crcerrors
+    filename = f"{sdmanager.mount_point}/{SCRATCHFILENAME}"
+    benchmarks = []
+    try:
+        for blocks in blockcounts:
+            benchmarks.append(await benchblocks(filename, blocks, size))
+    finally:
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+    health = cardhealth(card)
+    health["benchcrcerrors"] = card.crcerrors - crcerrors
+    logging.info("SD card benchmark finished")
+    return {
+        "version": version,
+        "machine": system.machine,
+        "time": time.time(),
+        "size": size,
+        "card": health,
+        "cache": sdmanager.cachestats(),
+        "benchmarks": benchmarks
+    }
@@ -26,9 +26,19 @@
 #     If a crc16 is provided, the CRC  function of the SD card is enabled,
 #     and data transfers both ways are protected by it
 #
+# Note about the dma:
+#     an object with startread(buf), startwrite(buf) and wait(), like
+#     spidma.SPIDMA, moves the blocks of multi-block reads and writes so
+#     the crc of one block is worked out while the next is transferred
+#
+# Note about initialise:
+#     with initialise=False the card is left for init_card_async, which
+#     lets other tasks run between the steps and retries of initialising
+#
 
 from micropython import const
 import time
+import asyncio
 from errno import ETIMEDOUT, EIO, ENODEV, EINVAL
 
 crc7_be_syndrome_table = (
@@ -57,6 +67,7 @@ def gb(bigval, b0, bn):
 
 
 _CMD_TIMEOUT = const(50)
+_BUSY_TIMEOUT_MS = const(500)  # longest a card may take over a write
 
 _R1_IDLE_STATE = const(1 << 0)
 # R1_ERASE_RESET = const(1 << 1)
@@ -68,22 +79,36 @@ _R1_COM_CRC_ERROR = const(1 << 3)
 _TOKEN_CMD25 = const(0xFC)
 _TOKEN_STOP_TRAN = const(0xFD)
 _TOKEN_DATA = const(0xFE)
+_DATA_CRC_ERROR = const(0x0B)  # data response token
 _HCS_BIT = const(1 << 30)  # for ACMD41
 
+_TRAN_SPEED_MULTIPLIERS = (0, 10, 12, 13, 15, 20, 25, 30, 35, 40, 45, 50, 55, 60, 70, 80)
+_SPEED_CLASSES = (0, 2, 4, 6, 10)
+
 
 class SDCard:
-    def __init__(self, spi, cs, baudrate=1320000, crc16_function=None):
+    def __init__(self, spi, cs, baudrate=1320000, crc16_function=None, dma=None, initialise=True):
         self.spi = spi
         self.cs = cs
+        self.dma = dma
+        self.writebusy = False  # the card is still busy with the last write
 
         self.cmdbuf = bytearray(6)
         self.cmdbuf5 = memoryview(self.cmdbuf)[:5]  # for crc7 generation
         self.tokenbuf = bytearray(1)
         self.crcbuf = bytearray(2)
+        self.blockcrcs = (bytearray(2), bytearray(2))
+        self.crcerrors = 0  # bad blocks read, and blocks the card said were bad
         self.crc16 = None  # during init
-        # initialise the card
-        self.init_card(baudrate)
-        self.check_crcs(crc16_function)  # now set it up
+        if initialise:
+            # initialise the card
+            self.init_card(baudrate)
+            self.check_crcs(crc16_function)  # now set it up
+
+    async def init_card_async(self, baudrate=1320000, crc16_function=None):
+        for delay in self.init_steps(baudrate):
+            await asyncio.sleep_ms(delay) # type: ignore
+        self.check_crcs(crc16_function)
 
     def check_crcs(self, crc16_function):
         self.crc16 = crc16_function
@@ -93,6 +118,7 @@ class SDCard:
         return result
 
     def init_spi(self, baudrate):
+        self.baudrate = baudrate
         try:
             master = self.spi.MASTER
         except AttributeError:
@@ -126,7 +152,47 @@ class SDCard:
             'date' : f"{manyear:04d}/{manmonth:02d}"
         }
 
+    def decode_csd(self):
+        csd_int = self.CSD
+        _gb = gb  # just for local binding
+        # the maximum bus speed is a multiplier (x10) of a unit of 100kbit/s
+        # to 100Mbit/s, see 5.3.2 of the SD card spec
+        tran_speed = _gb(csd_int, 96, 103)
+        multiplier = _TRAN_SPEED_MULTIPLIERS[(tran_speed >> 3) & 0xF]
+        unit = 10_000 * 10 ** (tran_speed & 0x7)
+        return {
+            'version' : _gb(csd_int, 126, 127) + 1,
+            'capacity' : self.sectors * 512,
+            'maxspeed' : multiplier * unit,
+            'classes' : _gb(csd_int, 84, 95)
+        }
+
+    # ACMD13: the SD status, a 64 byte block with the card's speed classes
+    def read_status(self):
+        self.cmd(55, 0)
+        # response R2 (R1 byte + status byte)
+        if self.cmd(13, 0, -1, False) != 0:
+            self.cs(1)
+            raise OSError(EIO, "no SD status response")
+        status = bytearray(64)
+        self.readinto(status)
+        return status
+
+    def decode_status(self):
+        status = self.read_status()
+        return {
+            'speedclass' : _SPEED_CLASSES[status[8]] if status[8] < len(_SPEED_CLASSES) else None,
+            'uhsgrade' : status[14] >> 4,
+            'videoclass' : status[15]
+        }
+
     def init_card(self, baudrate):
+        for delay in self.init_steps(baudrate):
+            if delay:
+                time.sleep_ms(delay)
+
+    # the initialisation, yielding the ms to wait for between its steps
+    def init_steps(self, baudrate):
         # init CS pin
         self.cs.init(self.cs.OUT, value=1)
 
@@ -143,6 +209,7 @@ class SDCard:
                 break
         else:
             raise OSError(ENODEV, "no SD card")
+        yield 0
 
         # CMD8: determine card version
         r = self.cmd(8, 0x01AA, 4)  # probe version
@@ -156,7 +223,7 @@ class SDCard:
             self.cmd(55, 0)
             if (r := self.cmd(41, arg41)) == 0:
                 break
-            time.sleep_ms(5)
+            yield 5
         if r != 0:
             raise OSError(ETIMEDOUT, "card type", "v2" if v2 else "v1")
 
@@ -185,6 +252,7 @@ class SDCard:
         else:
             raise OSError(EIO, "CSD format unknown")
         # print('sectors', self.sectors)
+        yield 0
 
         # get the card identification (CID)
         try:
@@ -199,6 +267,7 @@ class SDCard:
         except:
             self.CIDBYTES = bytearray(16)
             self.CID = 0
+        yield 0
 
         # CMD16: set block length to 512 bytes
         if self.cmd(16, 512) != 0:
@@ -216,6 +285,9 @@ class SDCard:
 
         cs(0)  # select chip
 
+        if self.writebusy:
+            self.waitbusy()
+
         # create and send the command
         buf = self.cmdbuf
         buf[0] = 0x40 | cmd
@@ -260,12 +332,22 @@ class SDCard:
         spiff()
         raise OSError(ETIMEDOUT, "command:", cmd, "arg:", arg)
 
-    def readinto(self, buf):
-        cs = self.cs
-        spiff = self._spiff
-
-        cs(0)
+    # waits, with the card selected, until it stops holding the line low
+    def waitbusy(self):
+        r = self.spi.readinto
+        tb = self.tokenbuf
+        self.writebusy = False
+        r(tb, 0xFF)
+        if tb[0] != 0:
+            return
+        deadline = time.ticks_add(time.ticks_ms(), _BUSY_TIMEOUT_MS)
+        while tb[0] == 0:
+            if time.ticks_diff(deadline, time.ticks_ms()) < 0:
+                self.cs(1)
+                raise OSError(ETIMEDOUT, "busy timeout")
+            r(tb, 0xFF)
 
+    def readtoken(self):
         # read until start byte (0xff)
         for i in range(_CMD_TIMEOUT):
             self.spi.readinto(self.tokenbuf, 0xFF)
@@ -275,59 +357,83 @@ class SDCard:
                 time.sleep_ms(1)  # if response is slow, wait longer
 
         else:
-            cs(1)
+            self.cs(1)
             raise OSError(ETIMEDOUT, "read timeout")
 
+    def checkcrc(self, buf, ck):
+        crc = self.crc16(self.crc16(0, buf), ck)
+        if crc != 0:
+            self.crcerrors += 1
+            raise OSError(EIO, f"bad data CRC: {crc:04x}")
+
+    def readinto(self, buf):
+        cs = self.cs
+        spiff = self._spiff
+
+        cs(0)
+
+        self.readtoken()
+
         self.spi.readinto(buf, 0xFF)
 
         # read checksum
         ck = self.spi.read(2, 0xFF)
-        if self.crc16:
-            crc = self.crc16(self.crc16(0, buf), ck)
-            if crc != 0:
-                raise OSError(EIO, f"bad data CRC: {crc:04x}")
 
         cs(1)
         spiff()
 
+        if self.crc16:
+            self.checkcrc(buf, ck)
+
     def write(self, token, buf):
         cs = self.cs
         spiff = self._spiff
-        r = self.spi.read
+        r = self.spi.readinto
         w = self.spi.write
+        tb = self.tokenbuf
+        dma = self.dma
 
         cs(0)
 
         # send: start of block, data, checksum
-        r(1, token)
-        w(buf)
+        r(tb, token)
+        if dma:
+            dma.startwrite(buf)
+        else:
+            w(buf)
+        # with dma the crc is worked out while the data goes out
         if self.crc16:
             crc = self.crc16(0, buf)
             self.crcbuf[0] = crc >> 8
             self.crcbuf[1] = crc & 0xFF
-            w(self.crcbuf)  # write checksum
         else:
-            w(b"\xff\xff")
-            # check the response
-        if ((r(1, 0xFF)[0]) & 0x1F) != 0x05:
+            self.crcbuf[0] = self.crcbuf[1] = 0xFF
+        if dma:
+            dma.wait()
+        w(self.crcbuf)  # write checksum
+        # check the response
+        r(tb, 0xFF)
+        if (tb[0] & 0x1F) != 0x05:
+            if (tb[0] & 0x1F) == _DATA_CRC_ERROR:
+                self.crcerrors += 1
             cs(1)
             spiff()
             raise OSError(EIO, "write fail")
 
         # wait for write to finish
-        while (r(1, 0xFF)[0]) == 0:
-            pass
+        self.waitbusy()
 
         cs(1)
         spiff()
 
+    # the card stays busy with the last block after the stop token. that's
+    # waited for at the next command, rather than here, so the time can be
+    # used for something else
     def write_token(self, token):
         self.cs(0)
-        self.spi.read(1, token)
+        self.spi.readinto(self.tokenbuf, token)
         self._spiff()
-        # wait for write to finish
-        while self.spi.read(1, 0xFF)[0] == 0x00:
-            pass
+        self.writebusy = True
 
         self.cs(1)
         self._spiff()
@@ -351,12 +457,50 @@ class SDCard:
             self.cs(1)
             raise OSError(EIO)  # EIO
         mv = memoryview(buf)
-        for offset in range(0, nblocks * 512, 512):
-            self.readinto(mv[offset : offset + 512])
+        try:
+            if self.dma:
+                self.readintodma(mv, nblocks)
+            else:
+                for offset in range(0, nblocks * 512, 512):
+                    self.readinto(mv[offset : offset + 512])
+        except:
+            # CMD12: stop the card sending, so it answers the next command
+            self.cmd(12, 0, skip1=True)
+            raise
 
         if self.cmd(12, 0, skip1=True):
             raise OSError(EIO)  # EIO
 
+    # each block is read by dma while the previous block's crc is checked
+    def readintodma(self, mv, nblocks):
+        cs = self.cs
+        dma = self.dma
+        checkcrc = self.checkcrc if self.crc16 else None
+        previous = None
+        for offset in range(0, nblocks * 512, 512):
+            block = mv[offset : offset + 512]
+            ck = self.blockcrcs[(offset >> 9) & 1]
+
+            cs(0)
+            self.readtoken()
+            dma.startread(block)
+            if checkcrc and previous is not None:
+                try:
+                    checkcrc(previous, previousck)
+                except:
+                    dma.wait()
+                    cs(1)
+                    raise
+            dma.wait()
+            self.spi.readinto(ck, 0xFF)
+            cs(1)
+            self._spiff()
+
+            previous = block
+            previousck = ck
+        if checkcrc and previous is not None:
+            checkcrc(previous, previousck)
+
     def writeblocks(self, block_num, buf):
         # workaround for shared bus, required for (at least) some Kingston
         # devices, ensure MOSI is high before starting transaction
@@ -373,6 +517,11 @@ class SDCard:
         self.write_token(_TOKEN_STOP_TRAN)
 
     def ioctl(self, op, arg):
+        if op == 3 and self.writebusy:  # sync, the last write has to finish
+            self.cs(0)
+            self.waitbusy()
+            self.cs(1)
+            self._spiff()
         if op == 4:  # get number of blocks
             return self.sectors
         if op == 5:  # get block size in bytes
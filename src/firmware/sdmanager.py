@@ -5,20 +5,32 @@ from micropython import const
 from machine import SPI, Pin
 from phew import logging
 from sdcard import SDCard
+from spidma import SPIDMA
+from crc16 import crc16
+from blockcache import BlockCache
+import metrics
 
-CARDDETECTMS = const(250)
+CARDDEBOUNCEMS = const(100)     # the detect switch settles within this
+BAUDRATE = const(24_000_000)
+CACHEBLOCKS = const(32)         # 16KB
+CACHEFLUSHMS = const(1000)      # longest a write is held in the cache
 
 class SDManager:
-    def __init__(self, bus, sck, mosi, miso, cs, cd, mount_point='/sd'):
+    def __init__(self, bus, sck, mosi, miso, cs, cd, mount_point='/sd', cacheblocks=CACHEBLOCKS):
         self.mount_point = mount_point
+        self.cacheblocks = cacheblocks
 
         clkpin = Pin(sck, Pin.OUT)
         mosipin = Pin(mosi, Pin.OUT)
         misopin = Pin(miso, Pin.IN, Pin.PULL_UP)
 
         self.cspin = Pin(cs, Pin.OUT)
-        self.spi = SPI(bus, baudrate=24_000_000, sck=clkpin, mosi=mosipin, miso=misopin)
+        self.spi = SPI(bus, baudrate=BAUDRATE, sck=clkpin, mosi=mosipin, miso=misopin)
+        self.dma = SPIDMA(bus)
         self.card = None
+        self.cache = None
+        self.cacheflushtime = time.ticks_ms()
+        metrics.setsdcache(self.cachestats)
 
         self.mountex = None
         self.mounted = False
@@ -27,6 +39,8 @@ class SDManager:
         self.cdtime = time.ticks_ms()
         self.cdpin = Pin(cd, Pin.IN, Pin.PULL_UP)
         self.cdhascard = False
+        self.cdflag = asyncio.ThreadSafeFlag()
+        self.cdpin.irq(self._cdirq, Pin.IRQ_FALLING | Pin.IRQ_RISING)
         self.cdtask = asyncio.create_task(self._cardwatch())
 
     def ismounted(self):
@@ -35,13 +49,22 @@ class SDManager:
     def _hascard(self):
         return not self.cdpin.value()
 
-    def mount(self):
+    # the card's initialisation, reading its partitions and mounting each
+    # take a while, so other tasks get to run between them and between the
+    # steps of initialising
+    async def mount(self):
         try:
             self.mountex = None
             logging.info("Init SD card")
-            self.card = SDCard(self.spi, self.cspin)
+            card = SDCard(self.spi, self.cspin, dma=self.dma, initialise=False)
+            # the card driver's default baudrate would slow the bus back down
+            await card.init_card_async(BAUDRATE, crc16)
+            self.card = card
+            await asyncio.sleep_ms(0) # type: ignore
+            self.cache = BlockCache(self.card, self.cacheblocks) if self.cacheblocks else None
+            await asyncio.sleep_ms(0) # type: ignore
             logging.info("Mount SD card")
-            os.mount(self.card, self.mount_point) # type: ignore
+            os.mount(self.cache or self.card, self.mount_point) # type: ignore
             self.mounted = True
         except Exception as ex:
             logging.error(f"Mount exception: {ex}")
@@ -52,26 +75,60 @@ class SDManager:
         try:
             self.mountex = None
             logging.info("Unmount SD card")
+            self.flushcache()
             os.umount(self.mount_point) # type: ignore
             self.card = None
+            self.cache = None
             self.mounted = False
         except Exception as ex:
             logging.error(f"Unmount exception: {ex}")
             self.mountex = ex
         return self.mounted
 
+    # the card may already have gone, in which case what's cached is lost
+    def flushcache(self):
+        self.cacheflushtime = time.ticks_ms()
+        if self.cache is not None and self.cache.dirty:
+            try:
+                self.cache.flush()
+            except OSError as ex:
+                logging.error(f"SD card cache flush failed: {ex}")
+
+    def cachestats(self):
+        return {} if self.cache is None else self.cache.stats()
+
     def addhandler(self, handler):
         self.cdhandlers.append(handler)
 
+    def _cdirq(self, pin):
+        self.cdflag.set()
+
+    # waits for the detect pin to change. with a cache, it wakes up often
+    # enough to flush any writes held in it.
+    async def _cdwait(self):
+        if self.cache is None:
+            await self.cdflag.wait()
+            return True
+        timeout = CACHEFLUSHMS - time.ticks_diff(time.ticks_ms(), self.cacheflushtime)
+        try:
+            await asyncio.wait_for_ms(self.cdflag.wait(), max(timeout, 0)) # type: ignore
+            return True
+        except asyncio.TimeoutError:
+            self.flushcache()
+            return False
+
     async def _cardwatch(self):
         while True:
             hascard = self._hascard()
             if hascard != self.cdhascard:
                 if hascard:
-                    self.mount()
+                    await self.mount()
                 else:
                     self.unmount()
                 self.cdhascard = hascard
                 for handler in self.cdhandlers:
                     await handler(hascard)
-            await asyncio.sleep_ms(CARDDETECTMS) # type: ignore
+            if await self._cdwait():
+                # the switch bounces, so read it once it's settled
+                await asyncio.sleep_ms(CARDDEBOUNCEMS) # type: ignore
+                self.cdflag.clear()
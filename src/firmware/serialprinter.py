@@ -22,6 +22,8 @@ softflow = False
 interchardelayms = 0
 
 class SerialPort(physicalprinter.Port):
+    name = "serial"
+
     async def writeport(self, line):
         global stopped
 
@@ -38,7 +40,7 @@ class SerialPort(physicalprinter.Port):
                 if interchardelayms>0:
                     await asyncio.sleep_ms(interchardelayms) # type: ignore
         else:
-            await portwriter.awrite(data) # type: ignore
+            await portwriter.awrite(line) # type: ignore
 
 serialport = SerialPort()
 
@@ -1,6 +1,8 @@
 import services
-from command import command, start_server
+from command import command, setexclusive, start_server
 import fileprinter
+import metrics
+import serialtransfer
 
 def initialize():
     pass
@@ -36,9 +38,41 @@ def storename(store):
 async def getprintouts(params):
     return services.get_printouts(storename(params.get("store")))
 
-@command("getprintout", "name", "[store]")
+@command("listprintouts", "[store]", "[offset]", "[limit]", "[order]", "[since]")
+async def listprintouts(params):
+    limit = params.get("limit")
+    since = params.get("since")
+    return services.list_printouts(
+        storename(params.get("store")),
+        int(params.get("offset", 0)),
+        None if limit is None else int(limit),
+        params.get("order", "name"),
+        None if since is None else int(since))
+
+@command("getprintout", "name", "[store]", "[offset]")
 async def getprintout(params):
-    return services.get_printout(storename(params.get("store")), params["name"])
+    store = storename(params.get("store"))
+    if serialtransfer.enabled:
+        filename = fileprinter.getfilepath(store, params["name"])
+        return await serialtransfer.sendfile(filename, int(params.get("offset", 0)))
+    return services.get_printout(store, params["name"])
+
+# a binary transfer's frames go straight to the port, so they'd end up in
+# the middle of other responses
+setexclusive("getprintout", lambda: serialtransfer.enabled)
+
+@command("setbinary", "state", "[framesize]", "[window]")
+async def setbinary(params):
+    framesize = params.get("framesize")
+    window = params.get("window")
+    return serialtransfer.setbinary(
+        params["state"].lower() == "on",
+        None if framesize is None else int(framesize),
+        None if window is None else int(window))
+
+@command("getbinary")
+async def getbinary(_):
+    return serialtransfer.getbinary()
 
 @command("deleteprintout", "name", "[store]")
 async def delprintout(params):
@@ -121,9 +155,38 @@ async def setserial(params):
 async def setflow(params):
     return services.setserialflow(params["hardware"] == "true", params["software"] == "true", int(params["delayms"]))
 
-@command("getlog")
-async def getlog(_):
-    return services.getlogfile()
+@command("getlog", "[tail]", "[since]", "[level]")
+async def getlog(params):
+    tail = params.get("tail")
+    since = params.get("since")
+    return services.getlogfile(
+        None if tail is None else int(tail),
+        None if since is None else int(since),
+        params.get("level"))
+
+@command("metrics")
+async def getmetrics(_):
+    return metrics.getmetrics()
+
+@command("gettrace")
+async def gettrace(_):
+    return services.gettrace()
+
+@command("settrace", "state")
+async def settrace(params):
+    return services.settrace(params["state"])
+
+@command("benchmark", "[captures]", "[protocols]", "[ports]")
+async def runbenchmark(params):
+    return await services.runbenchmark(params.get("captures"), params.get("protocols"), params.get("ports"))
+
+@command("getbenchmarks")
+async def getbenchmarks(_):
+    return services.getbenchmarks()
+
+@command("sdbench", "[blocks]", "[size]")
+async def runsdbench(params):
+    return await services.runsdbench(params.get("blocks"), params.get("size"))
 
 @command("cardinfo")
 async def getcardinfo(_):
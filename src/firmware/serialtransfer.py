@@ -0,0 +1,127 @@
+import os
+import struct
+import asyncio
+from micropython import const
+from phew import logging
+from crc16 import crc16
+import command
+
+# binary file transfer over usb serial, for when the json hex dump is too
+# slow. after a json line with the file's size, the file is sent as frames:
+#
+#   magic (0x5a), sequence (u16), offset (u32), length (u16), data, crc (u16)
+#
+# all little endian, the crc16 being over everything before it. up to a
+# window of frames are sent before waiting for the host to reply with a line:
+#
+#   ack <offset>    everything before offset arrived
+#   nak <offset>    resend from offset
+#   cancel          stop sending
+#
+# then a json line with the final offset ends the transfer. a transfer that
+# fails can be resumed by asking for the file again from the last offset.
+
+FRAMEMAGIC = const(0x5a)
+FRAMEHEADER = const("<BHLH")
+HEADERSIZE = const(9)
+CRCSIZE = const(2)
+
+FRAMESIZE = const(4096)         # largest frame data
+WINDOW = const(4)               # most frames sent without an ack
+ACKTIMEOUT = const(2000)
+RETRIES = const(3)
+
+enabled = False
+framesize = FRAMESIZE
+window = WINDOW
+
+def setbinary(state, size=None, frames=None):
+    global enabled, framesize, window
+
+    enabled = state
+    framesize = FRAMESIZE if size is None else max(64, min(size, FRAMESIZE))
+    window = WINDOW if frames is None else max(1, min(frames, WINDOW))
+    return getbinary()
+
+def getbinary():
+    return {
+        "enabled": enabled,
+        "framesize": framesize,
+        "window": window
+    }
+
+class FrameWriter:
+    def __init__(self, writer, size):
+        self.writer = writer
+        self.frame = bytearray(HEADERSIZE+size+CRCSIZE)
+        self.frameview = memoryview(self.frame)
+        self.data = self.frameview[HEADERSIZE:HEADERSIZE+size]
+
+    # sends the frame whose data has been put into self.data
+    async def send(self, sequence, offset, length):
+        struct.pack_into(FRAMEHEADER, self.frame, 0, FRAMEMAGIC, sequence & 0xffff, offset, length)
+        end = HEADERSIZE+length
+        struct.pack_into("<H", self.frame, end, crc16(0, self.frameview[:end]))
+        await self.writer.awrite(self.frameview[:end+CRCSIZE]) # type: ignore
+
+# a line ending in crlf reads as the line then an empty one, so blank
+# lines are skipped
+async def readreply():
+    line = ""
+    while not line:
+        line = await asyncio.wait_for_ms(command.serialreader.readline(), ACKTIMEOUT) # type: ignore
+        line = line.strip()
+    tokens = line.lower().split(" ")
+    return tokens[0], int(tokens[1]) if len(tokens) > 1 else None
+
+async def sendfile(filename, offset=0):
+    # pipelined requests run while the server reads the next line, so the
+    # acks would go to it
+    if command.serialreader.reading:
+        raise ValueError("Binary transfers can't be pipelined")
+    size = os.stat(filename)[6]
+    if offset < 0 or offset > size:
+        raise ValueError(f"Offset {offset} is outside the file")
+    await command.serialwrite({
+        "size": size,
+        "offset": offset,
+        "framesize": framesize,
+        "window": window
+    })
+    frames = FrameWriter(command.binaryout, framesize)
+    acked = offset
+    sent = offset
+    sequence = 0
+    retries = 0
+    with open(filename, "rb") as filehandle:
+        while acked < size:
+            if sent - acked < window*framesize:
+                filehandle.seek(sent)
+                while sent < size and sent - acked < window*framesize:
+                    length = filehandle.readinto(frames.data)
+                    await frames.send(sequence, sent, length)
+                    sequence += 1
+                    sent += length
+            try:
+                reply, replyoffset = await readreply()
+            except asyncio.TimeoutError:
+                retries += 1
+                if retries > RETRIES:
+                    raise Exception(f"Transfer timed out at offset {acked}")
+                logging.info(f"Transfer ack timed out, resending from offset {acked}")
+                sent = acked
+                continue
+            if reply == "cancel":
+                break
+            if replyoffset is None or replyoffset < acked or replyoffset > sent:
+                raise ValueError(f"Transfer reply '{reply}' has a bad offset")
+            retries = 0
+            acked = replyoffset
+            if reply == "nak":
+                sent = replyoffset
+            elif reply != "ack":
+                raise ValueError(f"Transfer reply '{reply}' not supported")
+    return {
+        "size": size,
+        "offset": acked
+    }
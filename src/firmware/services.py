@@ -1,7 +1,8 @@
 import os
 import json
+import time
 from micropython import const
-from phew import server, logging
+from phew import server, logging, trace
 import parallelprinter
 import serialprinter
 import networkprinter
@@ -9,6 +10,12 @@ import fileprinter
 import physicalprinter
 import settings
 import dnsclient
+import render
+import benchmark
+import sdbench
+from archive import TarArchive
+from catalogue import SIZE, MTIME, ROWBYTES
+from packbits import PackBitsValidator
 from system import hasnetwork
 
 testprinterfilename = const("/testprintout.cap")
@@ -23,6 +30,8 @@ OLDPRINTERPROTOCOL  = const("printerprotocol")
 
 ENVFILENAME         = const("env.json")
 
+UPLOADCHUNKSIZE     = const(1024)
+
 def initialise(p, sd):
     global connectedpixel
     global sdmanager
@@ -78,9 +87,72 @@ async def get_printout(store, name):
 def get_printouts(store):
     return fileprinter.getfiles(store)
 
+def list_printouts(store, offset=0, limit=None, order="name", since=None):
+    return fileprinter.getcatalogue(store).list(offset, limit, order, since)
+
+def export_printouts(store, names=None):
+    catalogue = fileprinter.getcatalogue(store)
+    if names is None:
+        names = catalogue.names()
+    entries = []
+    for name in names:
+        entry = catalogue.get(name)
+        if entry is None:
+            raise ValueError(f"Printout '{name}' not found")
+        entries.append((name, entry[SIZE], entry[MTIME]))
+    return TarArchive(fileprinter.getstorepath(store), entries)
+
+def renderprefix(store, name):
+    return f"{store or 'flash'}-{name.split('.')[0]}-"
+
+async def render_printout(store, name, format, scale):
+    catalogue = fileprinter.getcatalogue(store)
+    entry = catalogue.get(name)
+    if entry is None:
+        raise ValueError(f"Printout '{name}' not found")
+    filename = fileprinter.getfilepath(store, name)
+    key = f"{renderprefix(store, name)}{entry[MTIME]}"
+    return await render.render(filename, key, catalogue.rows(name), format, scale)
+
+async def upload_printout(store, readinto, length):
+    catalogue = fileprinter.getcatalogue(store)
+    tmpfilename = fileprinter.getfilepath(store, f"upload{time.ticks_ms()}.tmp")
+    chunk = bytearray(UPLOADCHUNKSIZE)
+    chunkview = memoryview(chunk)
+    validator = PackBitsValidator()
+    remaining = length
+    try:
+        with open(tmpfilename, "wb") as filehandle:
+            while remaining > 0:
+                bytecount = await readinto(chunkview[0:min(UPLOADCHUNKSIZE, remaining)])
+                if not bytecount:
+                    raise ValueError("Upload ended early")
+                validator.feed(chunk, bytecount)
+                filehandle.write(chunkview[0:bytecount])
+                remaining -= bytecount
+        if not validator.iscomplete() or validator.length == 0 or validator.length % ROWBYTES != 0:
+            raise ValueError("Upload is not a valid printout")
+        filename = fileprinter.nextfilename(store)
+        fileprinter.savesettings(store)
+        os.rename(tmpfilename, filename)
+    except:
+        try:
+            os.remove(tmpfilename)
+        except OSError:
+            pass
+        raise
+    name = filename.split("/")[-1]
+    catalogue.update(name, validator.length // ROWBYTES)
+    logging.info(f"Uploaded printout to {filename}")
+    return {
+        "name": name
+    }
+
 def delete_printout(store, name):
     filename = fileprinter.getfilepath(store, name)
     os.remove(filename)
+    fileprinter.getcatalogue(store).remove(name)
+    render.invalidate(renderprefix(store, name))
     return {}
 
 def print_printout(store, name):
@@ -93,7 +165,10 @@ def copy_printout(sourcestore, targetstore, filenames):
     tofilename = fileprinter.nextfilename(targetstore)
     fileprinter.savesettings(targetstore)
     logging.info(f"Copying from {fromfilenames} to {tofilename}")
-    copyfile(fromfilenames, tofilename)
+    if copyfile(fromfilenames, tofilename):
+        sourcecatalogue = fileprinter.getcatalogue(sourcestore)
+        rows = [sourcecatalogue.rows(fn) for fn in filenames]
+        fileprinter.getcatalogue(targetstore).update(tofilename.split("/")[-1], None if None in rows else sum(rows))
     return {}
 
 def testprinter():
@@ -322,22 +397,62 @@ def readlogfile(filename):
                 return
             yield json.dumps(line.rstrip())
 
-async def getlogfile():
-    yield '['
-    try:
-        isfirstline = True
-        for line in readlogfile(logging.log1_file):
-            if not isfirstline:
-                yield ','
-            isfirstline = False
-            yield line
-        for line in readlogfile(logging.log_file):
-            if not isfirstline:
-                yield ','
-            isfirstline = False
-            yield line
-    finally:
-        yield ']'
+LOGLEVELSTART = const(21)     # after the timestamp and the opening bracket
+
+def loglevel(line):
+    if len(line) > LOGLEVELSTART and line[LOGLEVELSTART-1] == 91:   # '['
+        end = line.find(b" ", LOGLEVELSTART)
+        if end > LOGLEVELSTART:
+            return line[LOGLEVELSTART:end].decode()
+    return None     # a continuation of the entry before, like a traceback
+
+# the whole log as a json array, or when any of tail, since or level are given
+# an object with the matching lines and the position to poll from next time.
+# tail is capped at 256 lines, as phew.logging only remembers where the most
+# recent 256 lines start
+async def getlogfile(tail=None, since=None, level=None):
+    if tail is None and since is None and level is None:
+        logging.flush()
+        yield '['
+        try:
+            isfirstline = True
+            for line in readlogfile(logging.log1_file):
+                if not isfirstline:
+                    yield ','
+                isfirstline = False
+                yield line
+            for line in readlogfile(logging.log_file):
+                if not isfirstline:
+                    yield ','
+                isfirstline = False
+                yield line
+        finally:
+            yield ']'
+        return
+
+    start, end = logging.log_range()
+    if since is not None:
+        if since < start or since > end:
+            since = start   # rotated away, or the device restarted
+        start = since
+    if tail is not None:
+        start = max(start, logging.tail_position(tail))
+    levels = None if level is None else set(level.lower().split(","))
+    yield '{"lines":['
+    isfirstline = True
+    matched = True
+    for _, line in logging.read_log(start, end):
+        if levels is not None:
+            linelevel = loglevel(line)
+            if linelevel is not None:
+                matched = linelevel in levels
+            if not matched:
+                continue
+        if not isfirstline:
+            yield ','
+        isfirstline = False
+        yield json.dumps(line.decode().rstrip())
+    yield '],"next":%d}' % end
 
 def copyfile(fromfilenames, tofilename):
     BUFFER_SIZE = const(128)
@@ -359,18 +474,52 @@ def copyfile(fromfilenames, tofilename):
             pass
         return False
 
+def gettrace():
+    return trace.dump()
+
+def settrace(state):
+    state = state.lower()
+    if state == "on":
+        trace.enable()
+    elif state == "off":
+        trace.disable()
+    elif state == "clear":
+        trace.clear()
+    else:
+        raise ValueError(f"Trace state '{state}' not supported")
+    logging.info(f"Tracing {state}")
+    return trace.status()
+
+def getversion():
+    with open(f"/{ENVFILENAME}") as fp:
+        return json.load(fp)["version"]
+
+def splitnames(names):
+    return None if not names else [name.strip().lower() for name in names.split(",")]
+
+async def runbenchmark(captures=None, protocols=None, ports=None):
+    captures = None if not captures else [name.strip() for name in captures.split(",")]
+    return await benchmark.run(captures, splitnames(protocols), splitnames(ports), getversion())
+
+def getbenchmarks():
+    return benchmark.gethistory()
+
+# block counts are comma separated, the size is in KB
+async def runsdbench(blocks=None, size=None):
+    blockcounts = None if not blocks else [int(count) for count in blocks.split(",")]
+    return await sdbench.run(sdmanager, blockcounts, int(size)*1024 if size else None, getversion())
+
 def getcardinfo():
     ismounted = sdmanager.ismounted()
     return {
         "identifier": hex(sdmanager.card.CID)[2:] if ismounted else None,
-        "details": sdmanager.card.decode_cid() if ismounted else None
+        "details": sdmanager.card.decode_cid() if ismounted else None,
+        "cache": sdmanager.cachestats()
     }
 
 def about():
-    with open(f"/{ENVFILENAME}") as fp:
-        env = json.load(fp)
     return {
-        "version": env["version"],
+        "version": getversion(),
         "network": hasnetwork(),
         "sdcard": sdmanager.ismounted()
     }
\ No newline at end of file
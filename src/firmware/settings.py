@@ -1,7 +1,22 @@
+import os
 import json
+import asyncio
 from micropython import const
+from crc16 import crc16
+
+# settings are saved a little after the last change, so a run of changes is
+# written once. the file is written to a temporary file that replaces the
+# settings file, whose last good copy is kept as a backup. the settings are
+# stored with a crc so a damaged file is found and the next copy used.
 
 SETTINGSFILE    = const("/settings.json")
+TEMPFILE        = const("/settings.tmp")
+BACKUPFILE      = const("/settings.bak")
+SAVEDELAY       = const(1000)
+
+FILEPREFIX      = const('{"crc": ')
+SETTINGSPREFIX  = const(', "settings": ')
+FILESUFFIX      = const("}")
 
 HOSTNAME        = const("hostname")
 SSID            = const("ssid")
@@ -9,10 +24,21 @@ PASSWORD        = const("password")
 
 settings = {}
 
+_keypaths = {}
+_dirty = False
+_saving = False
+_saveevent = asyncio.Event()
+
+def _keypath(key):
+    keys = _keypaths.get(key)
+    if keys is None:
+        keys = key.split(':')
+        _keypaths[key] = keys
+    return keys
+
 def getvalue(key, default=None):
-    keys = key.split(':')
     setting = settings
-    for k in keys:
+    for k in _keypath(key):
         if not isinstance(setting, dict) or k not in setting:
             return default
         setting = setting[k]
@@ -21,7 +47,7 @@ def getvalue(key, default=None):
     return value
 
 def _findsetting(key, create=False):
-    keys = key.split(":")
+    keys = _keypath(key)
     setting = settings
 
     for k in keys[:-1]:
@@ -38,32 +64,111 @@ def _findsetting(key, create=False):
     return setting, lastkey
 
 def setvalue(key, value):
+    global _dirty
+
     setting, settingkey = _findsetting(key, create=True)
-    setting[settingkey] = value
+    if settingkey not in setting or setting[settingkey] != value:
+        setting[settingkey] = value
+        _dirty = True
 
 def removevalue(key):
+    global _dirty
+
     try:
         setting, settingkey = _findsetting(key, create=False)
         if settingkey in setting:
             del setting[settingkey]
+            _dirty = True
     except KeyError:
         pass
 
 def initialize():
     load()
 
+# the settings in a file, or None if it's missing or damaged. files from
+# before the crc was added are plain settings.
+def _readfile(filename):
+    try:
+        with open(filename) as fp:
+            text = fp.read()
+    except OSError:
+        return None
+    try:
+        if not text.startswith(FILEPREFIX):
+            return json.loads(text)
+        crcend = text.index(SETTINGSPREFIX)
+        crc = int(text[len(FILEPREFIX):crcend])
+        data = text[crcend+len(SETTINGSPREFIX):-len(FILESUFFIX)]
+        if not text.endswith(FILESUFFIX) or crc16(0, data.encode()) != crc:
+            return None
+        return json.loads(data)
+    except ValueError:
+        return None
+
 def load():
-    global settings
+    global settings, _dirty
+
+    for filename in (SETTINGSFILE, TEMPFILE, BACKUPFILE):
+        loaded = _readfile(filename)
+        if isinstance(loaded, dict):
+            settings = loaded
+            if filename != SETTINGSFILE:
+                _dirty = True
+                flush()
+            return
+
+def _remove(filename):
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
 
+# writes the settings now if they've changed
+def flush():
+    global _dirty
+
+    if not _dirty:
+        return
+    _dirty = False
+    data = json.dumps(settings)
+    with open(TEMPFILE, "w") as fp:
+        fp.write(FILEPREFIX)
+        fp.write(str(crc16(0, data.encode())))
+        fp.write(SETTINGSPREFIX)
+        fp.write(data)
+        fp.write(FILESUFFIX)
+    _remove(BACKUPFILE)
     try:
-        with open(SETTINGSFILE) as fp:
-            settings = json.load(fp)
-    except:
+        os.rename(SETTINGSFILE, BACKUPFILE)
+    except OSError:
         pass
+    os.rename(TEMPFILE, SETTINGSFILE)
 
+# saves once there have been no changes for SAVEDELAY, or straight away
+# until the background save has been started
 def save():
-    with open(SETTINGSFILE, "w") as fp:
-        fp.write(json.dumps(settings))
+    if not _saving:
+        flush()
+    elif _dirty:
+        _saveevent.set()
+
+async def _save_task():
+    while True:
+        await _saveevent.wait()
+        _saveevent.clear()
+        while True:
+            try:
+                await asyncio.wait_for_ms(_saveevent.wait(), SAVEDELAY) # type: ignore
+                _saveevent.clear()
+            except asyncio.TimeoutError:
+                break
+        flush()
+
+def start_background_save():
+    global _saving
+
+    _saving = True
+    asyncio.create_task(_save_task())
 
 def gethostname():
     return getvalue(HOSTNAME, "zxprinter")
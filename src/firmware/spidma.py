@@ -0,0 +1,54 @@
+from micropython import const
+from machine import mem32
+from rp2 import DMA
+from system import isrp2350
+
+# moves blocks between an spi bus and memory with dma, so the cpu is free
+# while a block is clocked through. reading sends 0xff for every byte read,
+# writing throws away what's read back. see 4.4 in the RP2040 datasheet.
+
+SPI0_BASE       = const(0x40080000) if isrp2350 else const(0x4003c000)
+SPI1_BASE       = const(0x40088000) if isrp2350 else const(0x40040000)
+SSPDR           = const(0x008)
+SSPDMACR        = const(0x024)
+RXDMAE          = const(1<<0)
+TXDMAE          = const(1<<1)
+
+DREQ_SPI0_TX    = const(24) if isrp2350 else const(16)  # rx is tx+1, spi1 is spi0+2
+DMA_SIZE_BYTE   = const(0)
+
+class SPIDMA:
+    def __init__(self, bus):
+        base = SPI1_BASE if bus else SPI0_BASE
+        self.data = base + SSPDR
+        self.dmacr = base + SSPDMACR
+        dreqtx = DREQ_SPI0_TX + bus*2
+        self.txdma = DMA()
+        self.rxdma = DMA()
+        self.fill = bytearray(b"\xff")
+        self.discard = bytearray(1)
+        self.txfill = self.txdma.pack_ctrl(size=DMA_SIZE_BYTE, inc_read=False, inc_write=False, treq_sel=dreqtx)
+        self.txbuffer = self.txdma.pack_ctrl(size=DMA_SIZE_BYTE, inc_read=True, inc_write=False, treq_sel=dreqtx)
+        self.rxbuffer = self.rxdma.pack_ctrl(size=DMA_SIZE_BYTE, inc_read=False, inc_write=True, treq_sel=dreqtx+1)
+        self.rxdiscard = self.rxdma.pack_ctrl(size=DMA_SIZE_BYTE, inc_read=False, inc_write=False, treq_sel=dreqtx+1)
+
+    # the receive channel is started first so the rx fifo can't overflow
+    def startread(self, buf):
+        mem32[self.dmacr] = RXDMAE | TXDMAE
+        self.rxdma.config(read=self.data, write=buf, count=len(buf), ctrl=self.rxbuffer, trigger=True)
+        self.txdma.config(read=self.fill, write=self.data, count=len(buf), ctrl=self.txfill, trigger=True)
+
+    def startwrite(self, buf):
+        mem32[self.dmacr] = RXDMAE | TXDMAE
+        self.rxdma.config(read=self.data, write=self.discard, count=len(buf), ctrl=self.rxdiscard, trigger=True)
+        self.txdma.config(read=buf, write=self.data, count=len(buf), ctrl=self.txbuffer, trigger=True)
+
+    # the last byte has been received once the receive channel is done
+    def wait(self):
+        while self.rxdma.active():
+            pass
+        mem32[self.dmacr] = 0
+
+    def close(self):
+        self.txdma.close()
+        self.rxdma.close()
@@ -1,6 +1,7 @@
 import json
 import time
 import asyncio
+from micropython import const
 import network, ntptime
 from phew import server, logging
 from phew.server import redirect, Response, FileResponse
@@ -9,6 +10,11 @@ from system import logexception
 import services
 import settings
 import fileprinter
+import render
+import metrics
+from clientqueue import ClientQueue
+
+LOGQUEUELENGTH = const(32)
 
 class JsonResponse(Response):
     def __init__(self, body, content="application/json", status=200):
@@ -38,6 +44,9 @@ def initialize(p):
 
     connectedpixel = p
 
+    server.set_request_observer(lambda route, _, time: metrics.routelatency.observe(time, route))
+    server.set_garbage_collector(metrics.collectgarbage)
+
     with open("/files.json") as fp:
         files = json.load(fp)
         for file in files:
@@ -62,6 +71,48 @@ def storename(store):
 async def printouts(_, store):
     return JsonResponse(services.get_printouts(storename(store)))
 
+@server.route("/catalogue/<store>")
+async def catalogue(request, store):
+    query = request.query
+    try:
+        offset = int(query.get("offset", 0))
+        limit = int(query["limit"]) if "limit" in query else None
+        since = int(query["since"]) if "since" in query else None
+        return JsonResponse(services.list_printouts(storename(store), offset, limit, query.get("order", "name"), since))
+    except ValueError as ex:
+        raise BadRequest(str(ex))
+
+@server.route("/archive/<store>")
+async def archive(request, store):
+    names = request.query.get("names")
+    try:
+        tar = services.export_printouts(storename(store), names.split(",") if names else None)
+    except ValueError as ex:
+        raise BadRequest(str(ex))
+    return Response(tar.stream(), headers={
+        "Content-Type": "application/x-tar",
+        "Content-Length": tar.size,
+        "Content-Disposition": f"attachment; filename=\"printouts-{store}.tar\"",
+        "Access-Control-Allow-Origin": "*"
+    })
+
+@server.route("/render/<store>/<name>")
+async def renderprintout(request, store, name):
+    format = request.query.get("format", render.DEFAULTFORMAT).lower()
+    try:
+        scale = int(request.query.get("scale", 1))
+        image = await services.render_printout(storename(store), name, format, scale)
+    except ValueError as ex:
+        raise BadRequest(str(ex))
+    headers = {
+        "Access-Control-Allow-Origin": "*",
+        "Cache-Control": "max-age=86400"
+    }
+    if isinstance(image, str):
+        return FileResponse(image, headers=headers, onclose=lambda: render.release(image))
+    headers["Content-Type"] = render.contenttype(format)
+    return Response(image, headers=headers)
+
 @server.route("/printouts/<store>/<name>")
 async def printout(_, store, name):
     return JsonResponse(services.get_printout(storename(store), name))
@@ -70,6 +121,20 @@ async def printout(_, store, name):
 async def printoutdel(_, store, name):
     return JsonResponse(services.delete_printout(storename(store), name))
 
+@server.route("/printouts/<store>/<name>", methods=["PUT"])
+async def printoutupload(request, store, name):
+    length = request.content_length
+    if length is None:
+        return JsonResponse({
+            "error": "Content length required"
+        }, status=411)
+    logging.info(f"Uploading printout '{name}'")
+    try:
+        response = await services.upload_printout(storename(store), request.readinto, length)
+    except ValueError as ex:
+        raise BadRequest(str(ex))
+    return JsonResponse(response, status=201)
+
 @server.route("/printouts/<store>/<name>/printer", methods=["PUT", "POST"])
 async def printoutprint(_, store, name):
     return JsonResponse(services.print_printout(storename(store), name))
@@ -158,13 +223,78 @@ async def setprinterprotocol(_, value):
     return JsonResponse(services.setprinterprotocol(value))
 
 @server.route("/log")
-async def getlog(_):
-    return JsonResponse(services.getlogfile())
+async def getlog(request):
+    query = request.query
+    try:
+        tail = int(query["tail"]) if "tail" in query else None
+        since = int(query["since"]) if "since" in query else None
+    except ValueError as ex:
+        raise BadRequest(str(ex))
+    return JsonResponse(services.getlogfile(tail, since, query.get("level")))
+
+# new log entries as they're written, optionally only some levels
+@server.websocket("/log/live")
+async def livelog(websocket):
+    levels = websocket.query.get("level")
+    levels = None if levels is None else set(levels.lower().split(","))
+    queue = ClientQueue(websocket.send, LOGQUEUELENGTH, websocket.writer.close)
+    def listener(entry):
+        if levels is None or services.loglevel(entry.encode()) in levels:
+            queue.put(entry)
+    logging.add_listener(listener)
+    try:
+        while not queue.closed:
+            evt = await websocket.recv()
+            if evt is None or evt["type"] == "close":
+                break
+    finally:
+        logging.remove_listener(listener)
+        queue.close()
+
+@server.route("/metrics")
+async def getmetrics(_):
+    return Response(metrics.text(), headers={
+        "Content-Type": "text/plain; version=0.0.4",
+        "Cache-Control": "no-cache"
+    })
+
+@server.route("/trace")
+async def gettrace(_):
+    return JsonResponse(services.gettrace())
+
+@server.route("/trace/<state>", methods=["PUT"])
+async def settrace(_, state):
+    try:
+        return JsonResponse(services.settrace(state))
+    except ValueError as ex:
+        raise BadRequest(str(ex))
+
+@server.route("/benchmark")
+async def getbenchmarks(_):
+    return JsonResponse(services.getbenchmarks())
+
+# captures, protocols and ports are comma separated, all optional
+@server.route("/benchmark", methods=["POST"])
+async def runbenchmark(request):
+    query = request.query
+    try:
+        return JsonResponse(await services.runbenchmark(query.get("captures"), query.get("protocols"), query.get("ports")))
+    except ValueError as ex:
+        raise BadRequest(str(ex))
 
 @server.route("/sd")
 async def sdcard(_):
     return JsonResponse(services.getcardinfo())
 
+# blocks are comma separated block counts, size is in KB, both optional
+@server.route("/sd/benchmark", methods=["POST"])
+async def runsdbench(request):
+    query = request.query
+    try:
+        return JsonResponse(await services.runsdbench(query.get("blocks"), query.get("size")))
+    except ValueError as ex:
+        raise BadRequest(str(ex))
+
 @server.route("/about")
 async def getcardinfo(_):
     return JsonResponse(services.about())
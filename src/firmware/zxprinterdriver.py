@@ -6,6 +6,7 @@ from machine import Pin, mem32
 import time
 import asyncio
 from system import isrp2350
+from phew import trace
 
 # GPIO
 PORTRD          = const(6)
@@ -104,6 +105,8 @@ PORT = StateMachine(PORT_ID, port, freq=PORT_FREQ, in_base=PIXEL_ON, sideset_bas
 configpiostatus(PORT_ID, False, 2) # set status when RX FIFO reaches this level
 PORT.active(1)
 
+SPAN_ROWWAIT = trace.span("rowwait")
+
 rowbuf = bytearray(32)
 rowdma = DMA()
 
@@ -153,12 +156,15 @@ class RowServerAsync:
 
     async def __anext__(self):
         startdma()
+        trace.begin(SPAN_ROWWAIT)
         while isrunningdma():
             await asyncio.sleep_ms(0)
             if time.ticks_diff(time.ticks_ms(), self.lasttime) > self.timeout:
                 if self.started:
                     self.started = False
+                    trace.end(SPAN_ROWWAIT)
                     raise StopAsyncIteration
+        trace.end(SPAN_ROWWAIT)
         self.started = True
         self.lasttime = time.ticks_ms()
         return rowbuf
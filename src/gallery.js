@@ -1,6 +1,6 @@
 import { datauri } from "./datauri.js"
 import { bmp_mono } from "./jsbmp.js"
-import { execrequest, requests } from "./client.js"
+import { execrequest, requests, getrouteurl } from "./client.js"
 import { Mutex, addtooltip, updatetooltip } from "./utils.js"
 import { eventhandler } from "./event.js"
 import * as serial from "./serial.js"
@@ -33,6 +33,9 @@ const jsPDF = window.jspdf.jsPDF;
 
 const rendermutex = new Mutex();
 
+// formats the device renders itself, the others are rasterised here
+const deviceformats = ["bmp", "png"];
+
 class PrintItem {
     constructor(source, filename) {
         this.source = source;
@@ -120,6 +123,12 @@ function downloadimg(name, img) {
     download(getfilename(name, extension), img.src);
 }
 
+// images from the device are rasterised again, as a download needs a data uri
+async function downloadrendered(name, format) {
+    const bitmap = await getprintout(name);
+    download(getfilename(name, `.${format}`), rasterise(bitmap, format));
+}
+
 function downloadtxt(name, txt) {
     const text = txt.innerText;
     const blob = new Blob([text], {type: 'text/plain'});
@@ -208,6 +217,8 @@ function putimage(name, bitmap, format, imgsrc) {
             if (txtflip.dataset.flipped == "false") {
                 if (format === "cap") {
                     downloadcap(name, bitmap);
+                } else if (img.dataset.rendered) {
+                    downloadrendered(name, format);
                 } else {
                     downloadimg(name, img);
                 }
@@ -265,6 +276,19 @@ function putimage(name, bitmap, format, imgsrc) {
         paperelement.classList.add("zxpaper");
     }
 
+    if (imgsrc.startsWith("data:")) {
+        delete img.dataset.rendered;
+        img.onerror = null;
+    } else {
+        // fall back to rasterising here, as when the device can't do png
+        img.dataset.rendered = true;
+        img.onerror = async () => {
+            img.onerror = null;
+            const bitmap = await getprintout(name);
+            putimage(name, bitmap, format, rasterise(bitmap, format));
+        };
+    }
+
     try {
         img.src = imgsrc;
     } catch (e) {
@@ -273,7 +297,7 @@ function putimage(name, bitmap, format, imgsrc) {
     }
 }
 
-function rendercanvas(name, bitmap, format, mimetype) {
+function rendercanvas(bitmap, mimetype) {
     const scale = parseInt(document.getElementById("scale").value);
 
     const rowlength = 256;
@@ -320,10 +344,10 @@ function rendercanvas(name, bitmap, format, mimetype) {
     }
 
     context.putImageData(imageData, 0, 0);
-    putimage(name, bitmap, format, canvas.toDataURL(mimetype))
+    return canvas.toDataURL(mimetype);
 }
 
-function renderbmp(name, bitmap, format) {
+function renderbmp(bitmap) {
     const scale = parseInt(document.getElementById("scale").value);
 
     const rowlength = 256;
@@ -360,7 +384,27 @@ function renderbmp(name, bitmap, format) {
     const paper = document.querySelector("#paper input[type='radio']:checked").value;
     const papercolor = paper == "ts2040" ? "FFFFFF" : "C0C0C0";
     const content = bmp_mono(width, height, pixels, [papercolor, '000000']);
-    putimage(name, bitmap, format, datauri("image/bmp", content));
+    return datauri("image/bmp", content);
+}
+
+function rasterise(bitmap, format) {
+    switch(format) {
+        case "png":
+        case "cap":
+            return rendercanvas(bitmap, "image/png");
+        case "jpeg":
+            return rendercanvas(bitmap, "image/jpeg");
+        default:
+            return renderbmp(bitmap);
+    }
+}
+
+// thumbnails come straight from the device as ordinary, cacheable images
+// when it can be reached over the web
+function getrenderurl(name, format) {
+    if (!deviceformats.includes(format)) return null;
+    const scale = document.getElementById("scale").value;
+    return getrouteurl(`render/${getstorename()}/${encodeURIComponent(name)}`, { format: format, scale: scale });
 }
 
 let renderinprogress = 0;
@@ -382,18 +426,13 @@ async function renderall(clear = false) {
         names.sort();
         for(const name of names) {
             if (renderinprogress > 1) break;
-            const bitmap = await getprintout(name);
-            switch(format) {
-                case "png":
-                case "cap":
-                    rendercanvas(name, bitmap, format, "image/png");
-                    break;
-                case "jpeg":
-                    rendercanvas(name, bitmap, format, "image/jpeg");
-                    break;
-                default:
-                    renderbmp(name, bitmap, format);
+            const renderurl = getrenderurl(name, format);
+            if (renderurl) {
+                putimage(name, null, format, renderurl);
+                continue;
             }
+            const bitmap = await getprintout(name);
+            putimage(name, bitmap, format, rasterise(bitmap, format));
         }
     } catch(error) {
         console.error('Error:', error);
@@ -103,7 +103,7 @@ async function install() {
 
             if (installfiles.length > 0) {
                 if (isclean) {
-                    await repl.removedir("", ["printout", "sd", "settings.json"])
+                    await repl.removedir("", ["printout", "sd", "settings.json", "settings.bak"])
                 }
 
                 const todo = installfiles.length;